@@ -1,11 +1,32 @@
 #Importing necessary libraries
+import argparse
+import os
+import re
+import sys
+import time
+from functools import partial
 from mininet.net import Mininet # For mininet topo
-from mininet.node import RemoteController # For connecting to ONOS
+from mininet.node import RemoteController, OVSSwitch # For connecting to ONOS
 from mininet.topo import Topo
 from mininet.link import TCLink #Traffic-Control Link, can be used for bandwidth control and many more
 from mininet.cli import CLI
 from mininet.log import setLogLevel, info
 
+# The fabric compiler, the stand-in controller and the benchmark harness live in
+# ../vlan-routing. They are only imported by run() and the command line: mn --custom
+# execs this file without __file__ and just needs `topos`.
+# Returns (ovs_rules, traffic_bench, this topology in the fabric format).
+def vlan_routing_tools():
+    here = os.path.dirname(os.path.abspath(__file__))
+    tools = os.path.join(here, '..', 'vlan-routing')
+    if tools not in sys.path:
+        sys.path.insert(0, tools)
+    import ovs_rules
+    import traffic_bench
+    from fabric import load_fabric
+    # Same ports, MACs and IPs as RedundantVlanTopo
+    return ovs_rules, traffic_bench, load_fabric(os.path.join(here, 'fabric.json'))
+
 # Our topology will look like this
 """
         s0a - s0b (s0b will be s0a's replacement, in case s0a is down)
@@ -36,45 +57,115 @@ class RedundantVlanTopo(Topo):
 		sc1 = self.addSwitch('sc1', dpid='0000000000000005')
 
 		#Hosts (ha1, ha2, hb1, hb2, hc1, hc2)
-		ha1 = self.addHost('ha1', ip = '10.0.10.11/24')
-		ha2 = self.addHost('ha2', ip = '10.0.10.12/24')
-		hb1 = self.addHost('hb1', ip = '10.0.10.21/24')	
-		hb2 = self.addHost('hb2', ip = '10.0.10.22/24')
-		hc1 = self.addHost('hc1', ip = '10.0.10.31/24')
-		hc2 = self.addHost('hc2', ip = '10.0.10.32/24')
+		# Fixed MACs, the same as in fabric.json, so the compiled vlan-routing rules match them
+		ha1 = self.addHost('ha1', ip = '10.0.10.11/24', mac = '00:00:00:00:00:11')
+		ha2 = self.addHost('ha2', ip = '10.0.10.12/24', mac = '00:00:00:00:00:12')
+		hb1 = self.addHost('hb1', ip = '10.0.10.21/24', mac = '00:00:00:00:00:21')	
+		hb2 = self.addHost('hb2', ip = '10.0.10.22/24', mac = '00:00:00:00:00:22')
+		hc1 = self.addHost('hc1', ip = '10.0.10.31/24', mac = '00:00:00:00:00:31')
+		hc2 = self.addHost('hc2', ip = '10.0.10.32/24', mac = '00:00:00:00:00:32')
 		
 		#Main links
 		# Central switches links
-		self.addLink(s0a, s0b)#, cls = TCLink, bw = 100)
+		self.addLink(s0a, s0b, cls = TCLink, bw = 100)
 		# Central switch to branch switches
-		self.addLink(s0a, sa1)#, cls = TCLink, bw = 100)
-		self.addLink(s0a, sb1)#, cls = TCLink, bw = 100)
-		self.addLink(s0a, sc1)#, cls = TCLink, bw = 100)
+		self.addLink(s0a, sa1, cls = TCLink, bw = 100)
+		self.addLink(s0a, sb1, cls = TCLink, bw = 100)
+		self.addLink(s0a, sc1, cls = TCLink, bw = 100)
 		#sa1 to hosts
-		self.addLink(sa1, ha1)#, cls = TCLink, bw = 100)	
-		self.addLink(sa1, ha2)#, cls = TCLink, bw = 100)
+		self.addLink(sa1, ha1, cls = TCLink, bw = 100)	
+		self.addLink(sa1, ha2, cls = TCLink, bw = 100)
 		#sb1 to hosts
-		self.addLink(sb1, hb1)#, cls = TCLink, bw = 100)	
-		self.addLink(sb1, hb2)#, cls = TCLink, bw = 100)	
+		self.addLink(sb1, hb1, cls = TCLink, bw = 100)	
+		self.addLink(sb1, hb2, cls = TCLink, bw = 100)	
 		#sc1 to hosts
-		self.addLink(sc1, hc1)#, cls = TCLink, bw = 100)
-		self.addLink(sc1, hc2)#, cls = TCLink, bw = 100)
+		self.addLink(sc1, hc1, cls = TCLink, bw = 100)
+		self.addLink(sc1, hc2, cls = TCLink, bw = 100)
 		#Backup links
-		self.addLink(s0b, sa1)#, cls = TCLink, bw = 50)
-		self.addLink(s0b, sb1)#, cls = TCLink, bw = 50)
-		self.addLink(s0b, sc1)#, cls = TCLink, bw = 50)
+		self.addLink(s0b, sa1, cls = TCLink, bw = 50)
+		self.addLink(s0b, sb1, cls = TCLink, bw = 50)
+		self.addLink(s0b, sc1, cls = TCLink, bw = 50)
+
+# Cross-leaf pairs for the throughput test, each one crossing the spine layer
+IPERF_PAIRS = [('ha1', 'hb1'), ('ha2', 'hb2'), ('hb1', 'hc1'), ('hc2', 'ha2')]
+IPERF_RESULT = re.compile(r'\[SUM\].*?([\d.]+) Mbits/sec|^\[\s*\d+\].*?([\d.]+) Mbits/sec', re.M)
+
+# Static ARP between all hosts, so no ARP request has to go through the controller
+# (not needed when the rules were pushed with configure-onos-router.py --arp-proxy,
+# the leaves answer ARP themselves then)
+def set_static_arp(net):
+    for host in net.hosts:
+        for other in net.hosts:
+            if other is not host:
+                host.setARP(other.IP(), other.MAC())
+
+# Runs iperf between the IPERF_PAIRS at the same time and prints what each pair
+# and the whole fabric got. With plain rules every pair shares the 100 Mbit/s
+# links through s0a; with configure-onos-router.py --ecmp the leaves spread the
+# flows over s0a and s0b (+50 Mbit/s per leaf), which shows up in the total.
+def throughput_test(net, seconds, streams):
+    servers = [net.get(dst).popen(['iperf', '-s']) for dst in sorted({dst for _, dst in IPERF_PAIRS})]
+    time.sleep(1)
+    # Several parallel streams per pair, so the SELECT groups have more than one flow to hash
+    clients = [(src, dst, net.get(src).popen(['iperf', '-c', net.get(dst).IP(), '-t', str(seconds),
+                                               '-P', str(streams), '-f', 'm']))
+               for src, dst in IPERF_PAIRS]
+    total = 0.0
+    for src, dst, client in clients:
+        output, _ = client.communicate()
+        matches = IPERF_RESULT.findall(output.decode())
+        # With -P > 1 iperf prints a [SUM] line last, otherwise the single stream's line
+        rate = float(next(a or b for a, b in reversed(matches))) if matches else 0.0
+        total += rate
+        info(f'*** {src} -> {dst}: {rate:.1f} Mbits/sec\n')
+    for server in servers:
+        server.terminate()
+    info(f'*** Aggregate: {total:.1f} Mbits/sec over {len(clients)} pairs\n')
+    return total
 
 # This function will be used to run our defined topo
-def run():
+# bench: the parsed --bench options, runs traffic_bench instead of the CLI.
+# standin: no ONOS, fabric.json's rules are written into the switches directly.
+def run(iperf=None, streams=4, static_arp=True, standin=False, bench=None):
     setLogLevel('info') # Mostly for debugging
     topo = RedundantVlanTopo()
-    net = Mininet(topo=topo,controller=None,link=TCLink)
-    #c0 = net.addController('c0', controller = RemoteController, ip = '172.17.0.5', port = 6653)
+    measuring = iperf is not None or bench is not None
+    if standin:
+        net = Mininet(topo=topo, controller=None, link=TCLink,
+                      switch=partial(OVSSwitch, protocols='OpenFlow13', failMode='secure'))
+    elif not measuring:
+        net = Mininet(topo=topo,controller=None,link=TCLink)
+    else:
+        # The throughput test needs the rules from ONOS, so connect the switches to it
+        net = Mininet(topo=topo, controller=None, link=TCLink, switch=partial(OVSSwitch, protocols='OpenFlow13'))
+        net.addController('c0', controller = RemoteController, ip = '172.17.0.5', port = 6653)
+    ovs_rules, traffic_bench, fabric = vlan_routing_tools()
     net.start() # Starts it
-    info('*** Network is up\n')
-    CLI(net) # Opens the terminal for demo
-    net.stop() # Stops the topo, if terminal is closed
+    try:
+        if standin:
+            groups, flows = ovs_rules.install(net, fabric)
+            info(f'*** Stand-in controller installed {groups} groups and {flows} flows\n')
+        info('*** Network is up\n')
+        if measuring and static_arp:
+            set_static_arp(net)
+        if bench is not None:
+            traffic_bench.run_benchmark(net, fabric, bench, topology='TopoWithRedundancy')
+        elif iperf is not None:
+            throughput_test(net, iperf, streams)
+        else:
+            CLI(net) # Opens the terminal for demo
+    finally:
+        net.stop() # Stops the topo, if terminal is closed
 
 if __name__ == '__main__':
-    run()
+    parser = argparse.ArgumentParser(description="Redundant VLAN topology")
+    parser.add_argument("--iperf", type=int, nargs="?", const=10, metavar="SECONDS",
+                        help="run the cross-leaf iperf throughput test instead of the CLI")
+    parser.add_argument("--streams", type=int, default=4, help="parallel iperf streams per pair")
+    parser.add_argument("--arp-proxy", action="store_true",
+                        help="no static ARP for the iperf test, the leaves answer ARP (configure-onos-router.py --arp-proxy)")
+    vlan_routing_tools()[1].add_arguments(parser)
+    args = parser.parse_args()
+    run(args.iperf, args.streams, static_arp=not args.arp_proxy, standin=args.standin,
+        bench=args if args.bench else None)
 topos = { 'TopoWithRedundancy': ( lambda: RedundantVlanTopo() ) }
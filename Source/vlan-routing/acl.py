@@ -0,0 +1,279 @@
+import argparse
+import ipaddress
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+
+from fabric import load_fabric
+from flow_rules import build_acl_rule
+from onos_client import AUTH, OnosClient, add_onos_argument
+from provisioning import BATCH_SIZE, push_serial, report_results
+from rule_store import check_rules, print_findings
+
+# ACL policy compiler: turns allow/deny intents such as
+#   deny ping * -> hb2 except ha1
+# into a small set of prioritised drop/permit flows. Each flow sits on the leaf
+# of the hosts sending the traffic, so denied packets never cross the spine.
+
+TOPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'TopoWithRedundancy')
+POLICY_FILE = os.path.join(TOPO_DIR, 'acl.policy')
+ACL_FABRIC_FILE = os.path.join(TOPO_DIR, 'fabric.json')
+
+# Own appId, so configure-onos-router.py --reconcile (which owns onos_client.APP_ID)
+# never takes the ACL flows for stale routing rules
+ACL_APP_ID = 'vlan-acl'
+
+# Above the 40000/41000 pipeline rules. Each level of traffic class nesting
+# (ip > icmp > icmp/8) adds ACL_STEP, so a narrower class always wins.
+ACL_PRIORITY = 50000
+ACL_STEP = 1000
+
+PROTOCOLS = {"icmp": 1, "tcp": 6, "udp": 17}
+# protocol -> (criterion type, field) for the number after the slash
+SUBFIELDS = {"icmp": ("ICMPV4_TYPE", "icmpType"), "tcp": ("TCP_DST", "tcpPort"), "udp": ("UDP_DST", "udpPort")}
+ALIASES = {"ping": ("icmp", 8)}
+
+POLICY_LINE = re.compile(r'^(allow|deny)\s+(\S+)\s+(\S+)\s*->\s*(\S+)(?:\s+except\s+(\S+))?$')
+
+@dataclass
+class Policy:
+    action: str                 # 'allow' or 'deny'
+    traffic: tuple              # ('ip',), ('icmp',), ('icmp', 8), ('tcp', 80), ...
+    src: str                    # host name, prefix or *
+    dst: str
+    exceptions: str = ''        # source hosts/prefixes left out, comma-separated
+    line: int = 0
+
+# --- PARSING ---
+def parse_traffic(token):
+    if token in ALIASES:
+        return ALIASES[token]
+    proto, _, number = token.partition('/')
+    if proto != 'ip' and proto not in PROTOCOLS or (number and proto == 'ip'):
+        raise ValueError(f"unknown traffic class {token}")
+    return (proto, int(number)) if number else (proto,)
+
+def parse_policy(text):
+    policies = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.split('#')[0].strip()
+        if not line:
+            continue
+        match = POLICY_LINE.match(line)
+        if match is None:
+            raise ValueError(f"line {number}: cannot parse '{line}'")
+        action, traffic, src, dst, exceptions = match.groups()
+        policies.append(Policy(action, parse_traffic(traffic), src, dst,
+                               exceptions or '', number))
+    return policies
+
+def load_policy(path=POLICY_FILE):
+    with open(path) as f:
+        return parse_policy(f.read())
+
+# --- TRAFFIC CLASSES ---
+# ('tcp', 80) -> ('tcp',) -> ('ip',) -> None
+def parent_class(traffic):
+    if len(traffic) == 2:
+        return traffic[:1]
+    return None if traffic == ('ip',) else ('ip',)
+
+def class_depth(traffic):
+    return 0 if traffic == ('ip',) else len(traffic)
+
+def class_criteria(traffic):
+    criteria = [{"type": "ETH_TYPE", "ethType": "0x800"}]
+    if traffic[0] != 'ip':
+        criteria.append({"type": "IP_PROTO", "protocol": PROTOCOLS[traffic[0]]})
+    if len(traffic) == 2:
+        kind, name = SUBFIELDS[traffic[0]]
+        criteria.append({"type": kind, name: traffic[1]})
+    return criteria
+
+# Host names covered by a host name, an IP prefix, * or a comma-separated list of those
+def resolve(fabric, token):
+    if ',' in token:
+        return set().union(*(resolve(fabric, part) for part in token.split(',')))
+    if token == '*':
+        return set(fabric.hosts)
+    if token in fabric.hosts:
+        return {token}
+    try:
+        network = ipaddress.ip_network(token, strict=False)
+    except ValueError:
+        raise ValueError(f"unknown host or prefix {token}")
+    return {h.name for h in fabric.hosts.values() if ipaddress.ip_address(h.ip) in network}
+
+# First-match decision of every host pair for each traffic class used by the policy.
+# Only policies on the class itself or a wider one apply, so a 'tcp/80' rule
+# never decides plain 'tcp' traffic. Returns {class: {(src, dst): action}}.
+def decide(fabric, policies):
+    classes = {p.traffic for p in policies}
+    decisions = {}
+    for traffic in classes:
+        wider = {traffic}
+        parent = parent_class(traffic)
+        while parent:
+            wider.add(parent)
+            parent = parent_class(parent)
+        pairs = {}
+        for policy in policies:
+            if policy.traffic not in wider:
+                continue
+            excluded = resolve(fabric, policy.exceptions) if policy.exceptions else set()
+            dsts = resolve(fabric, policy.dst)
+            for src in resolve(fabric, policy.src) - excluded:
+                for dst in dsts:
+                    pairs.setdefault((src, dst), policy.action)
+        decisions[traffic] = pairs
+    return decisions
+
+# --- PREFIX COVER ---
+# Fewest prefixes covering every address in `include` and none in `exclude`
+# (addresses as ints). Walks the binary prefix trie from 0.0.0.0/0 down,
+# stopping as soon as a prefix only holds included addresses.
+def prefix_cover(include, exclude, network=0, length=0):
+    if not include:
+        return []
+    if not exclude:
+        return [ipaddress.ip_network((network, length))]
+    bit = 1 << (31 - length)
+    return (prefix_cover([a for a in include if not a & bit], [a for a in exclude if not a & bit], network, length + 1)
+            + prefix_cover([a for a in include if a & bit], [a for a in exclude if a & bit], network | bit, length + 1))
+
+# Parts of `networks` inside the fabric's VLAN subnets. prefix_cover() treats
+# addresses no host has as free to match, which could widen a deny to /0 and
+# drop traffic to or from the outside world; clipping keeps it to the fabric.
+def fabric_only(fabric, networks):
+    subnets = [ipaddress.ip_network(v.subnet, strict=False) for v in fabric.vlans.values()]
+    clipped = []
+    for network in networks:
+        if any(network.subnet_of(subnet) for subnet in subnets):
+            clipped.append(network)
+        else:
+            clipped += [subnet for subnet in subnets if subnet.subnet_of(network)]
+    return clipped
+
+# Rectangles (src prefixes x dst prefixes) covering every `needed` host pair
+# without touching a pair `allowed(src, dst)` refuses. Destinations needing the
+# same sources share a rectangle; the prefixes never leave the fabric's subnets.
+def cover_pairs(fabric, needed, allowed):
+    address = {name: int(ipaddress.ip_address(h.ip)) for name, h in fabric.hosts.items()}
+    by_dst = {}
+    for src, dst in needed:
+        by_dst.setdefault(dst, set()).add(src)
+    groups = {}
+    for dst, srcs in by_dst.items():
+        groups.setdefault(frozenset(srcs), []).append(dst)
+    rectangles = []
+    for srcs, dsts in groups.items():
+        blocked = [address[h] for h in fabric.hosts if h not in srcs and not all(allowed(h, d) for d in dsts)]
+        src_nets = fabric_only(fabric, prefix_cover([address[s] for s in srcs], blocked))
+        covered = [h for h in fabric.hosts if any(ipaddress.ip_address(address[h]) in n for n in src_nets)]
+        blocked = [address[h] for h in fabric.hosts if h not in dsts and not all(allowed(s, h) for s in covered)]
+        dst_nets = fabric_only(fabric, prefix_cover([address[d] for d in dsts], blocked))
+        rectangles += [(s, d) for s in src_nets for d in dst_nets]
+    return rectangles
+
+def prefix_criteria(kind, network):
+    # 0.0.0.0/0 matches anything, so leave the field out
+    return [] if network.prefixlen == 0 else [{"type": kind, "ip": str(network)}]
+
+
+# --- COMPILER ---
+# Per traffic class (widest first) and per leaf:
+#   deny flows for local senders whose traffic the wider class lets through,
+#   permit flows where a narrower class re-allows what the wider one denies.
+# A deny may also match hosts on other leaves when that can't change their
+# outcome, which lets one prefix stand in for many hosts. A permit hands the
+# packet back to the pipeline (VLAN push, table 1), so it matches the sender's
+# port like the ingress rule does and never sees tagged traffic from a spine.
+def compile_acl(fabric, policies):
+    decisions = decide(fabric, policies)
+    classes = sorted(decisions, key=class_depth)
+    address = {name: int(ipaddress.ip_address(h.ip)) for name, h in fabric.hosts.items()}
+
+    def decision(traffic, src, dst):
+        while traffic is not None and traffic not in decisions:
+            traffic = parent_class(traffic)
+        return 'allow' if traffic is None else decisions[traffic].get((src, dst), 'allow')
+
+    def narrower(traffic):
+        return [t for t in classes if t != traffic and (traffic == ('ip',) or len(traffic) == 1 and t[0] == traffic[0])]
+
+    flows = []
+    for traffic in classes:
+        parent = parent_class(traffic)
+        inner = narrower(traffic)
+        priority = ACL_PRIORITY + ACL_STEP * class_depth(traffic)
+        for leaf in fabric.leaves():
+            local = [h for h in fabric.hosts.values() if h.switch == leaf.name]
+            local_names = {h.name for h in local}
+
+            # Deny: remote senders may only be matched if every narrower class denies them too
+            def deny_ok(src, dst):
+                if src == dst:
+                    return True
+                if decision(traffic, src, dst) != 'deny':
+                    return False
+                return src in local_names or all(decision(t, src, dst) == 'deny' for t in inner)
+            needed = {(s.name, d) for s in local for d in fabric.hosts if d != s.name
+                      and decision(traffic, s.name, d) == 'deny' and decision(parent, s.name, d) == 'allow'}
+            for src_net, dst_net in cover_pairs(fabric, needed, deny_ok):
+                criteria = class_criteria(traffic) + prefix_criteria("IPV4_SRC", src_net) + prefix_criteria("IPV4_DST", dst_net)
+                flows.append(build_acl_rule(leaf.device_id, priority, criteria))
+
+            # Permit: per sender port, destination prefixes that skip every host this class denies
+            for host in local:
+                dsts = [address[d] for d in fabric.hosts if d != host.name
+                        and decision(traffic, host.name, d) == 'allow' and decision(parent, host.name, d) == 'deny']
+                blocked = [address[d] for d in fabric.hosts if decision(traffic, host.name, d) == 'deny']
+                for dst_net in prefix_cover(dsts, blocked):
+                    criteria = ([{"type": "IN_PORT", "port": host.port}] + class_criteria(traffic)
+                                + prefix_criteria("IPV4_DST", dst_net))
+                    flows.append(build_acl_rule(leaf.device_id, priority, criteria, vlan_id=host.vlan))
+    return flows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile an allow/deny policy into ACL flows and push them in bulk")
+    parser.add_argument("policy", nargs="?", default=POLICY_FILE, help="policy file, one rule per line")
+    parser.add_argument("--fabric", default=ACL_FABRIC_FILE, help="fabric description (JSON or YAML)")
+    parser.add_argument("--output", help="write the flows as a bulk {\"flows\": [...]} body to this file")
+    parser.add_argument("--dry-run", action="store_true", help="print the flows without pushing them")
+    parser.add_argument("--force", action="store_true",
+                        help="push even if the rule check finds shadowed or conflicting rules")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    add_onos_argument(parser)
+    args = parser.parse_args()
+
+    fabric = load_fabric(args.fabric)
+    policies = load_policy(args.policy)
+    start = time.perf_counter()
+    flows = compile_acl(fabric, policies)
+    print(f"Compiled {len(policies)} policy rules into {len(flows)} flows "
+          f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for flow in flows:
+        action = "drop" if not flow["treatment"]["instructions"] else f"vlan {flow['treatment']['instructions'][1]['vlanId']}, table 1"
+        matches = ", ".join(f"{c['type']}={next(v for k, v in c.items() if k != 'type')}" for c in flow["selector"]["criteria"])
+        print(f" {flow['deviceId']} prio {flow['priority']} [{matches}] -> {action}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"flows": flows}, f, indent=2)
+        print(f"Flows written to {args.output}")
+
+    _, findings = check_rules(flows)
+    print_findings(findings)
+    if args.dry_run:
+        raise SystemExit(0)
+    if any(finding.is_error for finding in findings) and not args.force:
+        raise SystemExit("Rule check failed, fix the policy or pass --force")
+
+    with OnosClient(*args.onos, AUTH, app_id=ACL_APP_ID) as client:
+        results = push_serial(client, flows, args.batch_size)
+    report_results(results)
+    installed = sum(len(ok) for ok, _ in results.values())
+    failed = sum(len(bad) for _, bad in results.values())
+    print(f"Installed {installed} ACL flows, {failed} failed")
@@ -0,0 +1,56 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+from mock_onos import MockOnos
+from onos_async import AsyncOnosClient
+from onos_client import AUTH
+
+# Load test of AsyncOnosClient against a local stand-in ONOS that takes --latency
+# seconds per request: throughput and per-rule latency percentiles (including the
+# time spent waiting for an in-flight slot) for each in-flight limit.
+
+DEVICE_ID = 'of:0000000000000003'
+
+def make_rule(i):
+    return {
+        "priority": 40000, "isPermanent": True, "deviceId": DEVICE_ID, "tableId": 0,
+        "selector": { "criteria": [ {"type": "IN_PORT", "port": i} ] },
+        "treatment": { "instructions": [ {"type": "TABLE", "tableId": 1} ] }
+    }
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+async def timed_post(client, rule, latencies):
+    start = time.perf_counter()
+    status, _ = await client.post_flow(rule["deviceId"], rule)
+    latencies.append(time.perf_counter() - start)
+    return status
+
+async def run_load(ip, port, rules, max_in_flight):
+    latencies = []
+    async with AsyncOnosClient(ip, port, AUTH, max_in_flight=max_in_flight) as client:
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*(timed_post(client, rule, latencies) for rule in rules))
+        elapsed = time.perf_counter() - start
+    failed = sum(1 for status in statuses if status not in (200, 201))
+    return elapsed, sorted(latencies), failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency percentiles of AsyncOnosClient per in-flight limit")
+    parser.add_argument("-n", "--requests", type=int, default=1000, help="flow POSTs per run")
+    parser.add_argument("--latency", type=float, default=0.005, help="mock ONOS answer time in seconds")
+    parser.add_argument("--limits", type=int, nargs="+", default=[1, 4, 16, 64], help="in-flight limits to test")
+    args = parser.parse_args()
+
+    rules = [make_rule(i) for i in range(args.requests)]
+    with MockOnos(latency=args.latency) as mock:
+        ip, port = mock.address
+        print(f"{'in-flight':>9} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'failed':>6}")
+        for limit in args.limits:
+            elapsed, latencies, failed = asyncio.run(run_load(ip, port, rules, limit))
+            ms = [l * 1000 for l in latencies]
+            print(f"{limit:>9} {len(rules) / elapsed:>8.0f} {statistics.median(ms):>8.1f} "
+                  f"{percentile(ms, 90):>8.1f} {percentile(ms, 99):>8.1f} {ms[-1]:>8.1f} {failed:>6}")
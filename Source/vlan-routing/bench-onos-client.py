@@ -0,0 +1,45 @@
+import argparse
+import json
+import time
+
+import requests
+
+from mock_onos import MockOnos
+from onos_client import AUTH, OnosClient
+
+# Requests per second against a local stand-in ONOS:
+# one requests.post per flow (the old send_flow) vs the pooled OnosClient session.
+
+DEVICE_ID = 'of:0000000000000003'
+
+def make_rule(i):
+    return {
+        "priority": 40000, "isPermanent": True, "deviceId": DEVICE_ID, "tableId": 0,
+        "selector": { "criteria": [ {"type": "IN_PORT", "port": i} ] },
+        "treatment": { "instructions": [ {"type": "TABLE", "tableId": 1} ] }
+    }
+
+def bench_unpooled(ip, port, n):
+    url = f'http://{ip}:{port}/onos/v1/flows/{DEVICE_ID}'
+    start = time.perf_counter()
+    for i in range(n):
+        requests.post(url, auth=AUTH, data=json.dumps(make_rule(i)), headers={'Content-Type': 'application/json'})
+    return time.perf_counter() - start
+
+def bench_pooled(ip, port, n):
+    with OnosClient(ip, port, AUTH) as client:
+        start = time.perf_counter()
+        for i in range(n):
+            client.post_flow(DEVICE_ID, make_rule(i))
+        return time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pooled vs per-call ONOS REST requests")
+    parser.add_argument("-n", "--requests", type=int, default=2000, help="flow POSTs per client")
+    args = parser.parse_args()
+
+    with MockOnos() as mock:
+        ip, port = mock.address
+        for label, bench in (("requests.post (no pool)", bench_unpooled), ("OnosClient (pooled)", bench_pooled)):
+            elapsed = bench(ip, port, args.requests)
+            print(f"{label:<26} {args.requests} requests in {elapsed:.2f}s -> {args.requests / elapsed:.0f} req/s")
@@ -0,0 +1,118 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+
+from fabric import compile_rules, generate_fabric
+from flow_rules import unique_rules
+from metrics import METRICS
+from mock_onos import MockOnos
+from onos_client import AUTH, OnosClient
+from provisioning import BATCH_SIZE, WORKERS, push_parallel, push_serial, push_specs
+from rule_templates import SPEC_BUILDERS, unique_specs
+
+# End-to-end provisioning benchmark: compile the rules for synthetic leaf-spine
+# fabrics of growing size and push them to a local mock ONOS (with optional
+# latency / error injection). Results can be saved as JSON and compared against
+# a run from another commit with --compare.
+
+# leaves:hosts_per_leaf -> 6, 100, 500 and 1000 hosts
+DEFAULT_SIZES = ['3:2', '10:10', '25:20', '50:20']
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_size(leaves, hosts_per_leaf, args):
+    fabric = generate_fabric(spines=args.spines, leaves=leaves, hosts_per_leaf=hosts_per_leaf)
+    METRICS.reset()
+    with MockOnos(latency=args.latency, error_rate=args.error_rate) as mock:
+        ip, port = mock.address
+        with OnosClient(ip, port, AUTH, pool_size=max(10, args.workers)) as client:
+            start = time.perf_counter()
+            if args.templates:
+                rules, duplicates = unique_specs(compile_rules(fabric, builders=SPEC_BUILDERS))
+            else:
+                rules, duplicates = unique_rules(compile_rules(fabric, aggregate=args.aggregate))
+            compiled = time.perf_counter()
+            if args.templates:
+                results = push_specs(client, rules, args.batch_size)
+            elif args.parallel:
+                results = push_parallel(client, rules, args.batch_size, args.workers)
+            else:
+                results = push_serial(client, rules, args.batch_size)
+            done = time.perf_counter()
+        stats = mock.stats
+    wall = done - start
+    return {
+        "leaves": leaves,
+        "hosts": len(fabric.hosts),
+        "rules": len(rules),
+        "duplicates_dropped": duplicates,
+        "compile_s": round(compiled - start, 4),
+        "push_s": round(done - compiled, 4),
+        "wall_s": round(wall, 4),
+        "requests": stats["requests"],
+        "bytes_sent": stats["bytes_received"],
+        "errors_injected": stats["errors_injected"],
+        "failed_rules": sum(len(failed) for _, failed in results.values()),
+        "rules_per_s": round(len(rules) / wall, 1),
+        # Where the push time went: our serialise/response code vs the HTTP round trips
+        "phases_s": {phase: s["total_s"] for phase, s in METRICS.snapshot()["phases"].items()},
+    }
+
+def print_row(row, baseline=None):
+    line = (f"{row['leaves']:>6} {row['hosts']:>6} {row['rules']:>9} {row['compile_s']:>9.3f} "
+            f"{row['push_s']:>8.3f} {row['wall_s']:>8.3f} {row['requests']:>8} "
+            f"{row['bytes_sent'] / 1e6:>9.2f} {row['rules_per_s']:>9.0f} {row['failed_rules']:>6}")
+    if baseline:
+        line += f"  wall x{row['wall_s'] / baseline['wall_s']:.2f}"
+    print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark rule compilation and push against a mock ONOS")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES,
+                        help="fabric sizes as leaves:hosts_per_leaf (e.g. 200:25 for 5000 hosts)")
+    parser.add_argument("--spines", type=int, default=1)
+    parser.add_argument("--aggregate", action="store_true", help="compile with per-subnet L3 prefix routes")
+    parser.add_argument("--parallel", action="store_true", help="push each device's rules concurrently")
+    parser.add_argument("--templates", action="store_true",
+                        help="compile to rule_templates specs and render the bodies from them (serial push, no --aggregate)")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--latency", type=float, default=0.0, help="mock ONOS answer time in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failed with 503")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare wall times against")
+    args = parser.parse_args()
+    if args.templates and (args.aggregate or args.parallel):
+        parser.error("--templates pushes serially without prefix routes, drop --aggregate/--parallel")
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(r["leaves"], r["hosts"]): r for r in json.load(f)["results"]}
+
+    print(f"{'leaves':>6} {'hosts':>6} {'rules':>9} {'compile s':>9} {'push s':>8} {'wall s':>8} "
+          f"{'requests':>8} {'MB sent':>9} {'rules/s':>9} {'failed':>6}")
+    rows = []
+    for size in args.sizes:
+        leaves, hosts_per_leaf = (int(x) for x in size.split(':'))
+        row = run_size(leaves, hosts_per_leaf, args)
+        print_row(row, baseline.get((row["leaves"], row["hosts"])))
+        rows.append(row)
+
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "settings": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "results": rows,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
@@ -0,0 +1,88 @@
+import argparse
+import gc
+import json
+import platform
+import time
+import tracemalloc
+
+from fabric import compile_rules, generate_fabric
+from flow_rules import unique_rules
+from provisioning import BATCH_SIZE
+from rule_templates import SPEC_BUILDERS, orjson, render_body, unique_specs
+
+# Rule generation microbenchmark: compile a synthetic fabric (about a million
+# generated rules by default) and serialise every unique rule into bulk
+# POST /onos/v1/flows bodies, with
+#   dicts      the flow_rules.py builders + json.dumps per body (the old path)
+#   orjson     the same dicts, serialised with orjson (when installed)
+#   templates  rule_templates specs rendered straight into the body text
+# and report rules/s and the peak Python heap (tracemalloc) of each path.
+# Nothing is sent anywhere; bench-provisioning.py --templates covers the push.
+
+def dict_bodies(fabric, batch_size, dumps):
+    rules, _ = unique_rules(compile_rules(fabric))
+    bodies = [dumps({"flows": rules[i:i + batch_size]}) for i in range(0, len(rules), batch_size)]
+    return len(rules), bodies
+
+def template_bodies(fabric, batch_size):
+    specs, _ = unique_specs(compile_rules(fabric, builders=SPEC_BUILDERS))
+    bodies = [render_body(specs[i:i + batch_size]) for i in range(0, len(specs), batch_size)]
+    return len(specs), bodies
+
+# (seconds, rules, body bytes, peak bytes or None). Timed without tracemalloc,
+# which slows allocation-heavy code down a lot; the peak comes from a second run.
+def measure(run, memory):
+    gc.collect()
+    start = time.perf_counter()
+    rules, bodies = run()
+    seconds = time.perf_counter() - start
+    size = sum(len(body) for body in bodies)
+    del bodies
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        result = run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del result
+    return seconds, rules, size, peak
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark rule generation + serialisation: dicts vs precompiled templates")
+    parser.add_argument("--spines", type=int, default=2)
+    parser.add_argument("--leaves", type=int, default=150)
+    parser.add_argument("--hosts-per-leaf", type=int, default=8)
+    parser.add_argument("--vlans", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--paths", nargs="+", default=["dicts", "orjson", "templates"],
+                        choices=["dicts", "orjson", "templates"])
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run (halves the time)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    fabric = generate_fabric(spines=args.spines, leaves=args.leaves, hosts_per_leaf=args.hosts_per_leaf, vlans=args.vlans)
+    generated = len(compile_rules(fabric, builders=SPEC_BUILDERS))
+    print(f"{len(fabric.hosts)} hosts on {len(fabric.switches)} switches, {generated} rules generated")
+
+    runs = {
+        "dicts": lambda: dict_bodies(fabric, args.batch_size, json.dumps),
+        "orjson": lambda: dict_bodies(fabric, args.batch_size, lambda body: orjson.dumps(body).decode()),
+        "templates": lambda: template_bodies(fabric, args.batch_size),
+    }
+    print(f"{'path':<10} {'rules':>8} {'seconds':>8} {'rules/s':>10} {'MB out':>8} {'peak MB':>8}")
+    rows = []
+    for path in args.paths:
+        if path == "orjson" and orjson is None:
+            print(f"{path:<10} skipped, orjson is not installed")
+            continue
+        seconds, rules, size, peak = measure(runs[path], not args.no_memory)
+        rows.append({"path": path, "rules": rules, "generated": generated, "seconds": round(seconds, 3),
+                     "rules_per_s": round(rules / seconds), "body_bytes": size, "peak_bytes": peak})
+        print(f"{path:<10} {rules:>8} {seconds:>8.2f} {rules / seconds:>10.0f} {size / 1e6:>8.1f} "
+              + (f"{peak / 1e6:>8.1f}" if peak is not None else f"{'-':>8}"))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"python": platform.python_version(), "settings": vars(args), "results": rows}, f, indent=2)
+        print(f"Results written to {args.output}")
@@ -1,672 +1,234 @@
-import requests
+import argparse
 import json
-
-# Configuration
-ONOS_IP = '172.17.0.5'
-ONOS_PORT = '8181'
-AUTH = ('onos', 'rocks') 
-# Define Device IDs
-DEV_HA1 = '00:00:00:00:01:01'
-DEV_HA2 = '00:00:00:00:02:01'
-DEV_HB1 = '00:00:00:00:01:02'
-DEV_HB2 = '00:00:00:00:02:02'
-DEV_HC1 = '00:00:00:00:01:03'
-DEV_HC2 = '00:00:00:00:02:03'
-
-DEV_SA1 = 'of:0000000000000003'
-DEV_SB1 = 'of:0000000000000004'
-DEV_SC1 = 'of:0000000000000005'
-DEV_S0A = 'of:0000000000000001' # The Spine
-ROUTER_MAC = '00:00:00:00:00:99'
-
-headers = {
-    'Content-Type': 'application/json',
-    'Accept': 'application/json'
-}
+import time
+
+from discovery import CACHE_FILE, TTL, live_fabric
+from fabric import FABRIC_FILE, compile_ecmp, compile_failover, compile_rules, load_fabric
+from flow_rules import describe_rule, rule_key, treatment_key, unique_rules
+from flowsim import FlowSimulator, print_ambiguous
+from reconcile import apply_deletes, delete_groups, plan_groups, plan_reconcile, print_group_plan, print_plan
+from rule_store import check_rules, print_findings
+from snapshot import build_snapshot, save_snapshot
+from metrics import METRICS
+from onos_client import AUTH, OnosClient, add_onos_argument
+from paths import compile_paths
+from provisioning import (
+    BATCH_SIZE, WORKERS, group_by_device, push_groups, push_parallel, push_serial, report_groups, report_results
+)
+
+# Rules queued by send_flow(), pushed in bulk by flush_flows()
+pending_flows = []
+# rule_key() -> rule, so the spine and destination-leaf rules that every
+# L2/L3 path re-emits are only queued once
+queued_keys = {}
+duplicates_dropped = 0
 
 def send_flow(device_id, flow_data):
-    url = f'http://{ONOS_IP}:{ONOS_PORT}/onos/v1/flows/{device_id}'
-    response = requests.post(url, auth=AUTH, data=json.dumps(flow_data), headers={'Content-Type': 'application/json'})
-    if response.status_code not in [200, 201]:
-        print(f" [FAIL] {device_id} Error: {response.text}")
-
-# --- 1. INGRESS RULE (Table 0 -> Table 1) ---
-# "If packet comes in Port X, push VLAN Y, and go to Table 1"
-def provision_ingress_rule(device_id, host_port, vlan_id):
-    print(f"Configuring Ingress for Port {host_port} on VLAN {vlan_id}...")
-    rule = {
-        "priority": 40000, "isPermanent": True, "deviceId": device_id, "tableId": 0,
-        "selector": { 
-            "criteria": [ {"type": "IN_PORT", "port": host_port} ] 
-        },
-        "treatment": { "instructions": [
-            {"type": "L2MODIFICATION", "subtype": "VLAN_PUSH"},
-            {"type": "L2MODIFICATION", "subtype": "VLAN_ID", "vlanId": vlan_id},
-            {"type": "TABLE", "tableId": 1}
-        ]}
-    }
-    send_flow(device_id, rule)
-
-# --- 2. INTRA-SWITCH ROUTE (Table 1 -> Output) ---
-# "If Dest IP is Local, rewrite MACs and deliver"
-def provision_intra_switch_route(
-    name,
-    device_id,
-    src_vlan,
-    dst_ip,        # Target IP (e.g., 10.0.20.11/32)
-    dst_mac,       # Target MAC (e.g., 00:00...02:01)
-    dst_vlan,      # Target VLAN (e.g., 20)
-    out_port       # Target Port (e.g., 3)
-):
-    print(f"Configuring Local Route: {name}...")
-    rule = {
-        "priority": 40000, "isPermanent": True, "deviceId": device_id, "tableId": 1,
-        "selector": {
-            "criteria": [
-                {"type": "IPV4_DST", "ip": dst_ip},
-                {"type": "ETH_TYPE", "ethType": "0x0800"},
-                {"type": "VLAN_VID", "vlanId": src_vlan}
-            ]
-        },
-        "treatment": { "instructions": [
-            # 1. Rewrite DST MAC to Host MAC
-            {"type": "L2MODIFICATION", "subtype": "ETH_DST", "mac": dst_mac},
-            # 2. Rewrite SRC MAC to Router MAC (Gateway)
-            {"type": "L2MODIFICATION", "subtype": "ETH_SRC", "mac": ROUTER_MAC},
-            # 3. Change VLAN ID to Target VLAN
-            {"type": "L2MODIFICATION", "subtype": "VLAN_ID", "vlanId": dst_vlan},
-            # 4. Pop VLAN (Host expects untagged)
-            {"type": "L2MODIFICATION", "subtype": "VLAN_POP"},
-            # 5. Output to Host Port
-            {"type": "OUTPUT", "port": out_port}
-        ]}
-    }
-    send_flow(device_id, rule)
-
-# --- 3. L2 INTER-SWITCH FORWARDING (Same Subnet, Different Switch) ---
-def provision_l2_remote_forwarding(
-    name,
-    src_leaf_id,
-    dst_leaf_id,
-    spine_id,
-    dst_mac,         # The actual Host MAC
-    vlan_id,         # The shared VLAN (e.g., 10)
-    src_uplink,      # Port on Src Leaf -> Spine
-    spine_downlink,  # Port on Spine -> Dst Leaf
-    dst_host_port    # Port on Dst Leaf -> Host
-):
-    print(f"--- Provisioning L2 Path (Bridging): {name} ---")
-
-    # 1. SRC LEAF: Bridge to Spine
-    # STRICTNESS: Match specific Host MAC and VLAN. 
-    # Do NOT match Router MAC here.
-    rule_src = {
-        "priority": 40000, "isPermanent": True, "deviceId": src_leaf_id, "tableId": 1,
-        "selector": {
-            "criteria": [
-                {"type": "ETH_DST", "mac": dst_mac},
-                {"type": "VLAN_VID", "vlanId": vlan_id}
-            ]
-        },
-        "treatment": { "instructions": [
-            {"type": "OUTPUT", "port": src_uplink}
-        ]}
-    }
-    send_flow(src_leaf_id, rule_src)
-
-    # 2. SPINE: Forward to Destination Leaf
-    # Spine acts as a transparent L2 bridge based on MAC
-    rule_spine = {
-        "priority": 40000, "isPermanent": True, "deviceId": spine_id, "tableId": 0,
-        "selector": {
-            "criteria": [ {"type": "ETH_DST", "mac": dst_mac} ]
-        },
-        "treatment": { "instructions": [
-            {"type": "OUTPUT", "port": spine_downlink}
-        ]}
-    }
-    send_flow(spine_id, rule_spine)
-
-    # 3. DST LEAF: Deliver to Host
-    rule_dst = {
-        "priority": 40000, "isPermanent": True, "deviceId": dst_leaf_id, "tableId": 0,
-        "selector": {
-            "criteria": [
-                {"type": "ETH_DST", "mac": dst_mac},
-                {"type": "VLAN_VID", "vlanId": vlan_id}
-            ]
-        },
-        "treatment": { "instructions": [
-            {"type": "L2MODIFICATION", "subtype": "VLAN_POP"},
-            {"type": "OUTPUT", "port": dst_host_port}
-        ]}
-    }
-    send_flow(dst_leaf_id, rule_dst)
-
-
-# --- 4. L3 INTER-SWITCH ROUTING (Different Subnet, Different Switch) ---
-def provision_l3_remote_routing(
-    name,
-    src_leaf_id,
-    dst_leaf_id,
-    spine_id,
-    src_vlan,        # VLAN where packet originates (e.g., 10)
-    dst_vlan,        # VLAN where packet is going (e.g., 20)
-    dst_ip,          # Specific Dest IP (e.g., 10.0.20.12/32)
-    dst_mac,         # Final Host MAC
-    src_uplink,      # Port on Src Leaf -> Spine
-    spine_downlink,  # Port on Spine -> Dst Leaf
-    dst_host_port    # Port on Dst Leaf -> Host
-):
-    print(f"--- Provisioning L3 Path (Routing): {name} ---")
-
-    # 1. SRC LEAF: Route to Spine
-    # STRICTNESS: Must match ETH_DST == ROUTER_MAC (00:00:00:00:00:99)
-    # This distinguishes this flow from L2 bridging.
-    rule_src = {
-        "priority": 41000, # Higher priority than generic matches
-        "isPermanent": True, "deviceId": src_leaf_id, "tableId": 1,
-        "selector": {
-            "criteria": [
-                {"type": "ETH_DST", "mac": ROUTER_MAC},
-                {"type": "IPV4_DST", "ip": dst_ip},
-                {"type": "ETH_TYPE", "ethType": "0x0800"},
-                {"type": "VLAN_VID", "vlanId": src_vlan}
-            ]
-        },
-        "treatment": { "instructions": [
-            # Rewrite Headers
-            {"type": "L2MODIFICATION", "subtype": "ETH_SRC", "mac": ROUTER_MAC},
-            {"type": "L2MODIFICATION", "subtype": "ETH_DST", "mac": dst_mac},
-            {"type": "L2MODIFICATION", "subtype": "VLAN_ID", "vlanId": dst_vlan},
-            # Forward Up
-            {"type": "OUTPUT", "port": src_uplink}
-        ]}
-    }
-    send_flow(src_leaf_id, rule_src)
-
-    # 2. SPINE: Forward to Destination Leaf
-    # Note: The packet now has the Final Host MAC (rewritten by Src Leaf)
-    rule_spine = {
-        "priority": 40000, "isPermanent": True, "deviceId": spine_id, "tableId": 0,
-        "selector": {
-            "criteria": [ {"type": "ETH_DST", "mac": dst_mac} ]
-        },
-        "treatment": { "instructions": [
-            {"type": "OUTPUT", "port": spine_downlink}
-        ]}
-    }
-    send_flow(spine_id, rule_spine)
-
-    # 3. DST LEAF: Deliver to Host
-    # Note: The packet arrives with dst_vlan and dst_mac
-    rule_dst = {
-        "priority": 40000, "isPermanent": True, "deviceId": dst_leaf_id, "tableId": 0,
-        "selector": {
-            "criteria": [
-                {"type": "ETH_DST", "mac": dst_mac},
-                {"type": "VLAN_VID", "vlanId": dst_vlan}
-            ]
-        },
-        "treatment": { "instructions": [
-            {"type": "L2MODIFICATION", "subtype": "VLAN_POP"},
-            {"type": "OUTPUT", "port": dst_host_port}
-        ]}
-    }
-    send_flow(dst_leaf_id, rule_dst)
-
-# Essential to keep the pipeline flowing if ARP requests happen
-def provision_arp_punt(device_id):
-    print(f"Configuring ARP Punt on {device_id}...")
-    rule = {
-        "priority": 41000, "isPermanent": True, "deviceId": device_id, "tableId": 1,
-        "selector": {
-            "criteria": [ {"type": "ETH_TYPE", "ethType": "0x0806"} ]
-        },
-        "treatment": { "instructions": [
-            {"type": "OUTPUT", "port": "CONTROLLER"}
-        ]}
-    }
-    send_flow(device_id, rule)
+    global duplicates_dropped
+    flow_data["deviceId"] = device_id
+    key = rule_key(flow_data)
+    if key in queued_keys:
+        duplicates_dropped += 1
+        if treatment_key(queued_keys[key]) != treatment_key(flow_data):
+            METRICS.event("duplicate_conflict",
+                          f" [WARN] {describe_rule(flow_data)} already queued with a different treatment, keeping the first",
+                          detail=True, device=device_id, rule=describe_rule(flow_data))
+        return
+    queued_keys[key] = flow_data
+    pending_flows.append(flow_data)
+
+# Push every queued rule in order, batch_size rules per bulk call
+def flush_flows(client, batch_size=BATCH_SIZE):
+    results = push_serial(client, pending_flows, batch_size)
+    pending_flows.clear()
+    report_results(results)
+    return results
+
+# Each device's rules pushed by its own worker, at most `workers` devices at once
+def flush_flows_parallel(client, batch_size=BATCH_SIZE, workers=WORKERS):
+    results = push_parallel(client, pending_flows, batch_size, workers)
+    pending_flows.clear()
+    report_results(results)
+    return results
+
+# flowId of every installed rule, for flow_stats.py --flow-ids
+def save_flow_ids(results, path):
+    flows = [{"deviceId": rule["deviceId"], "flowId": flow_id, "rule": describe_rule(rule)}
+             for installed, _ in results.values() for rule, flow_id in installed]
+    with open(path, 'w') as f:
+        json.dump({"flows": flows}, f, indent=2)
+    print(f"Saved {len(flows)} flow IDs to {path}")
+
+# Unique rule count of the per-host rule set vs the aggregated one,
+# in total and on the fullest switch (the one that hits its TCAM limit first)
+def report_aggregation(per_host_rules, aggregated_rules):
+    for label, rules in (("per-host", per_host_rules), ("aggregated", aggregated_rules)):
+        unique, _ = unique_rules(rules)
+        by_device = group_by_device(unique)
+        fullest = max(by_device, key=lambda device_id: len(by_device[device_id]))
+        print(f"{label:>10}: {len(unique)} rules, max {len(by_device[fullest])} on {fullest}")
 
 # --- MAIN EXECUTION ---
 if __name__ == "__main__":
-    
-    # SETUP SWITCH INFRASTRUCTURE
-    provision_arp_punt(DEV_SA1)
-    provision_arp_punt(DEV_SB1)
-    provision_arp_punt(DEV_SC1)
-    provision_arp_punt(DEV_S0A)
-
-    # SETUP HOST INGRESS (mostly so that table 1 can actually handle the routing (changing MAC dst and src, VLAN dst, etc.))
-    ## ha1 (Port 2, VLAN 10)
-    provision_ingress_rule(DEV_SA1, host_port=2, vlan_id=10)
-    ## ha2 (Port 3, VLAN 20)
-    provision_ingress_rule(DEV_SA1, host_port=3, vlan_id=20)
-    ## hb1 (Port 2, VLAN 10)
-    provision_ingress_rule(DEV_SB1, host_port=2, vlan_id=10)
-    ## hb2 (Port 3, VLAN 20)
-    provision_ingress_rule(DEV_SB1, host_port=3, vlan_id=20)
-    ## hc1 (Port 2, VLAN 10)
-    provision_ingress_rule(DEV_SC1, host_port=2, vlan_id=10)
-    ## hc2 (Port 3, VLAN 20)
-    provision_ingress_rule(DEV_SC1, host_port=3, vlan_id=20)
-
-    '''
-    SETUP LOCAL ROUTING
-    '''
-
-    ## Route: ha1 -> ha2
-    provision_intra_switch_route(
-        name="ha1 to ha2",
-        device_id=DEV_SA1,
-        src_vlan=10,
-        dst_ip="10.0.20.11/32",
-        dst_mac="00:00:00:00:02:01",
-        dst_vlan=20,
-        out_port=3
-    )
-
-    ## Route: ha2 -> ha1 (Reverse)
-    provision_intra_switch_route(
-        name="ha2 to ha1",
-        device_id=DEV_SA1,
-        src_vlan=20,
-        dst_ip="10.0.10.11/32",
-        dst_mac="00:00:00:00:01:01",
-        dst_vlan=10,
-        out_port=2
-    )
-
-    ## Route: hb1 -> hb2
-    provision_intra_switch_route(
-        name="hb1 to hb2",
-        device_id=DEV_SB1,
-        src_vlan=10,
-        dst_ip="10.0.20.12/32",
-        dst_mac="00:00:00:00:02:02",
-        dst_vlan=20,
-        out_port=3
-    )
-
-    ## Route: hb2 -> hb1 (Reverse)
-    provision_intra_switch_route(
-        name="hb2 to hb1",
-        device_id=DEV_SB1,
-        src_vlan=20,
-        dst_ip="10.0.10.12/32",
-        dst_mac="00:00:00:00:01:02",
-        dst_vlan=10,
-        out_port=2
-    )
-
-    ## Route: hc1 -> hc2
-    provision_intra_switch_route(
-        name="hc1 to hc2",
-        device_id=DEV_SC1,
-        src_vlan=10,
-        dst_ip="10.0.20.13/32",
-        dst_mac="00:00:00:00:02:03",
-        dst_vlan=20,
-        out_port=3
-    )
-
-    ## Route: hc2 -> hc1 (Reverse)
-    provision_intra_switch_route(
-        name="hc2 to hc1",
-        device_id=DEV_SC1,
-        src_vlan=20,
-        dst_ip="10.0.10.13/32",
-        dst_mac="00:00:00:00:01:03",
-        dst_vlan=10,
-        out_port=2
-    )
-
-    '''
-    SETUP SAME SUBNET FORWARDING
-    '''
-
-    ## ha1 - hb1 - hc1
-    ### ha1 -> hb1
-    provision_l2_remote_forwarding(
-        name="L2: ha1->hb1",
-        src_leaf_id=DEV_SA1,
-        dst_leaf_id=DEV_SB1,
-        spine_id=DEV_S0A,
-        dst_mac=DEV_HB1,       # hb1 MAC
-        vlan_id=10,            # Both are VLAN 10
-        src_uplink=1,
-        spine_downlink=3,      # s0a connects to sb1 on port 3
-        dst_host_port=2        # hb1 is on port 2 of sb1
-    )
-
-    ### hb1 -> ha1 (Return Path)
-    provision_l2_remote_forwarding(
-        name="L2: hb1->ha1",
-        src_leaf_id=DEV_SB1,
-        dst_leaf_id=DEV_SA1,
-        spine_id=DEV_S0A,
-        dst_mac=DEV_HA1,
-        vlan_id=10,
-        src_uplink=1,
-        spine_downlink=2,      # s0a connects to sa1 on port 2
-        dst_host_port=2
-    )
-
-    ### ha1 -> hc1
-    provision_l2_remote_forwarding(
-        name="L2: ha1->hc1",
-        src_leaf_id=DEV_SA1,
-        dst_leaf_id=DEV_SC1,
-        spine_id=DEV_S0A,
-        dst_mac=DEV_HC1,       # hc1 MAC
-        vlan_id=10,            # Both are VLAN 10
-        src_uplink=1,
-        spine_downlink=4,      # s0a connects to sc1 on port 4
-        dst_host_port=2        # hc1 is on port 2 of sc1
-    )
-
-    ### hc1 -> ha1 (Return Path)
-    provision_l2_remote_forwarding(
-        name="L2: hc1->ha1",
-        src_leaf_id=DEV_SC1,
-        dst_leaf_id=DEV_SA1,
-        spine_id=DEV_S0A,
-        dst_mac=DEV_HA1,
-        vlan_id=10,
-        src_uplink=1,
-        spine_downlink=2,      # s0a connects to sa1 on port 2
-        dst_host_port=2
-    )
-
-    ### hb1 -> hc1
-    provision_l2_remote_forwarding(
-        name="L2: hb1->hc1",
-        src_leaf_id=DEV_SB1,
-        dst_leaf_id=DEV_SC1,
-        spine_id=DEV_S0A,
-        dst_mac=DEV_HC1,       # hc1 MAC
-        vlan_id=10,            # Both are VLAN 10
-        src_uplink=1,
-        spine_downlink=4,      # s0a connects to sc1 on port 4
-        dst_host_port=2        # hc1 is on port 2 of sc1
-    )
-
-    ### hc1 -> hb1 (Return Path)
-    provision_l2_remote_forwarding(
-        name="L2: hc1->hb1",
-        src_leaf_id=DEV_SC1,
-        dst_leaf_id=DEV_SB1,
-        spine_id=DEV_S0A,
-        dst_mac=DEV_HB1,
-        vlan_id=10,
-        src_uplink=1,
-        spine_downlink=3,      # s0a connects to sb1 on port 3
-        dst_host_port=2
-    )
-
-    ## ha2 - hb2 - hc2
-    ### ha2 -> hb2
-    provision_l2_remote_forwarding(
-        name="L2: ha2->hb2",
-        src_leaf_id=DEV_SA1,
-        dst_leaf_id=DEV_SB1,
-        spine_id=DEV_S0A,
-        dst_mac=DEV_HB2,       # hb2 MAC
-        vlan_id=20,            # Both are VLAN 20
-        src_uplink=1,
-        spine_downlink=3,      # s0a connects to sb1 on port 3
-        dst_host_port=3        # hb2 is on port 2 of sb1
-    )
-
-    ### hb2 -> ha2 (Return Path)
-    provision_l2_remote_forwarding(
-        name="L2: hb2->ha2",
-        src_leaf_id=DEV_SB1,
-        dst_leaf_id=DEV_SA1,
-        spine_id=DEV_S0A,
-        dst_mac=DEV_HA2,
-        vlan_id=20,
-        src_uplink=1,
-        spine_downlink=2,      # s0a connects to sa1 on port 2
-        dst_host_port=3
-    )
-
-    ### ha2 -> hc2
-    provision_l2_remote_forwarding(
-        name="L2: ha2->hc2",
-        src_leaf_id=DEV_SA1,
-        dst_leaf_id=DEV_SC1,
-        spine_id=DEV_S0A,
-        dst_mac=DEV_HC2,       # hc2 MAC
-        vlan_id=20,            # Both are VLAN 20
-        src_uplink=1,
-        spine_downlink=4,      # s0a connects to sc1 on port 4
-        dst_host_port=3        # hc2 is on port 3 of sc1
-    )
-
-    ### hc2 -> ha2 (Return Path)
-    provision_l2_remote_forwarding(
-        name="L2: hc2->ha2",
-        src_leaf_id=DEV_SC1,
-        dst_leaf_id=DEV_SA1,
-        spine_id=DEV_S0A,
-        dst_mac=DEV_HA2,
-        vlan_id=20,
-        src_uplink=1,
-        spine_downlink=2,      # s0a connects to sa1 on port 2
-        dst_host_port=3
-    )
-
-    ### hb2 -> hc2
-    provision_l2_remote_forwarding(
-        name="L2: hb2->hc2",
-        src_leaf_id=DEV_SB1,
-        dst_leaf_id=DEV_SC1,
-        spine_id=DEV_S0A,
-        dst_mac=DEV_HC2,       # hc2 MAC
-        vlan_id=20,            # Both are VLAN 20
-        src_uplink=1,
-        spine_downlink=4,      # s0a connects to sc1 on port 4
-        dst_host_port=3        # hc1 is on port 3 of sc1
-    )
-
-    ### hc2 -> hb2 (Return Path)
-    provision_l2_remote_forwarding(
-        name="L2: hc2->hb2",
-        src_leaf_id=DEV_SC1,
-        dst_leaf_id=DEV_SB1,
-        spine_id=DEV_S0A,
-        dst_mac=DEV_HB2,
-        vlan_id=20,
-        src_uplink=1,
-        spine_downlink=3,      # s0a connects to sb1 on port 3
-        dst_host_port=3
-    )
-
-    '''
-    SETUP DIFFERENT SWITCH, DIFFERENT VLAN ROUTING
-    '''
-    ## ha1 - hb2 - hc2
-    ### ha1 -> hb2
-    provision_l3_remote_routing(
-        name="L3: ha1->hb2",
-        src_leaf_id=DEV_SA1,
-        dst_leaf_id=DEV_SB1,
-        spine_id=DEV_S0A,
-        src_vlan=10,
-        dst_vlan=20,
-        dst_ip="10.0.20.12/32", # hb2 IP
-        dst_mac=DEV_HB2,        # hb2 MAC
-        src_uplink=1,
-        spine_downlink=3,       # s0a connects to sb1 on port 3
-        dst_host_port=3         # hb2 is on port 3 of sb1
-    )
-
-    ### hb2 -> ha1 (Return Path)
-    provision_l3_remote_routing(
-        name="L3: hb2->ha1",
-        src_leaf_id=DEV_SB1,
-        dst_leaf_id=DEV_SA1,
-        spine_id=DEV_S0A,
-        src_vlan=20,
-        dst_vlan=10,
-        dst_ip="10.0.10.11/32",
-        dst_mac=DEV_HA1,
-        src_uplink=1,
-        spine_downlink=2,       # s0a connects to sa1 on port 2
-        dst_host_port=2
-    )
-
-    ### ha1 -> hc2
-    provision_l3_remote_routing(
-        name="L3: ha1->hc2",
-        src_leaf_id=DEV_SA1,
-        dst_leaf_id=DEV_SC1,
-        spine_id=DEV_S0A,
-        src_vlan=10,
-        dst_vlan=20,
-        dst_ip="10.0.20.13/32", # hc2 IP
-        dst_mac=DEV_HC2,        # hc2 MAC
-        src_uplink=1,
-        spine_downlink=4,       # s0a connects to sc1 on port 4
-        dst_host_port=3         # hc2 is on port 3 of sc1
-    )
-
-    ### hc2 -> ha1 (Return Path)
-    provision_l3_remote_routing(
-        name="L3: hc2->ha1",
-        src_leaf_id=DEV_SC1,
-        dst_leaf_id=DEV_SA1,
-        spine_id=DEV_S0A,
-        src_vlan=20,
-        dst_vlan=10,
-        dst_ip="10.0.10.11/32",
-        dst_mac=DEV_HA1,
-        src_uplink=1,
-        spine_downlink=2,       # s0a connects to sa1 on port 2
-        dst_host_port=2
-    )
-
-    ## ha2 - hb1 - hc1
-    ### ha2 -> hb1
-    provision_l3_remote_routing(
-        name="L3: ha2->hb1",
-        src_leaf_id=DEV_SA1,
-        dst_leaf_id=DEV_SB1,
-        spine_id=DEV_S0A,
-        src_vlan=20,
-        dst_vlan=10,
-        dst_ip="10.0.10.12/32", # hb1 IP
-        dst_mac=DEV_HB1,        # hb1 MAC
-        src_uplink=1,
-        spine_downlink=3,       # s0a connects to sb1 on port 3
-        dst_host_port=2         # hb1 is on port 3 of sb1
-    )
-
-    ### hb1 -> ha2 (Return Path)
-    provision_l3_remote_routing(
-        name="L3: hb1->ha2",
-        src_leaf_id=DEV_SB1,
-        dst_leaf_id=DEV_SA1,
-        spine_id=DEV_S0A,
-        src_vlan=10,
-        dst_vlan=20,
-        dst_ip="10.0.20.11/32",
-        dst_mac=DEV_HA2,
-        src_uplink=1,
-        spine_downlink=2,       # s0a connects to sa1 on port 2
-        dst_host_port=3
-    )
-
-    ### ha2 -> hc1
-    provision_l3_remote_routing(
-        name="L3: ha2->hc1",
-        src_leaf_id=DEV_SA1,
-        dst_leaf_id=DEV_SC1,
-        spine_id=DEV_S0A,
-        src_vlan=20,
-        dst_vlan=10,
-        dst_ip="10.0.10.13/32", # hc1 IP
-        dst_mac=DEV_HC1,        # hc1 MAC
-        src_uplink=1,
-        spine_downlink=4,       # s0a connects to sc1 on port 4
-        dst_host_port=2         # hc1 is on port 2 of sc1
-    )
-
-    ### hc1 -> ha2 (Return Path)
-    provision_l3_remote_routing(
-        name="L3: hc1->ha2",
-        src_leaf_id=DEV_SC1,
-        dst_leaf_id=DEV_SA1,
-        spine_id=DEV_S0A,
-        src_vlan=10,
-        dst_vlan=20,
-        dst_ip="10.0.20.11/32",
-        dst_mac=DEV_HA2,
-        src_uplink=1,
-        spine_downlink=2,       # s0a connects to sa1 on port 2
-        dst_host_port=3
-    )
-
-    ## hb1 - hc2
-    ### hb1 -> hc2
-    provision_l3_remote_routing(
-        name="L3: hb1->hc2",
-        src_leaf_id=DEV_SB1,
-        dst_leaf_id=DEV_SC1,
-        spine_id=DEV_S0A,
-        src_vlan=10,
-        dst_vlan=20,
-        dst_ip="10.0.20.13/32", # hc2 IP
-        dst_mac=DEV_HC2,        # hc2 MAC
-        src_uplink=1,
-        spine_downlink=4,       # s0a connects to sc1 on port 4
-        dst_host_port=3         # hc2 is on port 3 of sc1
-    )
-
-    ### hc2 -> hb1 (Return Path)
-    provision_l3_remote_routing(
-        name="L3: hc2->hb1",
-        src_leaf_id=DEV_SC1,
-        dst_leaf_id=DEV_SB1,
-        spine_id=DEV_S0A,
-        src_vlan=20,
-        dst_vlan=10,
-        dst_ip="10.0.10.12/32",
-        dst_mac=DEV_HB1,
-        src_uplink=1,
-        spine_downlink=3,       # s0a connects to sb1 on port 3
-        dst_host_port=2
-    )
-
-    ## hb2 - hc1
-    ### hb2 -> hc1
-    provision_l3_remote_routing(
-        name="L3: hb2->hc1",
-        src_leaf_id=DEV_SB1,
-        dst_leaf_id=DEV_SC1,
-        spine_id=DEV_S0A,
-        src_vlan=20,
-        dst_vlan=10,
-        dst_ip="10.0.10.13/32", # hc1 IP
-        dst_mac=DEV_HC1,        # hc1 MAC
-        src_uplink=1,
-        spine_downlink=4,       # s0a connects to sc1 on port 4
-        dst_host_port=2         # hc1 is on port 2 of sc1
-    )
-
-    ### hc1 -> hb2 (Return Path)
-    provision_l3_remote_routing(
-        name="L3: hc2->hb2",
-        src_leaf_id=DEV_SC1,
-        dst_leaf_id=DEV_SB1,
-        spine_id=DEV_S0A,
-        src_vlan=10,
-        dst_vlan=20,
-        dst_ip="10.0.20.12/32",
-        dst_mac=DEV_HB2,
-        src_uplink=1,
-        spine_downlink=3,       # s0a connects to sb1 on port 3
-        dst_host_port=3
-    )
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Install the vlan-routing flow rules on ONOS")
+    parser.add_argument("--fabric", default=FABRIC_FILE,
+                        help="fabric description (JSON or YAML) to compile the rules from")
+    parser.add_argument("--discover", action="store_true",
+                        help="take switches, links and host ports from ONOS (cached, see discovery.py), "
+                             "VLANs and host names from --fabric")
+    parser.add_argument("--discovery-ttl", type=float, default=TTL,
+                        help="seconds a discovered topology is reused without asking ONOS")
+    parser.add_argument("--refresh-discovery", action="store_true", help="ignore the discovery cache")
+    parser.add_argument("--multi-hop", action="store_true",
+                        help="route over the shortest paths of any length (paths.py) instead of one spine hop, "
+                             "for three-tier or ring fabrics")
+    parser.add_argument("--aggregate", action="store_true",
+                        help="route between leaves with per-subnet prefix rules instead of per-host /32 rules")
+    parser.add_argument("--failover", action="store_true",
+                        help="send uplink/downlink traffic through fast-failover groups covering every spine")
+    parser.add_argument("--ecmp", action="store_true",
+                        help="hash inter-leaf flows over every spine with SELECT groups (with --failover: also bypass dead links)")
+    parser.add_argument("--arp-proxy", action="store_true",
+                        help="answer gateway and host ARP in the leaves instead of punting it to the controller "
+                             "(start vlan-routing.py with --arp-proxy, no static ARP)")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="read the installed flows and groups first and only add/update/delete the difference")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print the --reconcile diff without changing anything")
+    parser.add_argument("--force", action="store_true",
+                        help="push even if the rule check finds shadowed or conflicting rules")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="rules per bulk POST /onos/v1/flows call")
+    parser.add_argument("--timeout", type=float, default=10,
+                        help="per-request read timeout in seconds")
+    parser.add_argument("--parallel", action="store_true",
+                        help="push each device's rules concurrently")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="max devices pushed at once in --parallel mode")
+    parser.add_argument("--snapshot", metavar="FILE",
+                        help="write the checked rule set and groups to FILE (gzip'd JSON, or MessagePack for .msgpack) "
+                             "for snapshot.py restore/diff")
+    parser.add_argument("--save-flow-ids", metavar="FILE",
+                        help="write the flowId ONOS returned for every installed rule to FILE (for flow_stats.py)")
+    parser.add_argument("--log-json", metavar="FILE",
+                        help="append every event (installed/failed rule, phase summary, ...) to FILE as JSON lines")
+    parser.add_argument("--prometheus", metavar="FILE",
+                        help="write the phase/request histograms and failure counts to FILE in Prometheus text format")
+    parser.add_argument("--quiet", action="store_true", help="no per-rule OK/WARN lines on the console (failures are still printed)")
+    add_onos_argument(parser)
+    args = parser.parse_args()
+    if args.multi_hop and (args.aggregate or args.failover or args.ecmp):
+        parser.error("--multi-hop doesn't combine with --aggregate, --failover or --ecmp (they assume leaf-spine)")
+    if args.log_json:
+        METRICS.open_log(args.log_json)
+    METRICS.verbose = not args.quiet
+    client = OnosClient(*args.onos, AUTH, pool_size=max(10, args.workers),
+                        timeout=(3.05, args.timeout))
+
+    # COMPILE EVERY RULE FROM THE FABRIC DESCRIPTION
+    fabric = load_fabric(args.fabric)
+    if args.discover:
+        fabric = live_fabric(client, fabric, CACHE_FILE, args.discovery_ttl, args.refresh_discovery)
+    start = time.perf_counter()
+    with METRICS.timed('build'):
+        if args.multi_hop:
+            rules = compile_paths(fabric, arp_proxy=args.arp_proxy)
+        else:
+            rules = compile_rules(fabric, aggregate=args.aggregate, arp_proxy=args.arp_proxy)
+    print(f"Compiled {len(rules)} rules for {len(fabric.hosts)} hosts on {len(fabric.switches)} switches "
+          f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+    if args.aggregate:
+        report_aggregation(compile_rules(fabric, arp_proxy=args.arp_proxy), rules)
+    groups = []
+    with METRICS.timed('build'):
+        if args.ecmp:
+            groups, rules = compile_ecmp(fabric, rules, failover=args.failover)
+        elif args.failover:
+            groups, rules = compile_failover(fabric, rules)
+        for rule in rules:
+            send_flow(rule["deviceId"], rule)
+    if args.ecmp:
+        print(f"Spreading inter-leaf traffic over {len(fabric.spines())} spines with {len(groups)} groups")
+    elif args.failover:
+        print(f"Protected spine links with {len(groups)} fast-failover groups")
+
+    print(f"Queued {len(pending_flows)} unique flow rules, dropped {duplicates_dropped} duplicates")
+
+    # NOTHING SHADOWED OR AMBIGUOUS REACHES THE SWITCHES
+    with METRICS.timed('check'):
+        _, findings = check_rules(pending_flows)
+    print_findings(findings)
+    if any(finding.is_error for finding in findings) and not args.force:
+        client.close()
+        raise SystemExit("Rule check failed, fix the rules or pass --force")
+    # Paths of any shape: no host's traffic may depend on the order the switches install rules in
+    if args.multi_hop:
+        sim = FlowSimulator(fabric, pending_flows, groups)
+        with METRICS.timed('check'):
+            sim.reachability()
+        print_ambiguous(sim.ambiguous)
+        if sim.ambiguous and not args.force:
+            client.close()
+            raise SystemExit("Rules of the same priority with different actions match the same traffic, "
+                             "fix the rules or pass --force")
+    if args.snapshot:
+        options = [name for name in ("multi_hop", "aggregate", "failover", "ecmp", "arp_proxy", "discover")
+                   if getattr(args, name)]
+        snapshot = build_snapshot(pending_flows, groups, {"fabric": args.fabric, "options": options})
+        size = save_snapshot(snapshot, args.snapshot)
+        print(f"Snapshot {snapshot['hash'][:16]} of {len(pending_flows)} rules and {len(groups)} groups "
+              f"written to {args.snapshot} ({size} bytes)")
+
+    # ONLY KEEP WHAT IS NOT ALREADY INSTALLED
+    plan = None
+    if args.reconcile or args.dry_run:
+        device_ids = [switch.device_id for switch in fabric.switches.values()]
+        plan, errors = plan_reconcile(client, pending_flows, device_ids)
+        group_plan, group_errors = plan_groups(client, groups, device_ids)
+        print_plan(plan, errors)
+        print_group_plan(group_plan, group_errors)
+        if args.dry_run:
+            client.close()
+            raise SystemExit(0)
+        pending_flows[:] = [rule for adds, changes, _ in plan.values() for rule in adds + changes]
+        # A changed group is removed first, ONOS would keep the old one on a re-post
+        changed = [group for _, device_changes, _ in group_plan.values() for group in device_changes]
+        if changed:
+            print(f"Removed {delete_groups(client, changed)} of {len(changed)} changed groups")
+        groups = [group for adds, changes, _ in group_plan.values() for group in adds + changes]
+
+    # GROUPS FIRST, FLOWS POINTING AT A MISSING GROUP WOULD STAY PENDING
+    if groups:
+        installed, failed = push_groups(client, groups)
+        report_groups(installed, failed)
+        if failed and not args.force:
+            client.close()
+            raise SystemExit("Some groups could not be installed, not pushing the flows that use them")
+
+    # PUSH EVERYTHING QUEUED ABOVE IN BULK
+    if args.parallel:
+        results = flush_flows_parallel(client, args.batch_size, args.workers)
+    else:
+        results = flush_flows(client, args.batch_size)
+    # Stale flows go last, so traffic keeps flowing on the old rules until the new ones are in
+    if plan is not None:
+        print(f"Deleted {apply_deletes(client, plan)} stale flow rules")
+        stale = [group for _, _, device_deletes in group_plan.values() for group in device_deletes]
+        if stale:
+            print(f"Deleted {delete_groups(client, stale)} stale groups")
+    client.close()
+    if args.save_flow_ids:
+        save_flow_ids(results, args.save_flow_ids)
+    installed = sum(len(ok) for ok, _ in results.values())
+    failed = sum(len(bad) for _, bad in results.values())
+    METRICS.count('rules_installed', installed)
+    METRICS.count('rules_failed', failed)
+    METRICS.event("push_done", f"Installed {installed} flow rules, {failed} failed",
+                  installed=installed, failed=failed, duplicates_dropped=duplicates_dropped)
+
+    # WHERE THE TIME WENT
+    METRICS.print_summary()
+    METRICS.event("metrics", **METRICS.snapshot())
+    if args.prometheus:
+        METRICS.write_prometheus(args.prometheus)
+    METRICS.close_log()
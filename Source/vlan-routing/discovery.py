@@ -0,0 +1,212 @@
+import argparse
+import ipaddress
+import json
+import os
+import sys
+import tempfile
+import time
+
+from fabric import FABRIC_FILE, Fabric, Host, Link, Switch, load_fabric, save_fabric
+from onos_client import AUTH, OnosClient, add_onos_argument
+
+# Topology discovery: the devices, links and hosts ONOS sees, fetched in one
+# GET each, indexed for O(1) lookups (host by MAC or IP, what sits behind a
+# device port) and cached on disk, so the next run within --ttl seconds needs
+# no REST call at all. After the TTL each resource is revalidated with its
+# ETag when ONOS sent one (an unchanged resource costs a 304 and no body) and
+# fetched again otherwise.
+#
+# discovered_fabric() turns it into the Fabric the rule compiler takes: the
+# switches, links and host ports as they are on the live network, the VLANs,
+# router MAC and host names from the fabric file (ONOS sees hosts untagged and
+# without names). Hosts ONOS hasn't learnt keep their fabric file entry; note
+# that ONOS learns hosts from punted ARP/IP, so with --arp-proxy it may know few.
+
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'vlan-routing', 'onos-topology.json')
+CACHE_VERSION = 1
+TTL = 300  # seconds a cached topology is used without asking ONOS
+RESOURCES = ("devices", "links", "hosts")
+
+class Topology:
+    def __init__(self, devices, links, hosts):
+        self.devices = {d["id"]: d for d in devices if d.get("available", True)}
+        # ONOS lists every link once per direction
+        self.links = [l for l in links if l.get("state", "ACTIVE") == "ACTIVE"]
+        self.hosts = hosts
+        self.by_mac = {}    # lower-case MAC -> host
+        self.by_ip = {}     # IP -> host
+        self.by_port = {}   # (device id, port) -> ("link", peer device id, peer port) or ("host", host)
+        self.adjacency = {device_id: {} for device_id in self.devices}  # device id -> {peer device id: port}
+        for link in self.links:
+            src, dst = link["src"], link["dst"]
+            if src["device"] in self.devices and dst["device"] in self.devices:
+                self.by_port[(src["device"], int(src["port"]))] = ("link", dst["device"], int(dst["port"]))
+                self.adjacency[src["device"]][dst["device"]] = int(src["port"])
+        for host in hosts:
+            self.by_mac[host["mac"].lower()] = host
+            for ip in host.get("ipAddresses", []):
+                self.by_ip[ip] = host
+            for location in host.get("locations", []):
+                self.by_port[(location["elementId"], int(location["port"]))] = ("host", host)
+
+    def host_by_mac(self, mac):
+        return self.by_mac.get(mac.lower())
+
+    def host_by_ip(self, ip):
+        return self.by_ip.get(ip)
+
+    def at_port(self, device_id, port):
+        return self.by_port.get((device_id, int(port)))
+
+
+# --- CACHE ---
+def read_cache(path):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return cache if cache.get("version") == CACHE_VERSION else None
+
+def write_cache(path, cache):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Written to a temp file and renamed, so a concurrent run never reads half a file
+    with open(path + '.tmp', 'w') as f:
+        json.dump(cache, f)
+    os.replace(path + '.tmp', path)
+
+# The topology from the cache while it is younger than `ttl`, from ONOS otherwise.
+# Returns (topology, how): 'cached', 'revalidated' (ONOS answered 304 for everything) or 'fetched'.
+def load_topology(client, path=CACHE_FILE, ttl=TTL, refresh=False):
+    cache = read_cache(path)
+    if cache and not refresh and time.time() - cache["fetched"] < ttl:
+        return Topology(*(cache[name] for name in RESOURCES)), 'cached'
+    fetch = {"devices": client.get_devices, "links": client.get_links, "hosts": client.get_hosts}
+    fresh = {"version": CACHE_VERSION, "fetched": time.time(), "etags": {}}
+    changed = False
+    for name in RESOURCES:
+        etag = cache["etags"].get(name) if cache and not refresh else None
+        response = fetch[name](etag=etag)
+        if response.status_code == 304:
+            fresh[name] = cache[name]
+        elif response.status_code == 200:
+            fresh[name] = response.json().get(name, [])
+            changed = True
+        else:
+            raise RuntimeError(f"GET /{name} failed: HTTP {response.status_code} {response.text}")
+        if response.headers.get('ETag'):
+            fresh["etags"][name] = response.headers['ETag']
+    write_cache(path, fresh)
+    return Topology(*(fresh[name] for name in RESOURCES)), 'fetched' if changed else 'revalidated'
+
+
+# --- FABRIC ---
+def dpid(device_id):
+    return device_id.split(':', 1)[1]
+
+# The live network as a Fabric, with the VLANs, router MAC and names of `base`.
+# Returns (fabric, notes), notes being what was skipped or kept from `base`.
+def discovered_fabric(topology, base):
+    notes = []
+    known = {s.device_id: s for s in base.switches.values()}
+    names = {device_id: (known[device_id].name if device_id in known else f's{int(dpid(device_id), 16)}')
+             for device_id in topology.devices}
+
+    hosts = {}
+    base_by_mac = {h.mac.lower(): h for h in base.hosts.values()}
+    for found in topology.hosts:
+        mac = found["mac"].lower()
+        location = next((l for l in found.get("locations", []) if l["elementId"] in topology.devices), None)
+        if location is None:
+            notes.append(f"host {mac} is not on a known device, skipped")
+            continue
+        vlans = [(ip, v) for ip in found.get("ipAddresses", []) for v in base.vlans.values()
+                 if ipaddress.ip_address(ip) in ipaddress.ip_network(v.subnet)]
+        if not vlans:
+            notes.append(f"host {mac} ({', '.join(found.get('ipAddresses', [])) or 'no IP'}) is in no VLAN subnet, skipped")
+            continue
+        ip, vlan = vlans[0]
+        name = base_by_mac[mac].name if mac in base_by_mac else f'h{mac.replace(":", "")[-6:]}'
+        hosts[name] = Host(name, base_by_mac[mac].mac if mac in base_by_mac else mac, ip, vlan.id,
+                           names[location["elementId"]], int(location["port"]))
+    for host in base.hosts.values():
+        if host.name not in hosts:
+            if base.switches[host.switch].device_id not in topology.devices:
+                notes.append(f"host {host.name}: leaf {host.switch} is not connected, skipped")
+                continue
+            notes.append(f"host {host.name} not seen by ONOS, kept on {host.switch} port {host.port}")
+            hosts[host.name] = host
+
+    leaves = {h.switch for h in hosts.values()}
+    switches = []
+    for device_id, name in names.items():
+        role = known[device_id].role if device_id in known else ('leaf' if name in leaves else 'spine')
+        switches.append(Switch(name, dpid(device_id), role))
+    links, seen = [], set()
+    for link in topology.links:
+        src, dst = link["src"], link["dst"]
+        ends = frozenset([(src["device"], int(src["port"])), (dst["device"], int(dst["port"]))])
+        if ends in seen or src["device"] not in names or dst["device"] not in names:
+            continue
+        seen.add(ends)
+        links.append(Link(names[src["device"]], int(src["port"]), names[dst["device"]], int(dst["port"])))
+    return Fabric(switches, base.vlans.values(), hosts.values(), links, base.router_mac), notes
+
+# Where the fabric file and the live network disagree, one line each
+def drift(base, live):
+    lines = []
+    for name in sorted(set(base.switches) ^ set(live.switches)):
+        lines.append(f"switch {name} only in the {'fabric file' if name in base.switches else 'live network'}")
+    for name, host in base.hosts.items():
+        other = live.hosts.get(name)
+        if other and (other.switch, other.port, other.ip) != (host.switch, host.port, host.ip):
+            lines.append(f"host {name}: {host.switch} port {host.port} {host.ip} in the fabric file, "
+                         f"{other.switch} port {other.port} {other.ip} live")
+    for name in sorted(set(live.hosts) - set(base.hosts)):
+        host = live.hosts[name]
+        lines.append(f"host {name} ({host.mac}, {host.ip}) only live, on {host.switch} port {host.port}")
+    for key in sorted(set(base.ports) | set(live.ports)):
+        if key[0] < key[1] and base.ports.get(key) != live.ports.get(key):
+            lines.append(f"link {key[0]}-{key[1]}: port {base.ports.get(key)} in the fabric file, "
+                         f"{live.ports.get(key)} live")
+    return lines
+
+# Everything above in one call, for configure-onos-router.py --discover
+def live_fabric(client, base, path=CACHE_FILE, ttl=TTL, refresh=False):
+    start = time.perf_counter()
+    topology, how = load_topology(client, path, ttl, refresh)
+    fabric, notes = discovered_fabric(topology, base)
+    print(f"Topology {how} ({len(topology.devices)} devices, {len(topology.links)} links, "
+          f"{len(topology.hosts)} hosts) in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for line in notes + drift(base, fabric):
+        print(f" [NOTE] {line}")
+    return fabric
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Discover the live topology from ONOS and compare it with the fabric file")
+    parser.add_argument("--fabric", default=FABRIC_FILE, help="fabric file with the VLANs, router MAC and host names")
+    parser.add_argument("--cache", default=CACHE_FILE, help="where the discovered topology is cached")
+    parser.add_argument("--ttl", type=float, default=TTL, help="seconds the cache is used without asking ONOS")
+    parser.add_argument("--refresh", action="store_true", help="ignore the cache and fetch everything")
+    parser.add_argument("--save-fabric", help="write the discovered fabric to this file (for --fabric of the other tools)")
+    parser.add_argument("--mock", action="store_true", help="discover from a local mock ONOS serving --fabric")
+    add_onos_argument(parser)
+    args = parser.parse_args()
+
+    base = load_fabric(args.fabric)
+    mock = None
+    if args.mock:
+        from mock_onos import MockOnos
+        mock = MockOnos(fabric=base).start()
+        args.onos = mock.address[0], str(mock.address[1])
+        if args.cache == CACHE_FILE:
+            args.cache = os.path.join(tempfile.gettempdir(), 'onos-topology-mock.json')
+    with OnosClient(*args.onos, AUTH) as client:
+        fabric = live_fabric(client, base, args.cache, args.ttl, args.refresh)
+    if mock:
+        mock.stop()
+    if args.save_fabric:
+        save_fabric(fabric, args.save_fabric)
+        print(f"Discovered fabric saved to {args.save_fabric}")
+    sys.exit(1 if drift(base, fabric) else 0)
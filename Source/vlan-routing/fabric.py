@@ -0,0 +1,462 @@
+import ipaddress
+import json
+import os
+from dataclasses import asdict, dataclass
+
+from flow_rules import (
+    ROUTER_MAC,
+    build_arp_punt,
+    build_arp_responder,
+    build_failover_group,
+    build_ingress_rule,
+    build_intra_switch_route,
+    build_l2_local_forwarding,
+    build_l2_remote_forwarding,
+    build_l2_uplink,
+    build_l3_leaf_delivery,
+    build_l3_prefix_route,
+    build_l3_remote_routing,
+    build_l3_uplink,
+    build_leaf_delivery,
+    build_leaf_transit,
+    build_select_group,
+    build_spine_forwarding,
+    build_spine_l3_forwarding,
+    group_instruction,
+)
+
+# One description of the leaf-spine fabric (switches, hosts, ports, VLANs, subnets),
+# read by both the Mininet topology (vlan-routing.py) and the rule compiler below,
+# so the emulated network and the installed flows can't drift apart.
+
+FABRIC_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fabric.json')
+# Group IDs: base + the (first) port the group sends to
+FAILOVER_GROUP_BASE = 0x100
+ECMP_GROUP_BASE = 0x200
+# What the compiler calls to make each kind of rule. rule_templates.py swaps in
+# builders with the same signatures that return compact (template, values) specs.
+# The per-hop builders (l2_uplink .. leaf_transit) are what paths.py chains for
+# paths of any length.
+RULE_BUILDERS = {
+    "arp_punt": build_arp_punt,
+    "arp_responder": build_arp_responder,
+    "ingress": build_ingress_rule,
+    "l2_local": build_l2_local_forwarding,
+    "intra_switch": build_intra_switch_route,
+    "l2_remote": build_l2_remote_forwarding,
+    "l3_remote": build_l3_remote_routing,
+    "l2_uplink": build_l2_uplink,
+    "l3_uplink": build_l3_uplink,
+    "transit": build_spine_forwarding,
+    "leaf_transit": build_leaf_transit,
+    "leaf_delivery": build_leaf_delivery,
+}
+
+@dataclass
+class Switch:
+    name: str
+    dpid: str      # 16 hex digits, e.g. 0000000000000001
+    role: str      # 'spine' or 'leaf'
+
+    @property
+    def device_id(self):
+        return f'of:{self.dpid}'
+
+@dataclass
+class Vlan:
+    id: int
+    subnet: str    # e.g. 10.0.10.0/24
+    gateway: str   # e.g. 10.0.10.1, answered with the fabric's router MAC
+
+@dataclass
+class Host:
+    name: str
+    mac: str
+    ip: str        # without prefix, the prefix comes from the VLAN subnet
+    vlan: int
+    switch: str    # leaf the host hangs off
+    port: int      # port on that leaf
+
+@dataclass
+class Link:
+    node1: str
+    port1: int
+    node2: str
+    port2: int
+
+
+class Fabric:
+    def __init__(self, switches, vlans, hosts, links, router_mac=ROUTER_MAC):
+        self.switches = {s.name: s for s in switches}
+        self.vlans = {v.id: v for v in vlans}
+        self.hosts = {h.name: h for h in hosts}
+        self.links = list(links)
+        self.router_mac = router_mac
+        # (node, neighbour) -> port on node facing neighbour
+        self.ports = {}
+        for link in self.links:
+            self.ports[(link.node1, link.node2)] = link.port1
+            self.ports[(link.node2, link.node1)] = link.port2
+        self.validate()
+
+    def spines(self):
+        return [s for s in self.switches.values() if s.role == 'spine']
+
+    def leaves(self):
+        return [s for s in self.switches.values() if s.role == 'leaf']
+
+    def port(self, node, neighbour):
+        return self.ports[(node, neighbour)]
+
+    # Add a host, leaving the fabric unchanged if it doesn't fit (unknown leaf/VLAN, port in use, ...)
+    def add_host(self, host):
+        if host.name in self.hosts:
+            raise ValueError(f"host {host.name} already exists")
+        for other in self.hosts.values():
+            if other.mac.lower() == host.mac.lower() or other.ip == host.ip:
+                raise ValueError(f"host {host.name} has the same MAC or IP as {other.name}")
+        self.hosts[host.name] = host
+        try:
+            self.validate()
+        except ValueError:
+            del self.hosts[host.name]
+            raise
+
+    def remove_host(self, name):
+        if name not in self.hosts:
+            raise ValueError(f"unknown host {name}")
+        return self.hosts.pop(name)
+
+    def host_cidr(self, host):
+        prefix = ipaddress.ip_network(self.vlans[host.vlan].subnet).prefixlen
+        return f'{host.ip}/{prefix}'
+
+    def validate(self):
+        used = set()
+        for link in self.links:
+            for node, port in ((link.node1, link.port1), (link.node2, link.port2)):
+                if node not in self.switches:
+                    raise ValueError(f"link endpoint {node} is not a switch")
+                if (node, port) in used:
+                    raise ValueError(f"port {port} of {node} is used twice")
+                used.add((node, port))
+        for host in self.hosts.values():
+            leaf = self.switches.get(host.switch)
+            if leaf is None or leaf.role != 'leaf':
+                raise ValueError(f"host {host.name} is attached to unknown leaf {host.switch}")
+            if (host.switch, host.port) in used:
+                raise ValueError(f"port {host.port} of {host.switch} is used twice")
+            used.add((host.switch, host.port))
+            vlan = self.vlans.get(host.vlan)
+            if vlan is None:
+                raise ValueError(f"host {host.name} is on unknown VLAN {host.vlan}")
+            if ipaddress.ip_address(host.ip) not in ipaddress.ip_network(vlan.subnet):
+                raise ValueError(f"host {host.name} ({host.ip}) is outside {vlan.subnet}")
+
+    def to_dict(self):
+        return {
+            "router_mac": self.router_mac,
+            "vlans": [asdict(v) for v in self.vlans.values()],
+            "switches": [asdict(s) for s in self.switches.values()],
+            "links": [asdict(l) for l in self.links],
+            "hosts": [asdict(h) for h in self.hosts.values()]
+        }
+
+
+def fabric_from_dict(data):
+    return Fabric(
+        switches=[Switch(**s) for s in data["switches"]],
+        vlans=[Vlan(**v) for v in data["vlans"]],
+        hosts=[Host(**h) for h in data["hosts"]],
+        links=[Link(**l) for l in data["links"]],
+        router_mac=data.get("router_mac", ROUTER_MAC)
+    )
+
+# JSON, or YAML when the file ends in .yaml/.yml (needs PyYAML)
+def load_fabric(path=FABRIC_FILE):
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("PyYAML is required for YAML fabric files: pip install pyyaml")
+            return fabric_from_dict(yaml.safe_load(f))
+        return fabric_from_dict(json.load(f))
+
+def save_fabric(fabric, path):
+    with open(path, 'w') as f:
+        json.dump(fabric.to_dict(), f, indent=2)
+
+
+# --- RULE COMPILER ---
+# Rules for one ordered host pair, picked by where the hosts sit:
+#   same leaf, same VLAN -> L2 bridge      same leaf, other VLAN -> intra-switch route
+#   other leaf, same VLAN -> L2 via spine  other leaf, other VLAN -> L3 via spine
+# With arp_proxy, a same-VLAN pair also gets the ARP answer for dst on the source leaf.
+def compile_pair(fabric, src, dst, spine, builders=RULE_BUILDERS, arp_proxy=False):
+    src_leaf = fabric.switches[src.switch]
+    dst_leaf = fabric.switches[dst.switch]
+    if arp_proxy and src.vlan == dst.vlan:
+        return ([builders["arp_responder"](src_leaf.device_id, dst.vlan, dst.ip, dst.mac)]
+                + compile_pair(fabric, src, dst, spine, builders))
+    if src.switch == dst.switch:
+        if src.vlan == dst.vlan:
+            return [builders["l2_local"](src_leaf.device_id, dst.mac, dst.vlan, dst.port)]
+        return [builders["intra_switch"](
+            device_id=src_leaf.device_id,
+            src_vlan=src.vlan,
+            dst_ip=f'{dst.ip}/32',
+            dst_mac=dst.mac,
+            dst_vlan=dst.vlan,
+            out_port=dst.port
+        )]
+    if src.vlan == dst.vlan:
+        return builders["l2_remote"](
+            src_leaf_id=src_leaf.device_id,
+            dst_leaf_id=dst_leaf.device_id,
+            spine_id=spine.device_id,
+            dst_mac=dst.mac,
+            vlan_id=dst.vlan,
+            src_uplink=fabric.port(src.switch, spine.name),
+            spine_downlink=fabric.port(spine.name, dst.switch),
+            dst_host_port=dst.port
+        )
+    return builders["l3_remote"](
+        src_leaf_id=src_leaf.device_id,
+        dst_leaf_id=dst_leaf.device_id,
+        spine_id=spine.device_id,
+        src_vlan=src.vlan,
+        dst_vlan=dst.vlan,
+        dst_ip=f'{dst.ip}/32',
+        dst_mac=dst.mac,
+        src_uplink=fabric.port(src.switch, spine.name),
+        spine_downlink=fabric.port(spine.name, dst.switch),
+        dst_host_port=dst.port
+    )
+
+# The leaf's ARP answer for the gateway of `vlan` (--arp-proxy)
+def gateway_responder(fabric, leaf, vlan, builders=RULE_BUILDERS):
+    return builders["arp_responder"](fabric.switches[leaf].device_id, vlan, fabric.vlans[vlan].gateway,
+                                     fabric.router_mac)
+
+# Prefix routes replacing the per-host L3 routes (see build_l3_prefix_route):
+# per leaf one route per (local VLAN, other subnet), plus one spine and one
+# delivery rule per host. O(N + L*V^2) rules instead of O(N*L).
+def compile_aggregated_l3(fabric, spine):
+    rules = []
+    for leaf in fabric.leaves():
+        local_vlans = sorted({h.vlan for h in fabric.hosts.values() if h.switch == leaf.name})
+        for src_vlan in local_vlans:
+            for dst_vlan in fabric.vlans.values():
+                if dst_vlan.id != src_vlan:
+                    rules.append(build_l3_prefix_route(
+                        leaf.device_id, src_vlan, dst_vlan.subnet, dst_vlan.id,
+                        src_uplink=fabric.port(leaf.name, spine.name)
+                    ))
+    for host in fabric.hosts.values():
+        leaf = fabric.switches[host.switch]
+        rules.append(build_spine_l3_forwarding(spine.device_id, f'{host.ip}/32', fabric.port(spine.name, leaf.name)))
+        rules.append(build_l3_leaf_delivery(leaf.device_id, f'{host.ip}/32', host.mac, host.vlan, host.port))
+    return rules
+
+# Every ARP punt, ingress, intra-switch, L2 and L3 rule for all host pairs.
+# Inter-leaf traffic goes through `spine` (default: the first spine).
+# With aggregate=True the inter-leaf L3 routes are per-subnet prefixes instead of per-host /32s.
+# A source host only matters through its leaf and VLAN, so pairs are compiled once
+# per (leaf, VLAN) group instead of once per host: O(L*V*N) instead of O(N^2).
+# The spine and delivery rules still repeat once per group; send_flow() drops the repeats.
+# With arp_proxy=True every group's leaf also answers ARP for its gateway and for
+# the hosts of its VLAN (build_arp_responder): O(L*V + L*N) more rules, no punts.
+def compile_rules(fabric, spine=None, aggregate=False, builders=RULE_BUILDERS, arp_proxy=False):
+    spine = fabric.switches[spine] if spine else fabric.spines()[0]
+    rules = [builders["arp_punt"](s.device_id) for s in fabric.switches.values()]
+    hosts = list(fabric.hosts.values())
+    groups = {}
+    for host in hosts:
+        rules.append(builders["ingress"](fabric.switches[host.switch].device_id, host.port, host.vlan))
+        groups.setdefault((host.switch, host.vlan), []).append(host)
+    for (leaf, vlan), group in groups.items():
+        src = group[0]
+        if arp_proxy:
+            rules.append(gateway_responder(fabric, leaf, vlan, builders))
+        for dst in hosts:
+            # A host alone in its group never needs a path to itself
+            if dst is src and len(group) == 1:
+                continue
+            if aggregate and src.switch != dst.switch and src.vlan != dst.vlan:
+                continue
+            rules += compile_pair(fabric, src, dst, spine, builders, arp_proxy)
+    if aggregate:
+        rules += compile_aggregated_l3(fabric, spine)
+    return rules
+
+
+# --- MULTI-SPINE (FAST FAILOVER / ECMP) ---
+# Turns the single-spine rules of compile_rules() into rules that use every spine:
+#   leaves: uplink outputs go through a group over the uplinks to all spines,
+#           FAILOVER (primary spine first, the rest as backups) or SELECT (ECMP,
+#           the switch hashes each flow onto one uplink)
+#   spines: the primary spine's rules are copied onto every other spine; with
+#           protect_downlinks, downlink outputs go through a FAILOVER group whose
+#           backup is the spine-spine link, so a spine that lost a leaf hands
+#           traffic to its peer
+# ECMP with protected links chains the groups: each SELECT bucket points at a
+# FAILOVER group that falls back to the other uplinks when its own one dies.
+# Returns (groups, rules); groups must be installed before the rules using them.
+def spread_over_spines(fabric, rules, spine=None, ecmp=False, protect_downlinks=True):
+    primary = fabric.switches[spine] if spine else fabric.spines()[0]
+    by_device_id = {s.device_id: s for s in fabric.switches.values()}
+    groups = {}
+
+    def add_group(switch, group_id, build, ports):
+        groups.setdefault((switch.device_id, group_id), build(switch.device_id, group_id, ports))
+        return group_instruction(group_id)
+
+    def failover_group(switch, ports):
+        return add_group(switch, FAILOVER_GROUP_BASE + int(ports[0]), build_failover_group, ports)
+
+    def uplink_group(switch, ports):
+        if not ecmp:
+            return failover_group(switch, ports)
+        if not protect_downlinks:
+            return add_group(switch, ECMP_GROUP_BASE + int(ports[0]), build_select_group, ports)
+        # One FAILOVER group per uplink (that uplink first), spread over by the SELECT group
+        buckets = [failover_group(switch, ports[i:] + ports[:i]) for i in range(len(ports))]
+        return add_group(switch, ECMP_GROUP_BASE + int(ports[0]), build_select_group, buckets)
+
+    def rewrite(rule, switch, ports_for, to_group):
+        instructions = []
+        for instruction in rule["treatment"]["instructions"]:
+            ports = ports_for(instruction["port"]) if instruction["type"] == "OUTPUT" else None
+            if not ports:
+                instructions.append(instruction)
+            elif len(ports) == 1:
+                instructions.append(dict(instruction, port=ports[0]))
+            else:
+                instructions.append(to_group(switch, ports))
+        return dict(rule, deviceId=switch.device_id, treatment={"instructions": instructions})
+
+    spines = [primary] + [s for s in fabric.spines() if s is not primary]
+    # (switch, port) -> the node behind it; rules may spell ports as strings
+    neighbours = {(node, port): peer for (node, peer), port in fabric.ports.items()}
+    def behind(node, port):
+        return neighbours.get((node, int(port))) if str(port).isdigit() else None
+
+    def leaf_ports(leaf):
+        def ports_for(port):
+            if behind(leaf.name, port) != primary.name:
+                return None
+            return [fabric.port(leaf.name, s.name) for s in spines if (leaf.name, s.name) in fabric.ports]
+        return ports_for
+
+    def spine_ports(spine):
+        peers = [fabric.port(spine.name, s.name) for s in spines if s is not spine and (spine.name, s.name) in fabric.ports]
+        def ports_for(leaf_name):
+            if (spine.name, leaf_name) not in fabric.ports:
+                return None
+            return [fabric.port(spine.name, leaf_name)] + (peers if protect_downlinks else [])
+        return ports_for
+
+    out = []
+    for rule in rules:
+        switch = by_device_id.get(rule["deviceId"])
+        if switch is None:
+            out.append(rule)
+        elif switch.role == 'leaf':
+            out.append(rewrite(rule, switch, leaf_ports(switch), uplink_group))
+        elif switch is primary:
+            for copy_to in spines:
+                ports_for = spine_ports(copy_to)
+                # Primary downlink port -> the leaf behind it -> that leaf's port on this spine
+                out.append(rewrite(rule, copy_to, lambda port: ports_for(behind(primary.name, port)), failover_group))
+        else:
+            out.append(rule)
+    return list(groups.values()), out
+
+# Fast failover: all traffic on the primary spine until one of its links dies
+def compile_failover(fabric, rules, spine=None):
+    return spread_over_spines(fabric, rules, spine, ecmp=False, protect_downlinks=True)
+
+# ECMP: flows hashed over every spine; with failover=True dead links are bypassed too
+def compile_ecmp(fabric, rules, spine=None, failover=False):
+    return spread_over_spines(fabric, rules, spine, ecmp=True, protect_downlinks=failover)
+
+# --- SYNTHETIC FABRICS ---
+# Fabrics of any size for benchmarks and scale tests. Hosts are spread
+# round-robin over `vlans` VLANs (10, 20, ...), each a /16, and take the leaf
+# ports after `first_port[leaf]`.
+def generated_vlans(vlans):
+    return [Vlan(10 * (i + 1), f'10.{i + 1}.0.0/16', f'10.{i + 1}.0.1') for i in range(vlans)]
+
+def generated_hosts(leaves, hosts_per_leaf, vlan_list, first_port):
+    hosts = []
+    per_vlan = [0] * len(vlan_list)
+    for l, leaf in enumerate(leaves):
+        for h in range(hosts_per_leaf):
+            n = len(hosts)
+            v = n % len(vlan_list)
+            per_vlan[v] += 1
+            index = per_vlan[v] + 1  # .0.0 is the network, .0.1 the gateway
+            hosts.append(Host(
+                name=f'h{l}x{h}',
+                mac='00:00:{:02x}:{:02x}:{:02x}:{:02x}'.format(*(n + 1).to_bytes(4, 'big')),
+                ip=f'10.{v + 1}.{index // 256}.{index % 256}',
+                vlan=vlan_list[v].id,
+                switch=leaf.name,
+                port=first_port[leaf.name] + h
+            ))
+    return hosts
+
+# Leaf-spine: every leaf has one uplink per spine (leaf ports 1..spines), hosts follow on the next ports
+def generate_fabric(spines=1, leaves=3, hosts_per_leaf=2, vlans=2):
+    switch_list = [Switch(f's{i}', f'{i + 1:016x}', 'spine') for i in range(spines)]
+    leaf_list = [Switch(f'l{i}', f'{spines + i + 1:016x}', 'leaf') for i in range(leaves)]
+    vlan_list = generated_vlans(vlans)
+    links = [
+        Link(f's{s}', l + 1, f'l{l}', s + 1)
+        for s in range(spines) for l in range(leaves)
+    ]
+    hosts = generated_hosts(leaf_list, hosts_per_leaf, vlan_list, {leaf.name: spines + 1 for leaf in leaf_list})
+    return Fabric(switch_list + leaf_list, vlan_list, hosts, links)
+
+# Three-tier: `pods` pods of `aggs_per_pod` aggregation and `leaves_per_pod` access
+# switches, every access switch linked to every aggregation switch of its pod and
+# every aggregation switch to every core. Core and aggregation switches have the
+# 'spine' role, so inter-pod paths are leaf-agg-core-agg-leaf (use paths.py).
+def generate_three_tier(cores=2, pods=2, aggs_per_pod=2, leaves_per_pod=2, hosts_per_leaf=2, vlans=2):
+    core_list = [Switch(f'c{i}', '', 'spine') for i in range(cores)]
+    agg_list, leaf_list, links = [], [], []
+    next_port = {}
+
+    def link(node1, node2):
+        for node in (node1, node2):
+            next_port[node] = next_port.get(node, 0) + 1
+        links.append(Link(node1, next_port[node1], node2, next_port[node2]))
+
+    for p in range(pods):
+        aggs = [Switch(f'a{p}x{i}', '', 'spine') for i in range(aggs_per_pod)]
+        leaves = [Switch(f'l{p * leaves_per_pod + i}', '', 'leaf') for i in range(leaves_per_pod)]
+        for leaf in leaves:
+            for agg in aggs:
+                link(leaf.name, agg.name)
+        for agg in aggs:
+            for core in core_list:
+                link(agg.name, core.name)
+        agg_list += aggs
+        leaf_list += leaves
+    switch_list = core_list + agg_list + leaf_list
+    for i, switch in enumerate(switch_list):
+        switch.dpid = f'{i + 1:016x}'
+    vlan_list = generated_vlans(vlans)
+    hosts = generated_hosts(leaf_list, hosts_per_leaf, vlan_list, {leaf.name: aggs_per_pod + 1 for leaf in leaf_list})
+    return Fabric(switch_list, vlan_list, hosts, links)
+
+# Ring of leaves, no spines: port 1 goes to the next leaf, port 2 to the previous one
+def generate_ring(leaves=4, hosts_per_leaf=2, vlans=2):
+    if leaves < 3:
+        raise ValueError("a ring needs at least 3 leaves")
+    leaf_list = [Switch(f'l{i}', f'{i + 1:016x}', 'leaf') for i in range(leaves)]
+    links = [Link(f'l{i}', 1, f'l{(i + 1) % leaves}', 2) for i in range(leaves)]
+    vlan_list = generated_vlans(vlans)
+    hosts = generated_hosts(leaf_list, hosts_per_leaf, vlan_list, {leaf.name: 3 for leaf in leaf_list})
+    return Fabric(leaf_list, vlan_list, hosts, links)
@@ -0,0 +1,110 @@
+#Importing necessary libraries
+import argparse
+import json
+import os
+import re
+import time
+from importlib import import_module
+
+from mininet.log import setLogLevel, info
+
+from fabric import compile_failover, compile_rules, load_fabric
+from flow_rules import unique_rules
+from onos_client import AUTH, OnosClient, add_onos_argument
+from provisioning import push_groups, push_serial
+
+# Failover test on the redundant topology (s0a + backup spine s0b):
+# starts the network, installs the rules with fast-failover groups, pings
+# across the fabric at a fixed interval and takes a spine link down mid-run.
+# Reports the lost pings and the longest gap between two answers, i.e. how
+# long the switches took to move traffic onto the backup path.
+
+# vlan-routing.py has a dash in its name, so it can't be imported with a plain import
+vlan_routing = import_module('vlan-routing')
+
+REDUNDANT_FABRIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'TopoWithRedundancy', 'fabric.json')
+
+REPLY = re.compile(r'icmp_seq=(\d+)')
+
+# Same rules configure-onos-router.py --failover pushes, groups first
+def provision(fabric, failover, onos):
+    rules = compile_rules(fabric)
+    groups = []
+    if failover:
+        groups, rules = compile_failover(fabric, rules)
+    rules, _ = unique_rules(rules)
+    with OnosClient(*onos, AUTH) as client:
+        _, failed_groups = push_groups(client, groups)
+        results = push_serial(client, rules)
+    failed = len(failed_groups) + sum(len(bad) for _, bad in results.values())
+    info(f'*** Installed {len(groups)} groups and {len(rules)} flow rules, {failed} failed\n')
+    return failed == 0
+
+# Ping dst from src every `interval` seconds for `duration` seconds, taking
+# `link` down after `down_at` seconds. Lost pings and recovery time come from
+# the icmp_seq numbers that got an answer.
+def measure(net, src, dst, link, interval, duration, down_at):
+    count = int(duration / interval)
+    ping = net.get(src.name).popen(['ping', '-n', '-i', str(interval), '-W', '1', '-c', str(count), dst.ip])
+    time.sleep(down_at)
+    info(f'*** Taking {link[0]}-{link[1]} down\n')
+    net.configLinkStatus(link[0], link[1], 'down')
+    output, _ = ping.communicate()
+    net.configLinkStatus(link[0], link[1], 'up')
+
+    answered = sorted({int(seq) for seq in REPLY.findall(output.decode())})
+    # Longest run of unanswered pings, counting from seq 1 up to seq `count`
+    edges = [0] + answered + [count + 1]
+    longest_gap = max(b - a - 1 for a, b in zip(edges, edges[1:]))
+    return {
+        "src": src.name, "dst": dst.name, "link_down": list(link),
+        "sent": count, "received": len(answered), "lost": count - len(answered),
+        "loss_pct": round(100.0 * (count - len(answered)) / count, 2),
+        "recovery_ms": round(longest_gap * interval * 1000, 1),
+        # Still answering in the last second, i.e. the backup path carried the traffic
+        "recovered": bool(answered) and answered[-1] > count - int(1.0 / interval),
+        "interval_ms": interval * 1000,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure packet loss and recovery time when a spine link fails")
+    parser.add_argument("--fabric", default=REDUNDANT_FABRIC, help="fabric description with a backup spine")
+    parser.add_argument("--src", default="ha1")
+    parser.add_argument("--dst", default="hb1")
+    parser.add_argument("--link", nargs=2, default=["s0a", "sa1"], metavar=("NODE1", "NODE2"),
+                        help="link taken down during the run")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between pings")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of pinging")
+    parser.add_argument("--down-at", type=float, default=2.0, help="seconds into the run the link goes down")
+    parser.add_argument("--no-failover", action="store_true", help="plain single-spine rules, for a baseline")
+    parser.add_argument("--skip-provision", action="store_true", help="rules are already installed")
+    parser.add_argument("--output", help="write the result as JSON to this file")
+    add_onos_argument(parser)
+    args = parser.parse_args()
+
+    setLogLevel('info')
+    fabric = load_fabric(args.fabric)
+    src, dst = fabric.hosts[args.src], fabric.hosts[args.dst]
+    net = vlan_routing.start_network(fabric)
+    try:
+        if not args.skip_provision and not provision(fabric, not args.no_failover, args.onos):
+            raise SystemExit("Provisioning failed")
+        # Static ARP both ways so neither side waits on ARP around the failure
+        net.get(src.name).cmd(f'arp -s {dst.ip} {dst.mac}')
+        net.get(dst.name).cmd(f'arp -s {src.ip} {src.mac}')
+        # Give the switches a moment to get the rules, then make sure the path works at all
+        time.sleep(2)
+        warmup = net.get(src.name).cmd(f'ping -n -c 3 -W 1 {dst.ip}')
+        if not REPLY.search(warmup):
+            raise SystemExit(f"{src.name} cannot reach {dst.name} before the failure:\n{warmup}")
+        result = measure(net, src, dst, args.link, args.interval, args.duration, args.down_at)
+        result["failover"] = not args.no_failover
+    finally:
+        net.stop()
+
+    print(f"{result['src']} -> {result['dst']}, {'-'.join(result['link_down'])} down: "
+          f"{result['lost']}/{result['sent']} pings lost ({result['loss_pct']}%), "
+          + (f"recovery {result['recovery_ms']} ms" if result['recovered'] else "not recovered"))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
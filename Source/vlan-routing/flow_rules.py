@@ -0,0 +1,430 @@
+# Flow rule builders for the vlan-routing pipeline.
+# Each builder only returns ONOS flow JSON (as dicts); pushing is up to the caller.
+#
+# Pipeline:
+#   table 0: host ports push the host VLAN and go to table 1,
+#            tagged packets for a local host are popped and delivered
+#   table 1: bridging / routing decisions (MAC + VLAN rewrites, uplink to spine)
+
+import ipaddress
+import json
+
+ROUTER_MAC = '00:00:00:00:00:99'
+
+# --- 1. INGRESS RULE (Table 0 -> Table 1) ---
+# "If packet comes in Port X, push VLAN Y, and go to Table 1"
+def build_ingress_rule(device_id, host_port, vlan_id):
+    return {
+        "priority": 40000, "isPermanent": True, "deviceId": device_id, "tableId": 0,
+        "selector": {
+            "criteria": [ {"type": "IN_PORT", "port": host_port} ]
+        },
+        "treatment": { "instructions": [
+            {"type": "L2MODIFICATION", "subtype": "VLAN_PUSH"},
+            {"type": "L2MODIFICATION", "subtype": "VLAN_ID", "vlanId": vlan_id},
+            {"type": "TABLE", "tableId": 1}
+        ]}
+    }
+
+# --- 2. INTRA-SWITCH ROUTE (Table 1 -> Output) ---
+# "If Dest IP is Local, rewrite MACs and deliver"
+def build_intra_switch_route(
+    device_id,
+    src_vlan,
+    dst_ip,        # Target IP (e.g., 10.0.20.11/32)
+    dst_mac,       # Target MAC (e.g., 00:00...02:01)
+    dst_vlan,      # Target VLAN (e.g., 20)
+    out_port       # Target Port (e.g., 3)
+):
+    return {
+        "priority": 40000, "isPermanent": True, "deviceId": device_id, "tableId": 1,
+        "selector": {
+            "criteria": [
+                {"type": "IPV4_DST", "ip": dst_ip},
+                {"type": "ETH_TYPE", "ethType": "0x0800"},
+                {"type": "VLAN_VID", "vlanId": src_vlan}
+            ]
+        },
+        "treatment": { "instructions": [
+            # 1. Rewrite DST MAC to Host MAC
+            {"type": "L2MODIFICATION", "subtype": "ETH_DST", "mac": dst_mac},
+            # 2. Rewrite SRC MAC to Router MAC (Gateway)
+            {"type": "L2MODIFICATION", "subtype": "ETH_SRC", "mac": ROUTER_MAC},
+            # 3. Change VLAN ID to Target VLAN
+            {"type": "L2MODIFICATION", "subtype": "VLAN_ID", "vlanId": dst_vlan},
+            # 4. Pop VLAN (Host expects untagged)
+            {"type": "L2MODIFICATION", "subtype": "VLAN_POP"},
+            # 5. Output to Host Port
+            {"type": "OUTPUT", "port": out_port}
+        ]}
+    }
+
+# --- 3. L2 INTRA-SWITCH BRIDGING (Same Subnet, Same Switch) ---
+def build_l2_local_forwarding(device_id, dst_mac, vlan_id, out_port):
+    return {
+        "priority": 40000, "isPermanent": True, "deviceId": device_id, "tableId": 1,
+        "selector": {
+            "criteria": [
+                {"type": "ETH_DST", "mac": dst_mac},
+                {"type": "VLAN_VID", "vlanId": vlan_id}
+            ]
+        },
+        "treatment": { "instructions": [
+            {"type": "L2MODIFICATION", "subtype": "VLAN_POP"},
+            {"type": "OUTPUT", "port": out_port}
+        ]}
+    }
+
+# Spine: transparent L2 bridge based on MAC
+def build_spine_forwarding(spine_id, dst_mac, spine_downlink):
+    return {
+        "priority": 40000, "isPermanent": True, "deviceId": spine_id, "tableId": 0,
+        "selector": {
+            "criteria": [ {"type": "ETH_DST", "mac": dst_mac} ]
+        },
+        "treatment": { "instructions": [
+            {"type": "OUTPUT", "port": spine_downlink}
+        ]}
+    }
+
+# Transit hop on a switch that also has hosts (multi-hop paths through a leaf):
+# matching the tag keeps it apart from the untagged traffic of the IN_PORT ingress
+# rules at the same priority, which a bare ETH_DST match would also catch
+def build_leaf_transit(device_id, dst_mac, vlan_id, out_port):
+    return {
+        "priority": 40000, "isPermanent": True, "deviceId": device_id, "tableId": 0,
+        "selector": {
+            "criteria": [
+                {"type": "ETH_DST", "mac": dst_mac},
+                {"type": "VLAN_VID", "vlanId": vlan_id}
+            ]
+        },
+        "treatment": { "instructions": [
+            {"type": "OUTPUT", "port": out_port}
+        ]}
+    }
+
+# Destination leaf: the packet arrives tagged with the host VLAN and host MAC
+def build_leaf_delivery(dst_leaf_id, dst_mac, vlan_id, dst_host_port):
+    return {
+        "priority": 40000, "isPermanent": True, "deviceId": dst_leaf_id, "tableId": 0,
+        "selector": {
+            "criteria": [
+                {"type": "ETH_DST", "mac": dst_mac},
+                {"type": "VLAN_VID", "vlanId": vlan_id}
+            ]
+        },
+        "treatment": { "instructions": [
+            {"type": "L2MODIFICATION", "subtype": "VLAN_POP"},
+            {"type": "OUTPUT", "port": dst_host_port}
+        ]}
+    }
+
+# --- 4. L2 INTER-SWITCH FORWARDING (Same Subnet, Different Switch) ---
+# Returns [src leaf rule, spine rule, dst leaf rule]
+def build_l2_remote_forwarding(
+    src_leaf_id,
+    dst_leaf_id,
+    spine_id,
+    dst_mac,         # The actual Host MAC
+    vlan_id,         # The shared VLAN (e.g., 10)
+    src_uplink,      # Port on Src Leaf -> Spine
+    spine_downlink,  # Port on Spine -> Dst Leaf
+    dst_host_port    # Port on Dst Leaf -> Host
+):
+    # 1. SRC LEAF: Bridge to Spine
+    # 2. SPINE: Forward to Destination Leaf
+    # 3. DST LEAF: Deliver to Host
+    return [
+        build_l2_uplink(src_leaf_id, dst_mac, vlan_id, src_uplink),
+        build_spine_forwarding(spine_id, dst_mac, spine_downlink),
+        build_leaf_delivery(dst_leaf_id, dst_mac, vlan_id, dst_host_port)
+    ]
+
+# Source leaf: bridge to the spine
+# STRICTNESS: Match specific Host MAC and VLAN.
+# Do NOT match Router MAC here.
+def build_l2_uplink(src_leaf_id, dst_mac, vlan_id, src_uplink):
+    return {
+        "priority": 40000, "isPermanent": True, "deviceId": src_leaf_id, "tableId": 1,
+        "selector": {
+            "criteria": [
+                {"type": "ETH_DST", "mac": dst_mac},
+                {"type": "VLAN_VID", "vlanId": vlan_id}
+            ]
+        },
+        "treatment": { "instructions": [
+            {"type": "OUTPUT", "port": src_uplink}
+        ]}
+    }
+
+# --- 5. L3 INTER-SWITCH ROUTING (Different Subnet, Different Switch) ---
+# Returns [src leaf rule, spine rule, dst leaf rule]
+def build_l3_remote_routing(
+    src_leaf_id,
+    dst_leaf_id,
+    spine_id,
+    src_vlan,        # VLAN where packet originates (e.g., 10)
+    dst_vlan,        # VLAN where packet is going (e.g., 20)
+    dst_ip,          # Specific Dest IP (e.g., 10.0.20.12/32)
+    dst_mac,         # Final Host MAC
+    src_uplink,      # Port on Src Leaf -> Spine
+    spine_downlink,  # Port on Spine -> Dst Leaf
+    dst_host_port    # Port on Dst Leaf -> Host
+):
+    # 1. SRC LEAF: Route to Spine
+    # 2. SPINE: Forward to Destination Leaf
+    # Note: The packet now has the Final Host MAC (rewritten by Src Leaf)
+    # 3. DST LEAF: Deliver to Host
+    # Note: The packet arrives with dst_vlan and dst_mac
+    return [
+        build_l3_uplink(src_leaf_id, src_vlan, dst_vlan, dst_ip, dst_mac, src_uplink),
+        build_spine_forwarding(spine_id, dst_mac, spine_downlink),
+        build_leaf_delivery(dst_leaf_id, dst_mac, dst_vlan, dst_host_port)
+    ]
+
+# Source leaf: route to the spine
+# STRICTNESS: Must match ETH_DST == ROUTER_MAC (00:00:00:00:00:99)
+# This distinguishes this flow from L2 bridging.
+def build_l3_uplink(src_leaf_id, src_vlan, dst_vlan, dst_ip, dst_mac, src_uplink):
+    return {
+        "priority": 41000, # Higher priority than generic matches
+        "isPermanent": True, "deviceId": src_leaf_id, "tableId": 1,
+        "selector": {
+            "criteria": [
+                {"type": "ETH_DST", "mac": ROUTER_MAC},
+                {"type": "IPV4_DST", "ip": dst_ip},
+                {"type": "ETH_TYPE", "ethType": "0x0800"},
+                {"type": "VLAN_VID", "vlanId": src_vlan}
+            ]
+        },
+        "treatment": { "instructions": [
+            # Rewrite Headers
+            {"type": "L2MODIFICATION", "subtype": "ETH_SRC", "mac": ROUTER_MAC},
+            {"type": "L2MODIFICATION", "subtype": "ETH_DST", "mac": dst_mac},
+            {"type": "L2MODIFICATION", "subtype": "VLAN_ID", "vlanId": dst_vlan},
+            # Forward Up
+            {"type": "OUTPUT", "port": src_uplink}
+        ]}
+    }
+
+# --- 6. AGGREGATED L3 ROUTING (--aggregate) ---
+# Instead of one /32 route per remote host on every leaf, each leaf gets one
+# prefix route per destination subnet. The packet keeps ETH_DST == ROUTER_MAC
+# across the spine, and the destination leaf does the final MAC rewrite.
+# Priority grows with the prefix length (longest prefix wins) but stays below
+# the 40000 intra-switch /32 routes, so local hosts in that subnet still win.
+def build_l3_prefix_route(src_leaf_id, src_vlan, dst_subnet, dst_vlan, src_uplink):
+    prefix_len = int(dst_subnet.split('/')[1])
+    return {
+        "priority": 39000 + prefix_len, "isPermanent": True, "deviceId": src_leaf_id, "tableId": 1,
+        "selector": {
+            "criteria": [
+                {"type": "ETH_DST", "mac": ROUTER_MAC},
+                {"type": "IPV4_DST", "ip": dst_subnet},
+                {"type": "ETH_TYPE", "ethType": "0x0800"},
+                {"type": "VLAN_VID", "vlanId": src_vlan}
+            ]
+        },
+        "treatment": { "instructions": [
+            {"type": "L2MODIFICATION", "subtype": "ETH_SRC", "mac": ROUTER_MAC},
+            {"type": "L2MODIFICATION", "subtype": "VLAN_ID", "vlanId": dst_vlan},
+            {"type": "OUTPUT", "port": src_uplink}
+        ]}
+    }
+
+# Spine: routed packets still carry ROUTER_MAC, so forward on the host IP
+def build_spine_l3_forwarding(spine_id, dst_ip, spine_downlink):
+    return {
+        "priority": 40000, "isPermanent": True, "deviceId": spine_id, "tableId": 0,
+        "selector": {
+            "criteria": [
+                {"type": "ETH_DST", "mac": ROUTER_MAC},
+                {"type": "IPV4_DST", "ip": dst_ip},
+                {"type": "ETH_TYPE", "ethType": "0x0800"}
+            ]
+        },
+        "treatment": { "instructions": [
+            {"type": "OUTPUT", "port": spine_downlink}
+        ]}
+    }
+
+# Destination leaf: rewrite ROUTER_MAC to the host MAC, pop and deliver
+def build_l3_leaf_delivery(dst_leaf_id, dst_ip, dst_mac, dst_vlan, dst_host_port):
+    return {
+        "priority": 40000, "isPermanent": True, "deviceId": dst_leaf_id, "tableId": 0,
+        "selector": {
+            "criteria": [
+                {"type": "ETH_DST", "mac": ROUTER_MAC},
+                {"type": "IPV4_DST", "ip": dst_ip},
+                {"type": "ETH_TYPE", "ethType": "0x0800"},
+                {"type": "VLAN_VID", "vlanId": dst_vlan}
+            ]
+        },
+        "treatment": { "instructions": [
+            {"type": "L2MODIFICATION", "subtype": "ETH_DST", "mac": dst_mac},
+            {"type": "L2MODIFICATION", "subtype": "VLAN_POP"},
+            {"type": "OUTPUT", "port": dst_host_port}
+        ]}
+    }
+
+# Essential to keep the pipeline flowing if ARP requests happen
+def build_arp_punt(device_id):
+    return {
+        "priority": 41000, "isPermanent": True, "deviceId": device_id, "tableId": 1,
+        "selector": {
+            "criteria": [ {"type": "ETH_TYPE", "ethType": "0x0806"} ]
+        },
+        "treatment": { "instructions": [
+            {"type": "OUTPUT", "port": "CONTROLLER"}
+        ]}
+    }
+
+# ARP proxy (--arp-proxy): the leaf answers "who has `ip`?" from a host in
+# `vlan_id` itself, turning the request into a reply from `mac` and sending it
+# back out of the port it came in on. `ip` is the VLAN gateway (answered with
+# ROUTER_MAC) or a host of the VLAN (answered with its own MAC), so neither
+# the static gateway ARP nor a round trip to the controller is needed.
+# OpenFlow 1.3 can't copy the requester's addresses into the target fields, so
+# the reply keeps the request's broadcast ETH_DST and target fields; Linux only
+# looks at the sender fields of a reply. A host's own probe for its address
+# (arping -D) would be answered too, so don't run DAD in this mode.
+# Above the punt, which still catches every ARP packet the fabric doesn't know.
+def build_arp_responder(device_id, vlan_id, ip, mac):
+    return {
+        "priority": 42000, "isPermanent": True, "deviceId": device_id, "tableId": 1,
+        "selector": {
+            "criteria": [
+                {"type": "ETH_TYPE", "ethType": "0x0806"},
+                {"type": "VLAN_VID", "vlanId": vlan_id},
+                {"type": "ARP_OP", "arpOp": 1},
+                {"type": "ARP_TPA", "ip": ip}
+            ]
+        },
+        "treatment": { "instructions": [
+            {"type": "L2MODIFICATION", "subtype": "ETH_SRC", "mac": mac},
+            {"type": "L3MODIFICATION", "subtype": "ARP_OP", "op": 2},
+            {"type": "L3MODIFICATION", "subtype": "ARP_SHA", "mac": mac},
+            {"type": "L3MODIFICATION", "subtype": "ARP_SPA", "ip": ip},
+            {"type": "L2MODIFICATION", "subtype": "VLAN_POP"},
+            {"type": "OUTPUT", "port": "IN_PORT"}
+        ]}
+    }
+
+# --- 7. ACL RULES (acl.py) ---
+# Table 0, above every pipeline rule. No instructions means drop; a permit
+# (vlan_id given) does what the ingress rule would, VLAN push and on to table 1.
+def build_acl_rule(device_id, priority, criteria, vlan_id=None):
+    return {
+        "priority": priority, "timeout": 0, "isPermanent": True, "deviceId": device_id, "tableId": 0,
+        "selector": { "criteria": criteria },
+        "treatment": { "instructions": [] if vlan_id is None else [
+            {"type": "L2MODIFICATION", "subtype": "VLAN_PUSH"},
+            {"type": "L2MODIFICATION", "subtype": "VLAN_ID", "vlanId": vlan_id},
+            {"type": "TABLE", "tableId": 1}
+        ]}
+    }
+
+# --- 8. GROUPS ---
+# ONOS group JSON for POST /onos/v1/groups/<device>. The appCookie is what ONOS
+# keys the group on (and what DELETE takes), so it is derived from the group ID.
+def build_group(device_id, group_id, group_type, buckets):
+    return {
+        "type": group_type, "deviceId": device_id,
+        "appCookie": f"0x{group_id:x}", "groupId": group_id,
+        "buckets": buckets
+    }
+
+# Fast-failover: the switch sends out of the first port in `ports` that is up,
+# without asking the controller, so a dead uplink is bypassed in the data plane
+def build_failover_group(device_id, group_id, ports):
+    return build_group(device_id, group_id, "FAILOVER", [
+        {"watchPort": port, "treatment": {"instructions": [{"type": "OUTPUT", "port": port}]}}
+        for port in ports
+    ])
+
+# Select (ECMP): the switch hashes each flow onto one bucket. A bucket is an
+# output port, or a GROUP instruction to chain into another group.
+def build_select_group(device_id, group_id, targets):
+    return build_group(device_id, group_id, "SELECT", [
+        {"weight": 1, "treatment": {"instructions": [
+            target if isinstance(target, dict) else {"type": "OUTPUT", "port": target}
+        ]}}
+        for target in targets
+    ])
+
+def group_instruction(group_id):
+    return {"type": "GROUP", "groupId": group_id}
+
+def describe_group(group):
+    targets = []
+    for bucket in group["buckets"]:
+        instruction = bucket["treatment"]["instructions"][0]
+        targets.append(f"group {instruction['groupId']}" if instruction["type"] == "GROUP" else str(instruction.get("port")))
+    return f"{group['deviceId']} group {group['groupId']} {group['type']} [{', '.join(targets)}]"
+
+# ONOS echoes flows back in its own spelling ("0x800" for "0x0800", ports as
+# strings, upper-case MACs, extra fields like VLAN_PUSH's ethernetType), so both
+# our rules and live flows are reduced to the same canonical values before comparing.
+CANONICAL_FIELDS = {
+    "mac": lambda v: str(v).lower(),
+    "vlanId": int,
+    "tableId": int,
+    "groupId": int,
+    "protocol": int,
+    "icmpType": int,
+    "tcpPort": int,
+    "udpPort": int,
+    "arpOp": int,
+    "op": int,
+    "ethType": lambda v: int(v, 16) if isinstance(v, str) else int(v),
+    "port": str,
+    "ip": lambda v: str(ipaddress.ip_network(v, strict=False)),
+}
+
+def canonical_entry(entry):
+    fields = [("type", entry["type"])]
+    if "subtype" in entry:
+        fields.append(("subtype", entry["subtype"]))
+    for name, convert in CANONICAL_FIELDS.items():
+        if name in entry:
+            fields.append((name, convert(entry[name])))
+    return tuple(fields)
+
+# ONOS identifies a flow by device, table, priority and selector (not treatment),
+# so that is what makes two rules the same rule. Criteria order doesn't matter.
+def rule_key(rule):
+    criteria = tuple(sorted(canonical_entry(c) for c in rule["selector"]["criteria"]))
+    return (rule["deviceId"], int(rule.get("tableId", 0)), int(rule["priority"]), criteria)
+
+# Instruction order matters (rewrite before output), so no sorting here
+def treatment_key(rule):
+    return tuple(canonical_entry(i) for i in rule["treatment"]["instructions"])
+
+# Drop repeated rules (same rule_key), keeping the first. Returns (unique, dropped)
+def unique_rules(rules):
+    seen = set()
+    unique = []
+    for rule in rules:
+        key = rule_key(rule)
+        if key not in seen:
+            seen.add(key)
+            unique.append(rule)
+    return unique, len(rules) - len(unique)
+
+# Short label so a returned flow ID can be traced back to the rule it came from
+def describe_rule(rule):
+    criteria = ", ".join(
+        f"{c['type']}={next(v for k, v in c.items() if k != 'type')}"
+        for c in rule["selector"]["criteria"]
+    )
+    return f"{rule['deviceId']} table {rule.get('tableId', 0)} prio {rule['priority']} [{criteria}]"
+
+# Rules from a JSON file: a single flow (like the ACL files in TopoWithRedundancy),
+# a list of flows or a bulk body {"flows": [...]}
+def load_rules(path):
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return data["flows"] if "flows" in data else [data]
+    return data
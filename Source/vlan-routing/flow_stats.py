@@ -0,0 +1,240 @@
+import argparse
+import heapq
+import json
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fabric import FABRIC_FILE, compile_rules, load_fabric
+from flow_rules import describe_rule, unique_rules
+from onos_client import AUTH, OnosClient, add_onos_argument
+from provisioning import WORKERS, push_serial
+from reconcile import APP_ID, GONE_STATES
+
+# Flow statistics collector: polls the packet/byte counters of the installed
+# flows (GET /onos/v1/flows/<device>) and of the switch ports
+# (GET /onos/v1/statistics/ports/<device>) every few seconds, and keeps the
+# per-interval deltas in fixed-size ring buffers for top-N talkers and port
+# utilisation. One request of each kind per device per round, with at most
+# `workers` devices in flight, so a large fabric doesn't flood the controller.
+
+CAPACITY = 60  # samples kept per device, i.e. the last minute at the default interval
+INTERVAL = 1.0  # seconds between polling rounds
+LINK_SPEED = 100  # Mbit/s, the TCLink limit of the topologies
+
+# --- RING BUFFER ---
+# Last `capacity` samples of a set of counters, one row per key. Every field is
+# one flat array ('Q' = unsigned 64 bit) with row r at [r * capacity, (r + 1) * capacity),
+# so a few thousand flows cost a few hundred KB and no per-sample Python objects.
+# Samples are appended for all keys at once: a key missing from a sample gets 0.
+class RingBuffer:
+    def __init__(self, capacity=CAPACITY, fields=("bytes", "packets")):
+        self.capacity = capacity
+        self.fields = fields
+        self.rows = {}  # key -> row
+        self.data = {field: array('Q') for field in fields}
+        self.seconds = array('d', bytes(8 * capacity))  # length of the interval each slot covers
+        self.count = 0  # samples written so far
+
+    def row(self, key):
+        if key not in self.rows:
+            self.rows[key] = len(self.rows)
+            for column in self.data.values():
+                column.frombytes(bytes(8 * self.capacity))
+        return self.rows[key]
+
+    # deltas: {key: (delta per field)}, seconds: time since the previous sample
+    def append(self, seconds, deltas):
+        slot = self.count % self.capacity
+        self.seconds[slot] = seconds
+        for column in self.data.values():
+            for row in range(len(self.rows)):
+                column[row * self.capacity + slot] = 0
+        for key, values in deltas.items():
+            start = self.row(key) * self.capacity
+            for field, value in zip(self.fields, values):
+                self.data[field][start + slot] = value
+        self.count += 1
+
+    # Slots of the last `samples` samples, newest first
+    def slots(self, samples=None):
+        samples = min(samples or self.capacity, self.count, self.capacity)
+        return [(self.count - 1 - i) % self.capacity for i in range(samples)]
+
+    # (sum of `field` over the window, seconds covered) for every key
+    def totals(self, field, samples=None):
+        slots = self.slots(samples)
+        seconds = sum(self.seconds[slot] for slot in slots)
+        column = self.data[field]
+        return {key: sum(column[row * self.capacity + slot] for slot in slots)
+                for key, row in self.rows.items()}, seconds
+
+    # Oldest to newest values of one key
+    def series(self, key, field="bytes", samples=None):
+        start = self.rows[key] * self.capacity
+        return [self.data[field][start + slot] for slot in reversed(self.slots(samples))]
+
+
+# Counter increase since the last poll. A counter that went down was reset
+# (flow re-installed, switch restarted), so everything it shows is new.
+def delta(now, before):
+    return now - before if now >= before else now
+
+
+# --- COLLECTOR ---
+class StatsCollector:
+    # flow_ids: {(device id, flow id): label} to watch only the flows installed
+    # by configure-onos-router.py --save-flow-ids; None watches every flow of `app_id`
+    def __init__(self, client, devices, capacity=CAPACITY, workers=WORKERS, flow_ids=None, app_id=APP_ID):
+        self.client = client
+        self.devices = list(devices)
+        self.workers = workers
+        self.flow_ids = flow_ids
+        self.app_id = app_id
+        self.labels = dict(flow_ids or {})
+        self.flows = {device_id: RingBuffer(capacity) for device_id in self.devices}
+        self.ports = {device_id: RingBuffer(capacity, ("rx_bytes", "tx_bytes")) for device_id in self.devices}
+        # device id -> (poll time, {flow id: (bytes, packets)}, {port: (rx bytes, tx bytes)})
+        self.last = {}
+        self.rounds = 0
+        self.requests = 0
+
+    def fetch(self, device_id):
+        flows = self.client.get_flows(device_id)
+        ports = self.client.get_port_stats(device_id)
+        for response in (flows, ports):
+            if response.status_code != 200:
+                raise requests.HTTPError(f"{response.status_code} {response.text}")
+        counters = {}
+        for flow in flows.json().get("flows", []):
+            if flow.get("state") in GONE_STATES:
+                continue
+            if self.flow_ids is None:
+                if flow.get("appId") != self.app_id:
+                    continue
+                self.labels.setdefault((device_id, flow["id"]), describe_rule(flow))
+            elif (device_id, flow["id"]) not in self.flow_ids:
+                continue
+            counters[flow["id"]] = (int(flow.get("bytes", 0)), int(flow.get("packets", 0)))
+        port_counters = {
+            port["port"]: (int(port.get("bytesReceived", 0)), int(port.get("bytesSent", 0)))
+            for stats in ports.json().get("statistics", []) for port in stats.get("ports", [])
+        }
+        return counters, port_counters
+
+    # Poll one device and store the deltas. The first poll only takes the baseline.
+    def poll_device(self, device_id):
+        counters, port_counters = self.fetch(device_id)
+        now = time.monotonic()
+        if device_id in self.last:
+            before, flows_before, ports_before = self.last[device_id]
+            self.flows[device_id].append(now - before, {
+                flow_id: tuple(delta(a, b) for a, b in zip(values, flows_before.get(flow_id, (0, 0))))
+                for flow_id, values in counters.items()
+            })
+            self.ports[device_id].append(now - before, {
+                port: tuple(delta(a, b) for a, b in zip(values, ports_before.get(port, (0, 0))))
+                for port, values in port_counters.items()
+            })
+        self.last[device_id] = (now, counters, port_counters)
+
+    # One round over every device. Returns {device id: error} for the devices that failed.
+    def poll(self):
+        def safe_poll(device_id):
+            try:
+                self.poll_device(device_id)
+            except (requests.RequestException, ValueError) as e:
+                return str(e)
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            outcomes = dict(zip(self.devices, pool.map(safe_poll, self.devices)))
+        self.rounds += 1
+        self.requests += 2 * len(self.devices)
+        return {device_id: error for device_id, error in outcomes.items() if error}
+
+    # Busiest flows over the last `samples` samples: [(bytes/s, device id, flow id, label)]
+    def top_talkers(self, n=10, samples=None):
+        rates = []
+        for device_id, ring in self.flows.items():
+            totals, seconds = ring.totals("bytes", samples)
+            if seconds:
+                rates += [(total / seconds, device_id, flow_id) for flow_id, total in totals.items()]
+        return [(rate, device_id, flow_id, self.labels.get((device_id, flow_id), ""))
+                for rate, device_id, flow_id in heapq.nlargest(n, rates)]
+
+    # [(device id, port, rx bit/s, tx bit/s, % of link_speed used by the busier direction)]
+    def port_utilisation(self, samples=None, link_speed=LINK_SPEED):
+        usage = []
+        for device_id, ring in self.ports.items():
+            rx, seconds = ring.totals("rx_bytes", samples)
+            tx, _ = ring.totals("tx_bytes", samples)
+            if not seconds:
+                continue
+            for port in sorted(ring.rows):
+                rx_bps, tx_bps = rx[port] * 8 / seconds, tx[port] * 8 / seconds
+                usage.append((device_id, port, rx_bps, tx_bps, 100 * max(rx_bps, tx_bps) / (link_speed * 1e6)))
+        return usage
+
+    def run(self, rounds, interval=INTERVAL, report=None):
+        for i in range(rounds):
+            start = time.monotonic()
+            errors = self.poll()
+            for device_id, error in errors.items():
+                print(f" [FAIL] {device_id}: {error}")
+            if report and i:
+                report(self)
+            time.sleep(max(0.0, interval - (time.monotonic() - start)))
+
+
+def print_report(collector, top=10, samples=None, link_speed=LINK_SPEED):
+    print(f"--- round {collector.rounds}, {collector.requests} requests ---")
+    print("Top talkers:")
+    for rate, device_id, flow_id, label in collector.top_talkers(top, samples):
+        print(f" {rate * 8 / 1e6:>9.3f} Mbit/s  flowId {flow_id}  {label or device_id}")
+    print("Port utilisation:")
+    for device_id, port, rx_bps, tx_bps, percent in collector.port_utilisation(samples, link_speed):
+        if rx_bps or tx_bps:
+            print(f" {device_id} port {port:<3} rx {rx_bps / 1e6:>8.3f} Mbit/s  tx {tx_bps / 1e6:>8.3f} Mbit/s  {percent:5.1f}%")
+
+# Flow IDs saved by configure-onos-router.py --save-flow-ids -> {(device id, flow id): label}
+def load_flow_ids(path):
+    with open(path) as f:
+        return {(flow["deviceId"], flow["flowId"]): flow.get("rule", "") for flow in json.load(f)["flows"]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect per-flow and per-port traffic statistics from ONOS")
+    parser.add_argument("--fabric", default=FABRIC_FILE, help="fabric description, for the list of switches")
+    parser.add_argument("--flow-ids", help="flow IDs saved by configure-onos-router.py --save-flow-ids, watch only these")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="seconds between polling rounds")
+    parser.add_argument("--rounds", type=int, default=10, help="polling rounds before exiting")
+    parser.add_argument("--capacity", type=int, default=CAPACITY, help="samples kept per device")
+    parser.add_argument("--window", type=int, help="samples the report covers (default: all kept)")
+    parser.add_argument("--top", type=int, default=10, help="talkers listed per report")
+    parser.add_argument("--link-speed", type=float, default=LINK_SPEED, help="port speed in Mbit/s for the utilisation")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="devices polled at once")
+    parser.add_argument("--mock", action="store_true",
+                        help="poll a local mock ONOS with synthetic counters, after pushing the fabric's rules to it")
+    add_onos_argument(parser)
+    args = parser.parse_args()
+
+    fabric = load_fabric(args.fabric)
+    flow_ids = load_flow_ids(args.flow_ids) if args.flow_ids else None
+    devices = [switch.device_id for switch in fabric.switches.values()]
+    report = lambda collector: print_report(collector, args.top, args.window, args.link_speed)
+
+    if args.mock:
+        from mock_onos import MockOnos
+        with MockOnos() as mock:
+            ip, port = mock.address
+            with OnosClient(ip, port, AUTH, pool_size=max(10, args.workers)) as client:
+                rules, _ = unique_rules(compile_rules(fabric))
+                push_serial(client, rules)
+                print(f"Pushed {len(rules)} rules to the mock ONOS at {ip}:{port}")
+                StatsCollector(client, devices, args.capacity, args.workers, flow_ids).run(args.rounds, args.interval, report)
+    else:
+        with OnosClient(*args.onos, AUTH, pool_size=max(10, args.workers)) as client:
+            StatsCollector(client, devices, args.capacity, args.workers, flow_ids).run(args.rounds, args.interval, report)
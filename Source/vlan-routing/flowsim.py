@@ -0,0 +1,384 @@
+import argparse
+import ipaddress
+import random
+import sys
+import time
+import zlib
+
+from fabric import FABRIC_FILE, compile_ecmp, compile_failover, compile_rules, generate_ring, load_fabric
+from flow_rules import CANONICAL_FIELDS, describe_rule, load_rules, treatment_key
+from paths import compile_paths
+
+# Offline OpenFlow pipeline simulator: pushes packets through the compiled rules
+# (multi-table, VLAN push/pop, MAC rewrites, priorities) over the fabric's links,
+# hop by hop, without Mininet or ONOS. Used for all-pairs reachability checks.
+# A packet matching two rules of the same top priority with different actions is
+# reported as "ambiguous": OpenFlow leaves that choice to the switch, so what
+# happens depends on the order the rules were installed in.
+
+MAX_HOPS = 64  # anything longer is a forwarding loop
+
+# criterion type -> (field name in the rule JSON, packet field)
+CRITERIA = {
+    "IN_PORT": ("port", "in_port"),
+    "ETH_DST": ("mac", "eth_dst"),
+    "ETH_SRC": ("mac", "eth_src"),
+    "ETH_TYPE": ("ethType", "eth_type"),
+    "VLAN_VID": ("vlanId", "vlan"),
+    "IPV4_DST": ("ip", "ipv4_dst"),
+    "IPV4_SRC": ("ip", "ipv4_src"),
+    "IP_PROTO": ("protocol", "ip_proto"),
+    "ICMPV4_TYPE": ("icmpType", "icmp_type"),
+    "ARP_OP": ("arpOp", "arp_op"),
+    "ARP_TPA": ("ip", "arp_tpa"),
+}
+PREFIX_FIELDS = ("IPV4_DST", "IPV4_SRC", "ARP_TPA")
+
+
+# --- RULE INDEX ---
+# Tuple-space search: rules of one (device, table) are grouped by the shape of
+# their match (which fields, which prefix lengths). Each group is a dict keyed
+# by the matched values, so a lookup costs one hash probe per group instead of
+# a scan over every rule. Groups are tried highest priority first.
+class TableIndex:
+    def __init__(self):
+        self.groups = {}  # shape -> {"max_priority": int, "rules": {values: [(priority, rule)]}}
+        self.ordered = []
+
+    @staticmethod
+    def shape_and_values(rule):
+        shape, values = [], []
+        for criterion in sorted(rule["selector"]["criteria"], key=lambda c: c["type"]):
+            kind = criterion["type"]
+            if kind not in CRITERIA:
+                raise ValueError(f"unsupported match field {kind} in rule on {rule['deviceId']}")
+            field = CRITERIA[kind][0]
+            if kind in PREFIX_FIELDS:
+                network = ipaddress.ip_network(criterion[field], strict=False)
+                shape.append((kind, network.prefixlen))
+                values.append(int(network.network_address) >> (32 - network.prefixlen))
+            else:
+                shape.append((kind, None))
+                values.append(CANONICAL_FIELDS[field](criterion[field]))
+        return tuple(shape), tuple(values)
+
+    def add(self, rule):
+        shape, values = self.shape_and_values(rule)
+        group = self.groups.setdefault(shape, {"max_priority": -1, "rules": {}})
+        group["max_priority"] = max(group["max_priority"], int(rule["priority"]))
+        group["rules"].setdefault(values, []).append((int(rule["priority"]), rule))
+
+    def finalize(self):
+        for group in self.groups.values():
+            for entries in group["rules"].values():
+                entries.sort(key=lambda entry: -entry[0])
+        self.ordered = sorted(self.groups.items(), key=lambda item: -item[1]["max_priority"])
+
+    @staticmethod
+    def packet_values(shape, packet):
+        values = []
+        for kind, prefix_len in shape:
+            value = packet.get(CRITERIA[kind][1])
+            if value is None:
+                return None
+            values.append(value >> (32 - prefix_len) if prefix_len is not None else value)
+        return tuple(values)
+
+    # The highest-priority matching rule, and the other rules at that priority that
+    # match too but do something else
+    def lookup(self, packet):
+        best, rivals = None, []
+        for shape, group in self.ordered:
+            if best is not None and group["max_priority"] < best[0]:
+                break
+            values = self.packet_values(shape, packet)
+            entries = group["rules"].get(values) if values is not None else None
+            if not entries or best is not None and entries[0][0] < best[0]:
+                continue
+            if best is None or entries[0][0] > best[0]:
+                best, rivals, entries = entries[0], [], entries[1:]
+            rivals += [rule for priority, rule in entries
+                       if priority == best[0] and treatment_key(rule) != treatment_key(best[1])]
+        return (best[1], rivals) if best else (None, [])
+
+
+# groups: ONOS group JSON (see compile_failover), referenced by GROUP instructions.
+# down_links: (node, node) pairs whose link is down; their ports count as dead.
+class FlowSimulator:
+    def __init__(self, fabric, rules, groups=(), down_links=()):
+        self.fabric = fabric
+        self.by_device_id = {s.device_id: s.name for s in fabric.switches.values()}
+        self.tables = {}  # (switch name, table id) -> TableIndex
+        for rule in rules:
+            switch = self.by_device_id.get(rule["deviceId"])
+            if switch is None:
+                continue
+            self.tables.setdefault((switch, int(rule.get("tableId", 0))), TableIndex()).add(rule)
+        for index in self.tables.values():
+            index.finalize()
+        self.ambiguous = {}  # describe_rule() of a rule picked over others -> (rule, rivals)
+        # (node, port) -> (peer node, peer port); ports as strings like in the rules
+        self.wires = {}
+        for link in fabric.links:
+            self.wires[(link.node1, str(link.port1))] = (link.node2, str(link.port2))
+            self.wires[(link.node2, str(link.port2))] = (link.node1, str(link.port1))
+        for host in fabric.hosts.values():
+            self.wires[(host.switch, str(host.port))] = (host.name, '1')
+        self.groups = {(self.by_device_id[g["deviceId"]], int(g["groupId"])): g
+                       for g in groups if g["deviceId"] in self.by_device_id}
+        self.dead = set()
+        for node1, node2 in down_links:
+            self.dead.add((node1, str(fabric.port(node1, node2))))
+            self.dead.add((node2, str(fabric.port(node2, node1))))
+
+    def port_up(self, node, port):
+        return (node, str(port)) in self.wires and (node, str(port)) not in self.dead
+
+    # The bucket a group sends this packet through: the first live one for FAILOVER,
+    # one picked by a hash of the flow's addresses for SELECT (buckets without a
+    # watch port count as live, as in Open vSwitch)
+    def group_bucket(self, switch, group_id, packet):
+        group = self.groups.get((switch, group_id))
+        if group is None:
+            raise ValueError(f"rule on {switch} points at missing group {group_id}")
+        if group["type"] == "FAILOVER":
+            return next((b for b in group["buckets"] if self.port_up(switch, b["watchPort"])), None)
+        if group["type"] == "SELECT":
+            flow = f'{packet["eth_src"]} {packet["eth_dst"]} {packet.get("ipv4_src")} {packet.get("ipv4_dst")}'
+            return group["buckets"][zlib.crc32(flow.encode()) % len(group["buckets"])]
+        raise ValueError(f"unsupported group type {group['type']} on {switch}")
+
+    # The frame a host puts on the wire for dst: straight to dst's MAC inside its
+    # own subnet, to the gateway (router MAC) otherwise. ARP is assumed resolved.
+    def host_packet(self, src, dst):
+        subnet = ipaddress.ip_network(self.fabric.vlans[src.vlan].subnet)
+        same_subnet = ipaddress.ip_address(dst.ip) in subnet
+        return {
+            "eth_src": src.mac.lower(),
+            "eth_dst": dst.mac.lower() if same_subnet else self.fabric.router_mac.lower(),
+            "eth_type": 0x0800,
+            "vlan": None,
+            "ipv4_src": int(ipaddress.ip_address(src.ip)),
+            "ipv4_dst": int(ipaddress.ip_address(dst.ip)),
+            "ip_proto": 1,
+            "icmp_type": 8,
+        }
+
+    # Run one packet through one switch's tables. Returns [(out_port, packet)] and the rules hit.
+    # Ties between rules doing different things are recorded in `ambiguous`.
+    def process(self, switch, packet):
+        outputs, hits = [], []
+
+        def apply(instructions):
+            next_table = None
+            for instruction in instructions:
+                kind, subtype = instruction["type"], instruction.get("subtype")
+                if kind == "OUTPUT":
+                    outputs.append((str(instruction["port"]), dict(packet)))
+                elif kind == "TABLE":
+                    next_table = int(instruction["tableId"])
+                elif kind == "GROUP":
+                    bucket = self.group_bucket(switch, int(instruction["groupId"]), packet)
+                    if bucket is not None:
+                        apply(bucket["treatment"]["instructions"])
+                elif subtype == "VLAN_PUSH":
+                    packet["vlan"] = 0
+                elif subtype == "VLAN_ID":
+                    packet["vlan"] = int(instruction["vlanId"])
+                elif subtype == "VLAN_POP":
+                    packet["vlan"] = None
+                elif subtype == "ETH_DST":
+                    packet["eth_dst"] = instruction["mac"].lower()
+                elif subtype == "ETH_SRC":
+                    packet["eth_src"] = instruction["mac"].lower()
+                elif subtype == "ARP_OP":
+                    packet["arp_op"] = int(instruction["op"])
+                elif subtype == "ARP_SHA":
+                    packet["arp_sha"] = instruction["mac"].lower()
+                elif subtype == "ARP_SPA":
+                    packet["arp_spa"] = int(ipaddress.ip_address(instruction["ip"]))
+                else:
+                    raise ValueError(f"unsupported instruction {kind}/{subtype} on {switch}")
+            return next_table
+
+        table = 0
+        while table is not None:
+            index = self.tables.get((switch, table))
+            rule, rivals = index.lookup(packet) if index else (None, [])
+            if rule is None:
+                break
+            if rivals:
+                self.ambiguous[describe_rule(rule)] = (rule, rivals)
+            hits.append((table, rule, rivals))
+            table = apply(rule["treatment"]["instructions"])
+        return outputs, hits
+
+    # Follow a packet from a host until it reaches a host, is dropped or punted.
+    # Returns (outcome, hops): outcome is "delivered", "dropped", "controller",
+    # "loop", "misdelivered" or "ambiguous"; hops are (switch, in_port, out_port) triples.
+    def trace(self, src, dst):
+        packet = self.host_packet(src, dst)
+        node, port = src.switch, str(src.port)
+        hops = []
+        for _ in range(MAX_HOPS):
+            packet["in_port"] = port
+            outputs, hits = self.process(node, packet)
+            if any(rivals for _, _, rivals in hits):
+                hops.append((node, port, outputs[0][0] if outputs else None))
+                return "ambiguous", hops
+            if not outputs:
+                hops.append((node, port, None))
+                return "dropped", hops
+            out_port, packet = outputs[0]
+            hops.append((node, port, out_port))
+            if out_port == "CONTROLLER":
+                return "controller", hops
+            # Dead link, or back out of the port it came in on (switches drop those)
+            if not self.port_up(node, out_port) or out_port == port:
+                return "dropped", hops
+            node, port = self.wires[(node, out_port)]
+            if node in self.fabric.hosts:
+                delivered = (node == dst.name and packet["vlan"] is None
+                             and packet["eth_dst"] == dst.mac.lower())
+                return ("delivered" if delivered else "misdelivered"), hops
+        return "loop", hops
+
+    def reachability(self):
+        hosts = list(self.fabric.hosts.values())
+        return {(src.name, dst.name): self.trace(src, dst) for src in hosts for dst in hosts if src is not dst}
+
+    # An ARP request from src for `ip`, as a host broadcasts it. Returns (outcome, MAC):
+    # "answered" with the MAC the reply carries when the leaf turns it around itself
+    # (see build_arp_responder), otherwise "controller", "dropped" or "misdelivered".
+    def resolve(self, src, ip):
+        packet = {
+            "eth_src": src.mac.lower(),
+            "eth_dst": "ff:ff:ff:ff:ff:ff",
+            "eth_type": 0x0806,
+            "vlan": None,
+            "in_port": str(src.port),
+            "arp_op": 1,
+            "arp_sha": src.mac.lower(),
+            "arp_spa": int(ipaddress.ip_address(src.ip)),
+            "arp_tpa": int(ipaddress.ip_address(ip)),
+        }
+        outputs, _ = self.process(src.switch, packet)
+        if not outputs:
+            return "dropped", None
+        out_port, reply = outputs[0]
+        if out_port == "CONTROLLER":
+            return "controller", None
+        if (out_port == "IN_PORT" and reply["arp_op"] == 2 and reply["vlan"] is None
+                and reply["arp_spa"] == packet["arp_tpa"]):
+            return "answered", reply["arp_sha"]
+        return "misdelivered", None
+
+    # Every host resolving its gateway and each other host of its VLAN.
+    # Returns {(host name, IP): (outcome, MAC), ...} and the MAC each IP should resolve to.
+    def arp_resolution(self):
+        results, expected = {}, {}
+        for src in self.fabric.hosts.values():
+            targets = {self.fabric.vlans[src.vlan].gateway: self.fabric.router_mac}
+            targets.update({h.ip: h.mac for h in self.fabric.hosts.values() if h.vlan == src.vlan and h is not src})
+            for ip, mac in targets.items():
+                results[(src.name, ip)] = self.resolve(src, ip)
+                expected[ip] = mac.lower()
+        return results, expected
+
+
+def print_matrix(fabric, results):
+    names = list(fabric.hosts)
+    width = max(len(n) for n in names) + 1
+    print(" " * width + "".join(f"{n:>{width}}" for n in names))
+    for src in names:
+        cells = []
+        for dst in names:
+            if src == dst:
+                cells.append(f"{'-':>{width}}")
+            else:
+                cells.append(f"{'ok' if results[(src, dst)][0] == 'delivered' else 'X':>{width}}")
+        print(f"{src:<{width}}" + "".join(cells))
+
+def print_ambiguous(ambiguous, limit=20):
+    for rule, rivals in list(ambiguous.values())[:limit]:
+        print(f" [ERROR] same priority, different actions: {describe_rule(rule)}")
+        for rival in rivals:
+            print(f"          and {describe_rule(rival)}")
+    if len(ambiguous) > limit:
+        print(f" ... {len(ambiguous) - limit} more ambiguous rules")
+
+def format_hops(hops):
+    return " -> ".join(f"{node}[{in_port}>{out_port or 'drop'}]" for node, in_port, out_port in hops)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check all-pairs reachability of the compiled rules offline")
+    parser.add_argument("--fabric", default=FABRIC_FILE, help="fabric description (JSON or YAML)")
+    parser.add_argument("--ring", nargs=2, type=int, metavar=("LEAVES", "HOSTS"),
+                        help="use a generated ring of leaves instead of --fabric (with --multi-hop)")
+    parser.add_argument("--rules", help="rule JSON to simulate instead of compiling the fabric")
+    parser.add_argument("--aggregate", action="store_true", help="compile with per-subnet L3 prefix routes")
+    parser.add_argument("--multi-hop", action="store_true",
+                        help="compile over the shortest paths of any length (paths.py), e.g. for three-tier or ring fabrics")
+    parser.add_argument("--failover", action="store_true", help="compile with fast-failover groups on every spine link")
+    parser.add_argument("--ecmp", action="store_true", help="compile with SELECT groups hashing flows over every spine")
+    parser.add_argument("--arp-proxy", action="store_true",
+                        help="compile with the in-switch ARP responders and check every host's ARP resolution too")
+    parser.add_argument("--link-down", nargs=2, action="append", default=[], metavar=("NODE1", "NODE2"),
+                        help="simulate with this link down (repeatable)")
+    parser.add_argument("--trace", nargs=2, metavar=("SRC", "DST"), help="print the hop-by-hop path of one pair")
+    parser.add_argument("--shuffle", type=int, metavar="SEED",
+                        help="load the rules in a random order, as a switch may install them "
+                             "(the result must not depend on it)")
+    args = parser.parse_args()
+    if args.multi_hop and (args.aggregate or args.failover or args.ecmp):
+        parser.error("--multi-hop doesn't combine with --aggregate, --failover or --ecmp (they assume leaf-spine)")
+    if args.ring and not args.multi_hop:
+        parser.error("--ring needs --multi-hop (a ring has no spines)")
+
+    fabric = generate_ring(*args.ring) if args.ring else load_fabric(args.fabric)
+    if args.rules:
+        rules = load_rules(args.rules)
+    elif args.multi_hop:
+        rules = compile_paths(fabric, arp_proxy=args.arp_proxy)
+    else:
+        rules = compile_rules(fabric, aggregate=args.aggregate, arp_proxy=args.arp_proxy)
+    groups = []
+    if args.ecmp:
+        groups, rules = compile_ecmp(fabric, rules, failover=args.failover)
+    elif args.failover:
+        groups, rules = compile_failover(fabric, rules)
+    if args.shuffle is not None:
+        random.Random(args.shuffle).shuffle(rules)
+    start = time.perf_counter()
+    sim = FlowSimulator(fabric, rules, groups, args.link_down)
+    if args.trace:
+        outcome, hops = sim.trace(fabric.hosts[args.trace[0]], fabric.hosts[args.trace[1]])
+        print(f"{args.trace[0]} -> {args.trace[1]}: {outcome}")
+        print(format_hops(hops))
+        sys.exit(0 if outcome == "delivered" else 1)
+
+    results = sim.reachability()
+    elapsed = time.perf_counter() - start
+    print_matrix(fabric, results)
+    broken = {pair: result for pair, result in results.items() if result[0] != "delivered"}
+    for (src, dst), (outcome, hops) in broken.items():
+        print(f" [FAIL] {src} -> {dst}: {outcome}: {format_hops(hops)}")
+    print_ambiguous(sim.ambiguous)
+    if len(fabric.spines()) > 1:
+        load = {spine.name: 0 for spine in fabric.spines()}
+        for outcome, hops in results.values():
+            for node, _, _ in hops:
+                if node in load:
+                    load[node] += 1
+        print("Paths per spine: " + ", ".join(f"{name} {count}" for name, count in load.items()))
+    print(f"{len(results) - len(broken)}/{len(results)} pairs reachable, "
+          f"{len(rules)} rules, {elapsed * 1000:.1f} ms")
+    unresolved = {}
+    if args.arp_proxy:
+        arp, expected = sim.arp_resolution()
+        unresolved = {key: result for key, result in arp.items() if result != ("answered", expected[key[1]])}
+        for (src, ip), (outcome, mac) in unresolved.items():
+            print(f" [FAIL] {src} ARP for {ip}: {outcome}" + (f" with {mac}, expected {expected[ip]}" if mac else ""))
+        print(f"{len(arp) - len(unresolved)}/{len(arp)} ARP requests answered in the switch")
+    sys.exit(1 if broken or unresolved else 0)
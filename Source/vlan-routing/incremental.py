@@ -0,0 +1,273 @@
+import argparse
+import time
+from dataclasses import replace
+
+from fabric import FABRIC_FILE, Host, compile_pair, gateway_responder, load_fabric, save_fabric, spread_over_spines
+from flow_rules import build_arp_punt, build_ingress_rule, describe_rule, rule_key, treatment_key
+from metrics import METRICS
+from onos_client import AUTH, OnosClient, add_onos_argument
+from provisioning import BATCH_SIZE, delete_batch, push_serial, report_results
+from reconcile import fetch_live_flows
+
+# Incremental provisioning: add, remove or move one host without recompiling
+# and re-pushing the whole fabric.
+#
+# compile_rules() emits, per (leaf, VLAN) source group and destination host,
+# the rules of compile_pair(), plus one ingress rule per host and one ARP punt
+# per switch. The spine and delivery rules towards a host are emitted by every
+# source group, so each rule carries a reference count: it is pushed when its
+# first contributor appears and deleted when its last one goes. A host change
+# touches its own ingress rule, the (group, host) pairs towards it and, when it
+# opens or closes a source group, that group's pairs: O(N) rules instead of the
+# O(N^2) of a full reinstall. Per-host (non --aggregate) rules only.
+# With --arp-proxy the ARP responders follow the same path: a source group's
+# gateway answer lives as long as the group, the answer for a host comes with
+# the (group, host) pair.
+
+class IncrementalCompiler:
+    # installed=True: the fabric's rules are already on the switches (the
+    # normal case after configure-onos-router.py), so only changes get pushed.
+    # failover/ecmp: the rules are spread over the spines like configure-onos-router.py
+    # --failover/--ecmp does; the groups themselves don't change with the hosts.
+    # arp_proxy: the fabric was installed with --arp-proxy.
+    def __init__(self, fabric, spine=None, failover=False, ecmp=False, arp_proxy=False, installed=True):
+        self.fabric = fabric
+        self.arp_proxy = arp_proxy
+        self.spine = fabric.switches[spine] if spine else fabric.spines()[0]
+        self.spread = None
+        if ecmp or failover:
+            self.spread = lambda rules: spread_over_spines(fabric, rules, self.spine.name, ecmp=ecmp,
+                                                           protect_downlinks=failover or not ecmp)[1]
+        self.rules = {}      # rule_key -> rule
+        self.refs = {}       # rule_key -> contributors
+        self.sources = {}    # (leaf, VLAN) -> names of its hosts, in insertion order
+        self.pairs = {}      # (source group, destination host) -> rule keys it contributed
+        self.ingress = {}    # host name -> rule keys of its ingress rule
+        self.gateways = {}   # source group -> rule keys of its gateway ARP responder
+        self.flow_ids = {}   # rule_key -> flowId, filled in by push()
+        self.touched = set()
+
+        for switch in fabric.switches.values():
+            self.contribute([build_arp_punt(switch.device_id)])
+        hosts = list(fabric.hosts.values())
+        for host in hosts:
+            self.ingress[host.name] = self.contribute([self.ingress_rule(host)])
+            self.sources.setdefault((host.switch, host.vlan), []).append(host.name)
+        for group in self.sources:
+            self.open_group(group)
+            for dst in hosts:
+                self.sync_pair(group, dst.name)
+        self.installed = dict(self.rules) if installed else {}
+        if installed:
+            self.touched.clear()
+
+    def ingress_rule(self, host):
+        return build_ingress_rule(self.fabric.switches[host.switch].device_id, host.port, host.vlan)
+
+    # --- REFERENCE COUNTING ---
+    def contribute(self, rules):
+        if self.spread:
+            rules = self.spread(rules)
+        keys = []
+        for rule in rules:
+            key = rule_key(rule)
+            if key not in self.refs:
+                self.refs[key] = 0
+                self.rules[key] = rule
+                self.touched.add(key)
+            elif treatment_key(self.rules[key]) != treatment_key(rule):
+                METRICS.event("duplicate_conflict",
+                              f" [WARN] {describe_rule(rule)} already used with a different treatment, keeping the first",
+                              detail=True, device=rule["deviceId"], rule=describe_rule(rule))
+            self.refs[key] += 1
+            keys.append(key)
+        return keys
+
+    def withdraw(self, keys):
+        for key in keys:
+            self.refs[key] -= 1
+            if not self.refs[key]:
+                del self.refs[key]
+                del self.rules[key]
+                self.touched.add(key)
+
+    def open_group(self, group):
+        if self.arp_proxy:
+            self.gateways[group] = self.contribute([gateway_responder(self.fabric, *group)])
+
+    def close_group(self, group):
+        del self.sources[group]
+        if group in self.gateways:
+            self.withdraw(self.gateways.pop(group))
+
+    # A group needs a path to every host, except to its only member
+    def wanted(self, group, dst):
+        members = self.sources.get(group, ())
+        return dst in self.fabric.hosts and bool(members) and not (members == [dst])
+
+    def sync_pair(self, group, dst):
+        pair = (group, dst)
+        if self.wanted(group, dst) and pair not in self.pairs:
+            src = self.fabric.hosts[self.sources[group][0]]
+            self.pairs[pair] = self.contribute(compile_pair(self.fabric, src, self.fabric.hosts[dst], self.spine,
+                                                            arp_proxy=self.arp_proxy))
+        elif not self.wanted(group, dst) and pair in self.pairs:
+            self.withdraw(self.pairs.pop(pair))
+
+    # --- HOST OPERATIONS ---
+    def add_host(self, host):
+        self.fabric.add_host(host)
+        self.ingress[host.name] = self.contribute([self.ingress_rule(host)])
+        group = (host.switch, host.vlan)
+        opened = group not in self.sources
+        self.sources.setdefault(group, []).append(host.name)
+        # Paths from every source group to the new host
+        for other in self.sources:
+            self.sync_pair(other, host.name)
+        if opened:
+            # A new source group also needs its gateway answer and paths to everyone else
+            self.open_group(group)
+            for dst in self.fabric.hosts:
+                self.sync_pair(group, dst)
+        else:
+            # A member that was alone in the group now needs a path too
+            for member in self.sources[group]:
+                self.sync_pair(group, member)
+
+    def remove_host(self, name):
+        host = self.fabric.remove_host(name)
+        self.withdraw(self.ingress.pop(name))
+        group = (host.switch, host.vlan)
+        self.sources[group].remove(name)
+        for other in self.sources:
+            self.sync_pair(other, name)
+        if not self.sources[group]:
+            self.close_group(group)
+            for pair in [pair for pair in self.pairs if pair[0] == group]:
+                self.withdraw(self.pairs.pop(pair))
+        else:
+            for member in self.sources[group]:
+                self.sync_pair(group, member)
+        return host
+
+    # New port, leaf and/or VLAN (and IP, when the VLAN's subnet changes)
+    def move_host(self, name, **changes):
+        old = self.remove_host(name)
+        try:
+            self.add_host(replace(old, **changes))
+        except ValueError:
+            self.add_host(old)
+            raise
+
+    # --- PUSH ---
+    def settled(self, key):
+        rule, live = self.rules.get(key), self.installed.get(key)
+        if rule is None or live is None:
+            return rule is live
+        return treatment_key(live) == treatment_key(rule)
+
+    # (rules to post, (key, installed rule) to delete) since the last push.
+    # A rule whose treatment changed is posted again: ONOS modifies it in place.
+    def changes(self):
+        adds, deletes = [], []
+        for key in self.touched:
+            if self.settled(key):
+                continue
+            if key in self.rules:
+                adds.append(self.rules[key])
+            else:
+                deletes.append((key, self.installed[key]))
+        return adds, deletes
+
+    # Post the new/changed rules in bulk, then delete the stale ones in one bulk call.
+    # Flow IDs of rules this compiler didn't push are looked up on their devices.
+    def push(self, client, batch_size=BATCH_SIZE):
+        adds, deletes = self.changes()
+        results = push_serial(client, adds, batch_size)
+        for installed, _ in results.values():
+            for rule, flow_id in installed:
+                self.installed[rule_key(rule)] = rule
+                self.flow_ids[rule_key(rule)] = flow_id
+        missing = {live["deviceId"] for key, live in deletes if key not in self.flow_ids}
+        if missing:
+            live_flows, _ = fetch_live_flows(client, missing)
+            for flows in live_flows.values():
+                for flow in flows:
+                    self.flow_ids.setdefault(rule_key(flow), flow["id"])
+        stale = [(key, live) for key, live in deletes if key in self.flow_ids]
+        deleted = 0
+        if stale and delete_batch(client, [{"deviceId": live["deviceId"], "flowId": self.flow_ids[key]}
+                                           for key, live in stale]):
+            deleted = len(stale)
+            for key, _ in stale:
+                del self.installed[key]
+                del self.flow_ids[key]
+        # Failed posts and deletes stay touched, the next push retries them
+        self.touched = {key for key in self.touched if not self.settled(key)}
+        return results, deleted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add, remove or move one host and push only the rules that change")
+    parser.add_argument("--fabric", default=FABRIC_FILE, help="fabric description the installed rules were compiled from")
+    parser.add_argument("--failover", action="store_true", help="the fabric was installed with --failover")
+    parser.add_argument("--ecmp", action="store_true", help="the fabric was installed with --ecmp")
+    parser.add_argument("--arp-proxy", action="store_true", help="the fabric was installed with --arp-proxy")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rules per bulk POST /onos/v1/flows call")
+    parser.add_argument("--dry-run", action="store_true", help="print the rule changes, push and save nothing")
+    parser.add_argument("--save", help="where to write the updated fabric (default: back to --fabric)")
+    parser.add_argument("--force", action="store_true",
+                        help="save the fabric even if some rules could not be pushed or deleted")
+    add_onos_argument(parser)
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add-host")
+    add.add_argument("name")
+    add.add_argument("--mac", required=True)
+    add.add_argument("--ip", required=True)
+    add.add_argument("--vlan", type=int, required=True)
+    add.add_argument("--switch", required=True, help="leaf the host is attached to")
+    add.add_argument("--port", type=int, required=True, help="port on that leaf")
+    remove = commands.add_parser("remove-host")
+    remove.add_argument("name")
+    move = commands.add_parser("move-host")
+    move.add_argument("name")
+    move.add_argument("--switch")
+    move.add_argument("--port", type=int)
+    move.add_argument("--vlan", type=int)
+    move.add_argument("--ip", help="new address, needed when the new VLAN has another subnet")
+    args = parser.parse_args()
+
+    fabric = load_fabric(args.fabric)
+    compiler = IncrementalCompiler(fabric, failover=args.failover, ecmp=args.ecmp, arp_proxy=args.arp_proxy)
+    start = time.perf_counter()
+    try:
+        if args.command == "add-host":
+            compiler.add_host(Host(args.name, args.mac, args.ip, args.vlan, args.switch, args.port))
+        elif args.command == "remove-host":
+            compiler.remove_host(args.name)
+        else:
+            changes = {field: getattr(args, field) for field in ("switch", "port", "vlan", "ip")
+                       if getattr(args, field) is not None}
+            compiler.move_host(args.name, **changes)
+    except ValueError as e:
+        raise SystemExit(f"{args.command} {args.name}: {e}")
+    adds, deletes = compiler.changes()
+    print(f"{args.command} {args.name}: {len(adds)} rules to add/update, {len(deletes)} to delete "
+          f"(of {len(compiler.rules)}), computed in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for rule in adds:
+        print(f" + {describe_rule(rule)}")
+    for _, rule in deletes:
+        print(f" - {describe_rule(rule)}")
+    if args.dry_run:
+        raise SystemExit(0)
+
+    with OnosClient(*args.onos, AUTH) as client:
+        results, deleted = compiler.push(client, args.batch_size)
+    report_results(results)
+    print(f"Deleted {deleted}/{len(deletes)} stale flow rules")
+    # The saved fabric is what the next run compiles as "installed", so it must match the switches
+    failed = sum(len(errors) for _, errors in results.values()) + len(deletes) - deleted
+    if failed and not args.force:
+        raise SystemExit(f"{failed} rule changes failed, fabric not saved (fix ONOS and retry, or pass --force)")
+    save_fabric(fabric, args.save or args.fabric)
+    print(f"Fabric saved to {args.save or args.fabric}")
@@ -0,0 +1,290 @@
+import argparse
+import time
+
+import requests
+
+from fabric import FABRIC_FILE, load_fabric
+from flow_rules import describe_rule, rule_key, treatment_key
+from metrics import METRICS
+from onos_client import AUTH, OnosClient, add_onos_argument
+from paths import PathEngine, compile_paths, destination_rules, source_groups
+from provisioning import BATCH_SIZE, delete_batch, push_serial, report_results
+from reconcile import fetch_live_flows
+
+# Link-failure daemon: polls ONOS's link list and, when a fabric link goes down
+# or comes back, reroutes only the flows that depend on it.
+#
+# ONOS's REST API has no event stream, so GET /onos/v1/links is polled with the
+# ETag of the last answer: an unchanged topology costs a 304 without a body, and
+# only a changed link set is compared with the previous one. A link is up while
+# ONOS lists it in at least one direction.
+#
+# The installed rules are those of compile_paths() (the same as the default
+# configure-onos-router.py push on a leaf-spine fabric, or --multi-hop), kept per
+# destination leaf, with a reverse index from each fabric link to the rules that
+# output onto it. When a link fails, its rules name the destination leaves to
+# reroute; the path engine rebuilds just those shortest-path trees (in
+# RedundantVlanTopo a leaf cut off from s0a is then reached through s0b), their
+# rules are recompiled and only the ones that differ are pushed, closest to the
+# destination first. Rules no path uses any more are deleted after that. A
+# restored link moves traffic back the same way.
+#
+# The index only ever holds what is on the switches: a destination leaf whose
+# rules could not all be pushed or deleted stays pending, and the link change
+# that caused it is seen again (and the leaf retried) on the next poll.
+#
+# Recovery time is from the poll that saw the change to ONOS acknowledging the
+# last rerouted rule; the failure itself happened up to one --interval earlier.
+
+INTERVAL = 0.5  # seconds between link polls
+
+class LinkWatcher:
+    def __init__(self, fabric, arp_proxy=False):
+        self.fabric = fabric
+        self.arp_proxy = arp_proxy
+        self.engine = PathEngine(fabric)
+        self.groups = source_groups(fabric)
+        self.names = {s.device_id: s.name for s in fabric.switches.values()}
+        # (switch, port) -> link, a link being the frozenset of its two switches
+        self.link_at = {(node, port): frozenset((node, neighbour)) for (node, neighbour), port in fabric.ports.items()}
+        self.links = set(self.link_at.values())
+        self.up = set(self.links)  # links whose state change is fully pushed
+        self.rules = {}     # destination leaf -> {rule_key: installed rule}
+        self.by_link = {}   # link -> {rule_key: destination leaf}
+        self.flow_ids = {}  # rule_key -> flowId
+        self.pending = set()  # destination leaves whose installed rules aren't what the engine wants yet
+        for leaf in {host.switch for host in fabric.hosts.values()}:
+            self.index(leaf, {rule_key(r): r for r in destination_rules(fabric, self.engine, leaf, self.groups,
+                                                                          arp_proxy=arp_proxy)})
+
+    # Replace the rules towards one leaf, keeping the reverse index in step
+    def index(self, leaf, rules):
+        for key, rule in self.rules.get(leaf, {}).items():
+            for link in self.links_of(rule):
+                self.by_link[link].pop(key, None)
+        self.rules[leaf] = rules
+        for key, rule in rules.items():
+            for link in self.links_of(rule):
+                self.by_link.setdefault(link, {})[key] = leaf
+
+    # The fabric links a rule sends packets onto
+    def links_of(self, rule):
+        node = self.names[rule["deviceId"]]
+        return [self.link_at[(node, instruction["port"])] for instruction in rule["treatment"]["instructions"]
+                if instruction["type"] == "OUTPUT" and (node, instruction["port"]) in self.link_at]
+
+    # Flow IDs of the installed rules, so stale ones can be deleted without a lookup
+    # during a reroute. Returns how many of the rules are not on their devices.
+    def load_flow_ids(self, client):
+        live, errors = fetch_live_flows(client, sorted(set(self.names)))
+        for device_id, error in errors.items():
+            METRICS.fail(device_id, "read")
+            METRICS.event("flows_unreadable", f" [WARN] {device_id}: could not read live flows. Error: {error}",
+                          device=device_id, error=error)
+        for flows in live.values():
+            for flow in flows:
+                self.flow_ids.setdefault(rule_key(flow), flow["id"])
+        return sum(1 for found in self.rules.values() for key in found if key not in self.flow_ids)
+
+    # --- LINK STATE ---
+    # Fabric links in an ONOS /links answer
+    def links_in(self, links):
+        found = set()
+        for link in links:
+            if link.get("state", "ACTIVE") != "ACTIVE":
+                continue
+            src, dst = link["src"], link["dst"]
+            ends = [(self.names.get(src["device"]), int(src["port"])), (self.names.get(dst["device"]), int(dst["port"]))]
+            fabric_link = self.link_at.get(ends[0])
+            if fabric_link and fabric_link == self.link_at.get(ends[1]):
+                found.add(fabric_link)
+        return found
+
+    # Mark the destination leaves `link` going down or up reroutes as pending
+    def reroute(self, link, up):
+        node1, node2 = sorted(link)
+        # The index names the destinations whose paths cross a failed link; the engine
+        # confirms them and finds those a restored link shortens
+        crossing = set() if up else set(self.by_link.get(link, {}).values())
+        affected = crossing | set(self.engine.set_link(node1, node2, up))
+        self.pending |= affected
+        return len(affected)
+
+    # Rules to push and (key, rule) to delete for every pending leaf, and what each leaf should end up with
+    def changes(self):
+        adds, deletes, wanted = [], [], {}
+        for leaf in sorted(self.pending, key=self.engine.order.get):
+            old = self.rules[leaf]
+            new = wanted[leaf] = {rule_key(r): r for r in destination_rules(self.fabric, self.engine, leaf, self.groups,
+                                                                            arp_proxy=self.arp_proxy)}
+            distance = self.engine.distances[leaf]
+            changed = [r for key, r in new.items() if key not in old or treatment_key(old[key]) != treatment_key(r)]
+            adds += sorted(changed, key=lambda r: distance.get(self.names[r["deviceId"]], len(distance)))
+            deletes += [(key, rule) for key, rule in old.items() if key not in new]
+        return adds, deletes, wanted
+
+    # Index what each leaf now really has; a leaf is settled once that is all it wanted
+    def commit(self, wanted, installed, gone):
+        for leaf, new in wanted.items():
+            rules = {key: rule for key, rule in self.rules[leaf].items() if key not in gone}
+            rules.update((key, new[key]) for key in installed if key in new)
+            self.index(leaf, rules)
+            if rules.keys() == new.keys() and all(treatment_key(rules[key]) == treatment_key(r) for key, r in new.items()):
+                self.pending.discard(leaf)
+
+    # Push the rerouted rules, then delete the stale ones; failures leave their leaf pending.
+    # Returns (results, deleted).
+    def apply(self, client, adds, deletes, wanted, batch_size=BATCH_SIZE):
+        results = push_serial(client, adds, batch_size)
+        installed = set()
+        for ok, _ in results.values():
+            for rule, flow_id in ok:
+                installed.add(rule_key(rule))
+                self.flow_ids[rule_key(rule)] = flow_id
+        # Without a flow ID the rule was never installed, nothing to delete
+        gone = {key for key, _ in deletes if key not in self.flow_ids}
+        stale = [(key, rule) for key, rule in deletes if key in self.flow_ids]
+        deleted = 0
+        # A failed delete keeps its flow IDs, so the leaf stays pending and the next poll retries it
+        if stale and delete_batch(client, [{"deviceId": rule["deviceId"], "flowId": self.flow_ids[key]}
+                                           for key, rule in stale]):
+            deleted = len(stale)
+            for key, _ in stale:
+                gone.add(key)
+                del self.flow_ids[key]
+        self.commit(wanted, installed, gone)
+        return results, deleted
+
+    # One link change, end to end, timed from `detected` (perf_counter of the poll that saw it).
+    # Leaves still pending from an earlier failure are retried along with it.
+    # Returns True when nothing is left pending.
+    def handle(self, client, link, up, detected, batch_size=BATCH_SIZE, dry_run=False):
+        name = '-'.join(sorted(link))
+        start = time.perf_counter()
+        affected = self.reroute(link, up)
+        adds, deletes, wanted = self.changes()
+        computed = time.perf_counter()
+        if dry_run:
+            for rule in adds:
+                print(f" + {describe_rule(rule)}")
+            for _, rule in deletes:
+                print(f" - {describe_rule(rule)}")
+            self.commit(wanted, {rule_key(rule) for rule in adds}, {key for key, _ in deletes})
+            results, deleted = {}, 0
+        else:
+            results, deleted = self.apply(client, adds, deletes, wanted, batch_size)
+            report_results(results)
+        recovered = time.perf_counter()
+        failed = sum(len(bad) for _, bad in results.values())
+        METRICS.observe('reroute', recovered - detected)
+        METRICS.event("link_up" if up else "link_down",
+                      f"Link {name} {'up' if up else 'down'}: {len(adds)} rules rerouted, {deleted}/{len(deletes)} "
+                      f"stale deleted for {affected} destination leaves, recovered in "
+                      f"{(recovered - detected) * 1000:.1f} ms (compute {(computed - start) * 1000:.1f} ms, "
+                      f"push {(recovered - computed) * 1000:.1f} ms)" + (f", {failed} rules failed" if failed else ""),
+                      link=name, up=up, rerouted=len(adds), deleted=deleted, destinations=affected, failed=failed,
+                      recovery_ms=round((recovered - detected) * 1000, 3),
+                      compute_ms=round((computed - start) * 1000, 3))
+        return not self.pending
+
+
+# --- POLLING ---
+# Poll ONOS every `interval` seconds and handle every link change; `polls` > 0 stops after that many polls.
+# A link's new state is only taken on once its rules are in, and the ETag only
+# moves on when every change is, so the next poll sees an unfinished one again.
+def watch(client, watcher, interval=INTERVAL, polls=0, batch_size=BATCH_SIZE, dry_run=False, etag=None):
+    done = 0
+    while not polls or done < polls:
+        started = time.perf_counter()
+        done += 1
+        try:
+            response = client.get_links(etag=etag, timeout=(3.05, max(interval, 1)))
+        except requests.RequestException as e:
+            METRICS.fail('all', "links")
+            METRICS.event("links_failed", f" [WARN] GET /links failed: {e}", error=str(e))
+            response = None
+        if response is not None and response.status_code == 200:
+            detected = time.perf_counter()
+            up = watcher.links_in(response.json().get("links", []))
+            # Also links the engine already routes as changed when the push failed, in case they flipped back since
+            routed = watcher.links - watcher.engine.down
+            changed = (watcher.up ^ up) | (routed ^ up)
+            # A link whose change isn't fully pushed is left in its old state, and the next poll retries it
+            for link in sorted(changed - up, key=sorted):
+                if watcher.handle(client, link, False, detected, batch_size, dry_run):
+                    watcher.up.discard(link)
+                else:
+                    watcher.up.add(link)
+            for link in sorted(changed & up, key=sorted):
+                if watcher.handle(client, link, True, detected, batch_size, dry_run):
+                    watcher.up.add(link)
+                else:
+                    watcher.up.discard(link)
+            if not watcher.pending and watcher.up == up == watcher.links - watcher.engine.down:
+                etag = response.headers.get('ETag')
+        elif response is not None and response.status_code != 304:
+            METRICS.fail('all', "links")
+            METRICS.event("links_failed", f" [WARN] GET /links: HTTP {response.status_code} {response.text}",
+                          status=response.status_code, error=response.text)
+        if not polls or done < polls:
+            time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+    return etag
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch the fabric links in ONOS and reroute only the flows a failed link carried")
+    parser.add_argument("--fabric", default=FABRIC_FILE,
+                        help="fabric description the installed rules were compiled from "
+                             "(../TopoWithRedundancy/fabric.json for RedundantVlanTopo)")
+    parser.add_argument("--arp-proxy", action="store_true", help="the fabric was installed with --arp-proxy")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="seconds between link polls")
+    parser.add_argument("--polls", type=int, default=0, help="stop after this many polls (0: run until interrupted)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rules per bulk POST /onos/v1/flows call")
+    parser.add_argument("--dry-run", action="store_true", help="print the rule changes of each link event, push nothing")
+    parser.add_argument("--log-json", metavar="FILE", help="append every link event (with its recovery time) to FILE as JSON lines")
+    parser.add_argument("--mock", nargs=2, metavar=("NODE1", "NODE2"),
+                        help="against a local mock ONOS holding the fabric's rules: fail this link, then restore it")
+    add_onos_argument(parser)
+    args = parser.parse_args()
+    if args.log_json:
+        METRICS.open_log(args.log_json)
+    METRICS.verbose = False
+
+    fabric = load_fabric(args.fabric)
+    start = time.perf_counter()
+    watcher = LinkWatcher(fabric, args.arp_proxy)
+    print(f"Indexed {sum(len(r) for r in watcher.rules.values())} rules over {len(watcher.by_link)} links "
+          f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    mock = None
+    if args.mock:
+        from mock_onos import MockOnos
+        mock = MockOnos(fabric=fabric).start()
+        args.onos = mock.address[0], str(mock.address[1])
+    with OnosClient(*args.onos, AUTH) as client:
+        if mock:
+            push_serial(client, compile_paths(fabric, arp_proxy=args.arp_proxy), args.batch_size)
+        missing = watcher.load_flow_ids(client)
+        if missing:
+            METRICS.event("rules_missing", f" [WARN] {missing} of the compiled rules are not installed "
+                          f"(run configure-onos-router.py{' --arp-proxy' if args.arp_proxy else ''} first)",
+                          missing=missing)
+        print(f"Watching {len(watcher.up)} links every {args.interval}s")
+        try:
+            if mock:
+                etag = watch(client, watcher, args.interval, 1, args.batch_size, args.dry_run)
+                mock.store.set_topology(fabric, down=[args.mock])
+                etag = watch(client, watcher, args.interval, 1, args.batch_size, args.dry_run, etag)
+                mock.store.set_topology(fabric)
+                watch(client, watcher, args.interval, 1, args.batch_size, args.dry_run, etag)
+            else:
+                watch(client, watcher, args.interval, args.polls, args.batch_size, args.dry_run)
+        except KeyboardInterrupt:
+            pass
+    if mock:
+        mock.stop()
+    reroute = METRICS.snapshot()["phases"].get("reroute")
+    if reroute:
+        print(f"Link events: {reroute['count']}, recovery p50 {reroute['p50_s'] * 1000:.1f} ms, "
+              f"max {reroute['max_s'] * 1000:.1f} ms")
+    METRICS.close_log()
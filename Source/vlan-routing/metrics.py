@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Instrumentation shared by the provisioning pipeline: per-phase timing
+# histograms (rule building, JSON serialisation, HTTP round trips, response
+# handling), per-device request latencies and failure counts, and a structured
+# JSON-lines event log. Everything goes to the module-level METRICS registry, which
+# configure-onos-router.py summarises at the end and can dump in the Prometheus
+# text format (--prometheus) for node_exporter's textfile collector or a pushgateway.
+#
+# Reading the phases: 'build', 'serialise' and 'response' are our own code,
+# 'http' is the network plus ONOS. Running the same push against mock_onos.py
+# gives the http time of a controller that does no work, so the rest is ONOS.
+
+# Histogram bucket upper bounds in seconds (Prometheus style, cumulative on export)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = 'vlan_routing'
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    # Upper bound of the bucket holding the q-quantile (the max for the +Inf bucket)
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.verbose = True  # print the messages of per-rule (detail) events too
+        self.log = None    # open JSON-lines file, see open_log()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.phases = {}    # phase -> Histogram
+            self.requests = {}  # device id (or 'mixed') -> Histogram
+            self.failures = {}  # (device id, reason) -> count
+            self.counters = {}  # name -> value
+
+    # --- RECORDING ---
+    def observe(self, phase, seconds):
+        with self.lock:
+            self.phases.setdefault(phase, Histogram()).observe(seconds)
+
+    @contextmanager
+    def timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start)
+
+    # One REST call: its latency under 'http' and per device, failures counted per device
+    def request(self, device, seconds, failure=None):
+        with self.lock:
+            self.phases.setdefault('http', Histogram()).observe(seconds)
+            self.requests.setdefault(device, Histogram()).observe(seconds)
+            if failure:
+                self.failures[(device, failure)] = self.failures.get((device, failure), 0) + 1
+
+    def fail(self, device, reason, count=1):
+        with self.lock:
+            self.failures[(device, reason)] = self.failures.get((device, reason), 0) + count
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # --- EVENT LOG ---
+    def open_log(self, path):
+        self.log = open(path, 'a')
+
+    def close_log(self):
+        if self.log:
+            self.log.close()
+            self.log = None
+
+    # One structured event: a JSON line in the log (if open) and `message` on the console.
+    # detail=True marks per-rule events, which stay off the console unless verbose.
+    def event(self, name, message=None, detail=False, **fields):
+        if self.log:
+            line = json.dumps(dict({"time": round(time.time(), 6), "event": name}, **fields))
+            with self.lock:
+                self.log.write(line + '\n')
+        if message and (self.verbose or not detail):
+            print(message)
+
+    # --- OUTPUT ---
+    def snapshot(self):
+        with self.lock:
+            return {
+                "phases": {phase: self.summarise(h) for phase, h in self.phases.items()},
+                "devices": {device: dict(self.summarise(h), failures=sum(
+                    n for (d, _), n in self.failures.items() if d == device))
+                    for device, h in self.requests.items()},
+                "failures": [{"device": d, "reason": r, "count": n} for (d, r), n in self.failures.items()],
+                "counters": dict(self.counters),
+            }
+
+    @staticmethod
+    def summarise(histogram):
+        return {"count": histogram.count, "total_s": round(histogram.sum, 6),
+                "p50_s": round(histogram.quantile(0.5), 6), "p95_s": round(histogram.quantile(0.95), 6),
+                "max_s": round(histogram.max, 6)}
+
+    def print_summary(self, devices=10):
+        snapshot = self.snapshot()
+        print(f"{'phase':<10} {'count':>7} {'total ms':>10} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+        for phase, s in snapshot["phases"].items():
+            print(f"{phase:<10} {s['count']:>7} {s['total_s'] * 1000:>10.1f} {s['p50_s'] * 1000:>8.1f} "
+                  f"{s['p95_s'] * 1000:>8.1f} {s['max_s'] * 1000:>8.1f}")
+        # Slowest devices first
+        slowest = sorted(snapshot["devices"].items(), key=lambda item: -item[1]["total_s"])[:devices]
+        for device, s in slowest:
+            print(f" {device}: {s['count']} requests, p95 {s['p95_s'] * 1000:.1f} ms, "
+                  f"max {s['max_s'] * 1000:.1f} ms, {s['failures']} failures")
+
+    # Prometheus text exposition format
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for name, label, histograms in (('phase_seconds', 'phase', self.phases),
+                                            ('request_seconds', 'device', self.requests)):
+                metric = f'{PREFIX}_{name}'
+                lines += [f'# HELP {metric} Time spent per {label}', f'# TYPE {metric} histogram']
+                for value, h in histograms.items():
+                    cumulative = 0
+                    for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_sum{{{label}="{value}"}} {h.sum}')
+                    lines.append(f'{metric}_count{{{label}="{value}"}} {h.count}')
+            metric = f'{PREFIX}_failures_total'
+            lines += [f'# HELP {metric} Failed requests and rules', f'# TYPE {metric} counter']
+            lines += [f'{metric}{{device="{d}",reason="{r}"}} {n}' for (d, r), n in self.failures.items()]
+            for name, value in self.counters.items():
+                lines += [f'# TYPE {PREFIX}_{name} counter', f'{PREFIX}_{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # Written to a temp file and renamed, so a scraper never reads half a file
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.prometheus())
+        os.replace(path + '.tmp', path)
+
+METRICS = Metrics()
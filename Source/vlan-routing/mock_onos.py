@@ -0,0 +1,294 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from flow_rules import rule_key
+
+# Local stand-in for the ONOS /onos/v1/flows, /onos/v1/groups and /onos/v1/statistics/ports
+# REST API, for benchmarks and dry runs. Given a fabric it also answers /devices,
+# /links and /hosts the way ONOS reports that network (with ETags, for discovery.py).
+# Installed flows and groups are kept in memory per device; flow IDs are handed out sequentially.
+# As in ONOS, posting a rule with the same device/table/priority/selector as an
+# installed flow modifies that flow in place and keeps its ID.
+# Every flow carries synthetic packet/byte counters that grow with its age, at a
+# heavy-tailed rate (a few elephants, many mice), and port counters add up the
+# flows entering and leaving each port.
+# Latency and 503 errors can be injected, and every request is counted in `stats`.
+
+class MockOnosHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real ONOS Jetty server
+    # Headers and body go out in separate writes; without TCP_NODELAY every
+    # answer would wait ~40 ms on the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    # Count the request, wait the configured latency, and maybe fail it.
+    # Returns True when the request was answered with an injected 503.
+    def _simulate(self, body_bytes):
+        server = self.server
+        time.sleep(server.latency)
+        failed = random.random() < server.error_rate
+        with server.stats_lock:
+            server.stats["requests"] += 1
+            server.stats["bytes_received"] += body_bytes
+            server.stats["errors_injected"] += failed
+        if failed:
+            self._reply(503, {"code": 503, "message": "injected error"})
+        return failed
+
+    def _parts(self):
+        # /onos/v1/flows/<device>/<flowId> -> ['flows', '<device>', '<flowId>']
+        path = self.path.split('?', 1)[0]
+        return path[len('/onos/v1/'):].strip('/').split('/')
+
+    def do_POST(self):
+        parts = self._parts()
+        body = self._read_json()
+        if self._simulate(int(self.headers.get('Content-Length', 0))):
+            return
+        if parts[0] == 'groups' and len(parts) == 2:
+            group = self.server.store.add_group(parts[1], body)
+            self.send_response(201)
+            self.send_header('Location', f'/onos/v1/groups/{parts[1]}/{group["appCookie"]}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if parts[0] != 'flows':
+            return self._reply(404)
+        # Like ONOS, flows posted without ?appId= belong to org.onosproject.rest
+        app_id = parse_qs(urlsplit(self.path).query).get('appId', ["org.onosproject.rest"])[0]
+        if len(parts) == 1:
+            flows = [self.server.store.add(rule["deviceId"], rule, app_id) for rule in body.get("flows", [])]
+            return self._reply(200, {"flows": flows})
+        flow = self.server.store.add(parts[1], body, app_id)
+        self.send_response(201)
+        self.send_header('Location', f'/onos/v1/flows/{flow["deviceId"]}/{flow["flowId"]}')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        parts = self._parts()
+        if self._simulate(0):
+            return
+        if parts[0] == 'groups':
+            return self._reply(200, {"groups": self.server.store.list_groups(parts[1] if len(parts) > 1 else None)})
+        if parts[:2] == ['statistics', 'ports']:
+            return self._reply(200, {"statistics": self.server.store.port_stats(parts[2] if len(parts) > 2 else None)})
+        if parts[0] in ('devices', 'links', 'hosts') and len(parts) == 1:
+            body = {parts[0]: self.server.store.topology[parts[0]]}
+            etag = '"%s"' % hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest()[:16]
+            if self.headers.get('If-None-Match') == etag:
+                return self._reply(304, headers={'ETag': etag})
+            return self._reply(200, body, headers={'ETag': etag})
+        if parts[0] != 'flows':
+            return self._reply(404)
+        self._reply(200, {"flows": self.server.store.list(parts[1] if len(parts) > 1 else None)})
+
+    def do_DELETE(self):
+        parts = self._parts()
+        body = self._read_json()
+        if self._simulate(int(self.headers.get('Content-Length', 0))):
+            return
+        if parts[0] == 'groups' and len(parts) == 3:
+            return self._reply(204 if self.server.store.remove_group(parts[1], parts[2]) else 404)
+        if parts[0] != 'flows':
+            return self._reply(404)
+        if len(parts) == 1:
+            for flow in body.get("flows", []):
+                self.server.store.remove(flow["deviceId"], flow["flowId"])
+            return self._reply(204)
+        if len(parts) != 3:
+            return self._reply(404)
+        self._reply(204 if self.server.store.remove(parts[1], parts[2]) else 404)
+
+
+class FlowStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.flows = {}  # deviceId -> {flowId: flow}
+        self.groups = {}  # deviceId -> {appCookie: group}
+        self.traffic = {}  # flowId -> (install time, packets/s, packet size)
+        self.keys = {}  # rule_key -> flowId
+        self.topology = {"devices": [], "links": [], "hosts": []}  # see set_topology()
+
+    def add(self, device_id, rule, app_id="org.onosproject.rest"):
+        flow = dict(rule, deviceId=device_id, state="ADDED", appId=app_id)
+        key = rule_key(flow)
+        with self.lock:
+            if key in self.keys:
+                flow_id = self.keys[key]
+                self.flows[device_id][flow_id] = dict(flow, id=flow_id)
+                return {"deviceId": device_id, "flowId": flow_id}
+            flow_id = str(self.next_id)
+            self.next_id += 1
+            self.keys[key] = flow_id
+            self.flows.setdefault(device_id, {})[flow_id] = dict(flow, id=flow_id)
+            # Seeded by the flow ID, so the same flow always gets the same rate
+            rng = random.Random(flow_id)
+            self.traffic[flow_id] = (time.monotonic(), min(rng.paretovariate(1.2) * 10, 100000),
+                                     rng.choice((64, 576, 1500)))
+        return {"deviceId": device_id, "flowId": flow_id}
+
+    # Cumulative counters of a flow, like the packets/bytes/life fields of a real ONOS flow entry
+    def counters(self, flow_id, now):
+        installed, rate, size = self.traffic[flow_id]
+        life = now - installed
+        packets = int(life * rate)
+        return {"life": int(life), "packets": packets, "bytes": packets * size}
+
+    def list(self, device_id=None):
+        now = time.monotonic()
+        with self.lock:
+            devices = [device_id] if device_id else list(self.flows)
+            return [dict(flow, **self.counters(flow["id"], now))
+                    for dev in devices for flow in self.flows.get(dev, {}).values()]
+
+    # ONOS /statistics/ports body: per device, cumulative counters per port.
+    # A port receives what its IN_PORT flows match and sends what OUTPUT flows send to it.
+    def port_stats(self, device_id=None):
+        statistics = []
+        for dev in ([device_id] if device_id else list(self.flows)):
+            ports = {}
+            for flow in self.list(dev):
+                in_ports = [c["port"] for c in flow["selector"]["criteria"] if c["type"] == "IN_PORT"]
+                out_ports = [i["port"] for i in flow["treatment"]["instructions"] if i["type"] == "OUTPUT"]
+                for port, direction in [(p, "Received") for p in in_ports] + [(p, "Sent") for p in out_ports]:
+                    if not str(port).isdigit():
+                        continue  # CONTROLLER, IN_PORT, ...
+                    counters = ports.setdefault(str(port), {
+                        "port": int(port), "packetsReceived": 0, "packetsSent": 0, "bytesReceived": 0,
+                        "bytesSent": 0, "packetsRxDropped": 0, "packetsTxDropped": 0, "durationSec": flow["life"],
+                    })
+                    counters["packets" + direction] += flow["packets"]
+                    counters["bytes" + direction] += flow["bytes"]
+            statistics.append({"device": dev, "ports": list(ports.values())})
+        return statistics
+
+    # The fabric as ONOS reports it: every link once per direction, hosts untagged
+    # (the VLAN is pushed by the leaf) with upper-case MACs, ports as strings.
+    # Links in `down` ((node1, node2) pairs) are left out, as ONOS drops a failed link.
+    def set_topology(self, fabric, down=()):
+        devices = [{"id": s.device_id, "type": "SWITCH", "available": True, "role": "MASTER",
+                    "chassisId": str(int(s.dpid, 16)), "annotations": {"protocol": "OF_13"}}
+                   for s in fabric.switches.values()]
+        down = {frozenset(pair) for pair in down}
+        links = []
+        for link in fabric.links:
+            if frozenset((link.node1, link.node2)) in down:
+                continue
+            ends = [(fabric.switches[link.node1].device_id, link.port1), (fabric.switches[link.node2].device_id, link.port2)]
+            for (src, src_port), (dst, dst_port) in (ends, ends[::-1]):
+                links.append({"src": {"port": str(src_port), "device": src}, "dst": {"port": str(dst_port), "device": dst},
+                              "type": "DIRECT", "state": "ACTIVE"})
+        hosts = [{"id": f"{h.mac.upper()}/None", "mac": h.mac.upper(), "vlan": "None", "configured": False,
+                  "ipAddresses": [h.ip],
+                  "locations": [{"elementId": fabric.switches[h.switch].device_id, "port": str(h.port)}]}
+                 for h in fabric.hosts.values()]
+        with self.lock:
+            self.topology = {"devices": devices, "links": links, "hosts": hosts}
+
+    def remove(self, device_id, flow_id):
+        with self.lock:
+            flow = self.flows.get(device_id, {}).pop(flow_id, None)
+            if flow is None:
+                return False
+            del self.keys[rule_key(flow)]
+            del self.traffic[flow_id]
+            return True
+
+    # Like ONOS, re-adding a group with a known appCookie keeps the existing one
+    def add_group(self, device_id, group):
+        with self.lock:
+            groups = self.groups.setdefault(device_id, {})
+            if group["appCookie"] not in groups:
+                groups[group["appCookie"]] = dict(group, deviceId=device_id, state="ADDED")
+            return groups[group["appCookie"]]
+
+    def list_groups(self, device_id=None):
+        with self.lock:
+            devices = [device_id] if device_id else list(self.groups)
+            return [group for dev in devices for group in self.groups.get(dev, {}).values()]
+
+    def remove_group(self, device_id, app_cookie):
+        with self.lock:
+            return self.groups.get(device_id, {}).pop(app_cookie, None) is not None
+
+
+# latency: seconds every request takes to answer, like a busy controller
+# error_rate: fraction of requests answered with 503 instead
+class MockOnos:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, fabric=None):
+        self.server = ThreadingHTTPServer((host, port), MockOnosHandler)
+        self.server.daemon_threads = True
+        self.server.store = FlowStore()
+        if fabric:
+            self.server.store.set_topology(fabric)
+        self.server.latency = latency
+        self.server.error_rate = error_rate
+        self.server.stats_lock = threading.Lock()
+        self.server.stats = {"requests": 0, "bytes_received": 0, "errors_injected": 0}
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address  # (ip, port), port is picked by the OS when 0
+
+    @property
+    def store(self):
+        return self.server.store
+
+    @property
+    def stats(self):
+        with self.server.stats_lock:
+            return dict(self.server.stats)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+    from fabric import load_fabric
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the ONOS flows, groups and port statistics REST API")
+    parser.add_argument("--port", type=int, default=8181)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failed with 503")
+    parser.add_argument("--fabric", help="answer /devices, /links and /hosts as if this fabric were connected")
+    args = parser.parse_args()
+    mock = MockOnos(port=args.port, latency=args.latency, error_rate=args.error_rate,
+                    fabric=load_fabric(args.fabric) if args.fabric else None)
+    print(f"Mock ONOS listening on http://{mock.address[0]}:{mock.address[1]}/onos/v1")
+    mock.server.serve_forever()
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from flow_rules import (
+    build_arp_punt,
+    build_arp_responder,
+    build_ingress_rule,
+    build_intra_switch_route,
+    build_l2_remote_forwarding,
+    build_l3_remote_routing,
+    describe_rule,
+)
+from metrics import METRICS
+from onos_client import APP_ID
+
+# asyncio counterpart of OnosClient (onos_client.py) for pushing many rules from one
+# process without threads, or from inside an existing async service.
+# At most `max_in_flight` requests are outstanding at once; the rest wait their turn.
+class AsyncOnosClient:
+    def __init__(self, ip, port, auth, max_in_flight=16, retries=3, backoff=0.2, timeout=10, app_id=APP_ID):
+        self.base_url = f'http://{ip}:{port}/onos/v1'
+        self.app_params = {'appId': app_id}  # query string of every flow POST
+        self.auth = aiohttp.BasicAuth(*auth)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_in_flight = max_in_flight
+        self.in_flight = None
+        self.session = None
+
+    async def open(self):
+        # Created here so they belong to the running event loop
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        # One keep-alive connection per allowed in-flight request
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+        self.session = aiohttp.ClientSession(
+            auth=self.auth, timeout=self.timeout, connector=connector,
+            headers={'Content-Type': 'application/json', 'Accept': 'application/json'}
+        )
+        return self
+
+    async def close(self):
+        await self.session.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # Retries 5xx answers and connection errors with exponential backoff, like OnosClient.
+    # Every attempt is timed into METRICS under `device`, the same way OnosClient does.
+    # Returns (status, parsed JSON body, the raw text if it isn't JSON, or None).
+    async def request(self, method, path, body=None, device='all', params=None):
+        with METRICS.timed('serialise'):
+            data = json.dumps(body) if body is not None else None
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.in_flight:
+                    start = time.perf_counter()
+                    async with self.session.request(method, self.base_url + path, data=data,
+                                                    params=params) as response:
+                        text = await response.text()
+                    METRICS.request(device, time.perf_counter() - start,
+                                    failure=f'http {response.status}' if response.status >= 400 else None)
+                    if response.status < 500 or attempt == self.retries:
+                        with METRICS.timed('response'):
+                            try:
+                                return response.status, json.loads(text) if text else None
+                            except ValueError:
+                                # Proxy error pages and the like
+                                return response.status, text
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                METRICS.request(device, time.perf_counter() - start, failure=type(e).__name__)
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def post_flow(self, device_id, rule):
+        return await self.request('POST', f'/flows/{device_id}', rule, device=device_id, params=self.app_params)
+
+    async def post_flows(self, rules):
+        devices = {rule["deviceId"] for rule in rules}
+        return await self.request('POST', '/flows', {"flows": rules}, device=devices.pop() if len(devices) == 1 else 'mixed',
+                                  params=self.app_params)
+
+    async def get_flows(self, device_id=None):
+        return await self.request('GET', f'/flows/{device_id}' if device_id else '/flows', device=device_id or 'all')
+
+    async def delete_flow(self, device_id, flow_id):
+        return await self.request('DELETE', f'/flows/{device_id}/{flow_id}', device=device_id)
+
+    # Push many rules, one POST per rule, all pipelined through the in-flight limit.
+    # Returns [(rule, status)] in input order. A rule whose request failed even after
+    # the retries gets the error's name as its status, so one dead connection fails
+    # that rule only instead of the whole push.
+    async def push_rules(self, rules):
+        replies = await asyncio.gather(*(self.post_flow(rule["deviceId"], rule) for rule in rules),
+                                       return_exceptions=True)
+        return [(rule, type(reply).__name__ if isinstance(reply, BaseException) else reply[0])
+                for rule, reply in zip(rules, replies)]
+
+    # Same, but batch_size rules per bulk POST /onos/v1/flows call, batches pipelined.
+    # Returns [(batch, status, body)], a failed request giving (batch, error name, error text).
+    async def push_rules_bulk(self, rules, batch_size=50):
+        batches = [rules[i:i + batch_size] for i in range(0, len(rules), batch_size)]
+        replies = await asyncio.gather(*(self.post_flows(batch) for batch in batches), return_exceptions=True)
+        return [(batch, type(reply).__name__, str(reply)) if isinstance(reply, BaseException) else (batch, *reply)
+                for batch, reply in zip(batches, replies)]
+
+
+# --- ASYNC PROVISIONING ---
+# Async versions of the rule builders in flow_rules.py: build, push, return [(rule, status)].
+# Build time goes to the 'build' phase, every rule ONOS refused is logged as a flow_failed event.
+
+async def provision(client, build, *args, **kwargs):
+    with METRICS.timed('build'):
+        rules = build(*args, **kwargs)
+    results = await client.push_rules(rules if isinstance(rules, list) else [rules])
+    for rule, status in results:
+        if status not in (200, 201):
+            METRICS.fail(rule["deviceId"], "rule")
+            METRICS.event("flow_failed", f" [FAIL] {describe_rule(rule)} "
+                          f"{f'HTTP {status}' if isinstance(status, int) else status}",
+                          device=rule["deviceId"], rule=describe_rule(rule), status=status)
+    return results
+
+async def provision_ingress_rule(client, device_id, host_port, vlan_id):
+    return await provision(client, build_ingress_rule, device_id, host_port, vlan_id)
+
+async def provision_intra_switch_route(client, **kwargs):
+    return await provision(client, build_intra_switch_route, **kwargs)
+
+async def provision_l2_remote_forwarding(client, **kwargs):
+    return await provision(client, build_l2_remote_forwarding, **kwargs)
+
+async def provision_l3_remote_routing(client, **kwargs):
+    return await provision(client, build_l3_remote_routing, **kwargs)
+
+async def provision_arp_punt(client, device_id):
+    return await provision(client, build_arp_punt, device_id)
+
+async def provision_arp_responder(client, device_id, vlan_id, ip, mac):
+    return await provision(client, build_arp_responder, device_id, vlan_id, ip, mac)
@@ -0,0 +1,152 @@
+import argparse
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import METRICS
+from rule_templates import dumps
+
+# ONOS tags every flow with the appId it was posted under. The vlan-routing pipeline
+# posts under this one so --reconcile and flow_stats.py only ever see their own
+# flows; other tools sharing the client (acl.py) pass their own app_id.
+APP_ID = 'vlan-routing'
+
+# Where the tools find ONOS unless --onos says otherwise
+ONOS_IP = '172.17.0.5'
+ONOS_PORT = '8181'
+AUTH = ('onos', 'rocks')
+
+# --onos HOST[:PORT], parsed to (host, port) with ONOS_PORT when no port is given
+def onos_address(value):
+    host, _, port = value.partition(':')
+    if not host or (port and not port.isdigit()):
+        raise argparse.ArgumentTypeError(f"expected HOST or HOST:PORT, got {value!r}")
+    return host, port or ONOS_PORT
+
+def add_onos_argument(parser):
+    parser.add_argument("--onos", type=onos_address, default=(ONOS_IP, ONOS_PORT), metavar="HOST[:PORT]",
+                        help=f"ONOS REST API to talk to (default: {ONOS_IP}:{ONOS_PORT})")
+
+# Small ONOS REST client shared by the vlan-routing tooling.
+# One keep-alive Session per client, so every call reuses pooled TCP connections
+# and the basic auth header instead of opening a new socket per flow rule.
+class OnosClient:
+    def __init__(self, ip, port, auth, pool_size=10, retries=3, backoff=0.2, timeout=(3.05, 10), app_id=APP_ID):
+        self.base_url = f'http://{ip}:{port}/onos/v1'
+        self.timeout = timeout  # (connect, read) seconds, used unless a call passes its own
+        self.app_params = {'appId': app_id}  # query string of every flow POST
+
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        })
+
+        # Retry 5xx answers and dropped/reset connections with exponential backoff.
+        # Flow POSTs are safe to repeat: ONOS derives the flow ID from the rule itself.
+        retry = Retry(
+            total=retries, connect=retries, read=retries, status=retries,
+            backoff_factor=backoff,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=frozenset(['GET', 'POST', 'DELETE']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    # Every call is timed into METRICS under the device it is for ('mixed' for bulk
+    # calls spanning several devices, 'all' for fabric-wide reads)
+    def request(self, method, path, timeout=None, device='all', **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=timeout or self.timeout, **kwargs)
+        except requests.RequestException as e:
+            METRICS.request(device, time.perf_counter() - start, failure=type(e).__name__)
+            raise
+        METRICS.request(device, time.perf_counter() - start,
+                        failure=f'http {response.status_code}' if response.status_code >= 400 else None)
+        return response
+
+    # Compact JSON, through orjson when it is installed
+    @staticmethod
+    def serialise(body):
+        with METRICS.timed('serialise'):
+            return dumps(body)
+
+    @staticmethod
+    def device_of(entries):
+        devices = {entry["deviceId"] for entry in entries}
+        return devices.pop() if len(devices) == 1 else 'mixed'
+
+    # --- FLOWS ---
+    def post_flow(self, device_id, rule, timeout=None):
+        return self.request('POST', f'/flows/{device_id}', data=self.serialise(rule), timeout=timeout, device=device_id,
+                            params=self.app_params)
+
+    # Bulk install, body is {"flows": [...]}
+    def post_flows(self, rules, timeout=None):
+        return self.request('POST', '/flows', data=self.serialise({"flows": rules}), timeout=timeout,
+                            device=self.device_of(rules), params=self.app_params)
+
+    # Bulk install of an already serialised body (rule_templates.render_body)
+    def post_flows_body(self, body, device='mixed', timeout=None):
+        return self.request('POST', '/flows', data=body.encode(), timeout=timeout, device=device,
+                            params=self.app_params)
+
+    def get_flows(self, device_id=None, timeout=None):
+        path = f'/flows/{device_id}' if device_id else '/flows'
+        return self.request('GET', path, timeout=timeout, device=device_id or 'all')
+
+    def delete_flow(self, device_id, flow_id, timeout=None):
+        return self.request('DELETE', f'/flows/{device_id}/{flow_id}', timeout=timeout, device=device_id)
+
+    # Bulk delete, body is {"flows": [{"deviceId": ..., "flowId": ...}]}
+    def delete_flows(self, flows, timeout=None):
+        return self.request('DELETE', '/flows', data=self.serialise({"flows": flows}), timeout=timeout,
+                            device=self.device_of(flows))
+
+    # --- GROUPS ---
+    def post_group(self, device_id, group, timeout=None):
+        return self.request('POST', f'/groups/{device_id}', data=self.serialise(group), timeout=timeout, device=device_id)
+
+    def get_groups(self, device_id=None, timeout=None):
+        path = f'/groups/{device_id}' if device_id else '/groups'
+        return self.request('GET', path, timeout=timeout, device=device_id or 'all')
+
+    # ONOS keys groups by appCookie, not by group ID
+    def delete_group(self, device_id, app_cookie, timeout=None):
+        return self.request('DELETE', f'/groups/{device_id}/{app_cookie}', timeout=timeout, device=device_id)
+
+    # --- TOPOLOGY ---
+    # Conditional GETs: with the ETag of an earlier answer, an unchanged resource comes back as 304 without a body
+    @staticmethod
+    def conditional(etag):
+        return {'If-None-Match': etag} if etag else None
+
+    def get_devices(self, etag=None, timeout=None):
+        return self.request('GET', '/devices', timeout=timeout, headers=self.conditional(etag))
+
+    def get_links(self, etag=None, timeout=None):
+        return self.request('GET', '/links', timeout=timeout, headers=self.conditional(etag))
+
+    def get_hosts(self, etag=None, timeout=None):
+        return self.request('GET', '/hosts', timeout=timeout, headers=self.conditional(etag))
+
+    # --- STATISTICS ---
+    # Cumulative per-port counters, body is {"statistics": [{"device": ..., "ports": [...]}]}
+    def get_port_stats(self, device_id=None, timeout=None):
+        path = f'/statistics/ports/{device_id}' if device_id else '/statistics/ports'
+        return self.request('GET', path, timeout=timeout, device=device_id or 'all')
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
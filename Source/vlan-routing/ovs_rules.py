@@ -0,0 +1,142 @@
+import argparse
+import os
+import tempfile
+
+from fabric import FABRIC_FILE, compile_ecmp, compile_failover, compile_rules, load_fabric
+from flow_rules import unique_rules
+
+# Stand-in controller for data-plane benchmarks: the rules and groups the
+# compiler makes for ONOS, translated to ovs-ofctl syntax and written straight
+# into the Mininet switches (OpenFlow 1.3, fail-mode secure, no controller).
+# Without a controller nothing answers punted ARP, so the rules are compiled
+# with the in-switch ARP responders (arp_proxy=True).
+
+OFCTL = 'ovs-ofctl -O OpenFlow13'
+
+# criterion type -> ovs-ofctl match field
+MATCH_FIELDS = {
+    "IN_PORT": "in_port",
+    "ETH_DST": "dl_dst",
+    "ETH_SRC": "dl_src",
+    "ETH_TYPE": "dl_type",
+    "VLAN_VID": "dl_vlan",
+    "IPV4_DST": "nw_dst",
+    "IPV4_SRC": "nw_src",
+    "IP_PROTO": "nw_proto",
+    "ICMPV4_TYPE": "icmp_type",
+    "TCP_DST": "tcp_dst",
+    "UDP_DST": "udp_dst",
+    "ARP_OP": "arp_op",
+    "ARP_TPA": "arp_tpa",
+}
+# (instruction type or subtype) -> ovs-ofctl action, {} is the value
+ACTIONS = {
+    "VLAN_PUSH": "push_vlan:0x8100",
+    "VLAN_ID": "mod_vlan_vid:{vlanId}",
+    "VLAN_POP": "pop_vlan",
+    "ETH_DST": "mod_dl_dst:{mac}",
+    "ETH_SRC": "mod_dl_src:{mac}",
+    "ARP_OP": "set_field:{op}->arp_op",
+    "ARP_SHA": "set_field:{mac}->arp_sha",
+    "ARP_SPA": "set_field:{ip}->arp_spa",
+    "GROUP": "group:{groupId}",
+    "TABLE": "goto_table:{tableId}",
+}
+# Logical ports ONOS spells in upper case
+PORTS = {"CONTROLLER": "controller", "IN_PORT": "in_port"}
+GROUP_TYPES = {"FAILOVER": "ff", "SELECT": "select", "ALL": "all", "INDIRECT": "indirect"}
+
+def match(rule):
+    fields = []
+    for criterion in rule["selector"]["criteria"]:
+        if criterion["type"] not in MATCH_FIELDS:
+            raise ValueError(f"no ovs-ofctl field for {criterion['type']} in rule on {rule['deviceId']}")
+        value = next(v for k, v in criterion.items() if k != "type")
+        fields.append(f'{MATCH_FIELDS[criterion["type"]]}={value}')
+    return fields
+
+def actions(instructions):
+    out = []
+    for instruction in instructions:
+        kind = instruction.get("subtype", instruction["type"])
+        if kind == "OUTPUT":
+            port = str(instruction["port"])
+            out.append(f'output:{PORTS.get(port, port)}')
+        elif kind in ACTIONS:
+            out.append(ACTIONS[kind].format(**instruction))
+        else:
+            raise ValueError(f"no ovs-ofctl action for {instruction['type']}/{kind}")
+    # No instructions means drop, like in OpenFlow
+    return ','.join(out) or 'drop'
+
+# One ONOS flow rule as an ovs-ofctl add-flows line
+def flow_line(rule):
+    return ','.join([f'table={rule.get("tableId", 0)}', f'priority={rule["priority"]}'] + match(rule)
+                    + [f'actions={actions(rule["treatment"]["instructions"])}'])
+
+# One ONOS group as an ovs-ofctl add-groups line
+def group_line(group):
+    buckets = []
+    for bucket in group["buckets"]:
+        options = [f'watch_port:{bucket["watchPort"]}'] if "watchPort" in bucket else []
+        options += [f'weight:{bucket["weight"]}'] if "weight" in bucket else []
+        buckets.append('bucket=' + ','.join(options + [f'actions={actions(bucket["treatment"]["instructions"])}']))
+    return ','.join([f'group_id={group["groupId"]}', f'type={GROUP_TYPES[group["type"]]}'] + buckets)
+
+# switch name -> ([group line], [flow line])
+def translate(fabric, rules, groups=()):
+    names = {switch.device_id: switch.name for switch in fabric.switches.values()}
+    tables = {name: ([], []) for name in names.values()}
+    for group in groups:
+        tables[names[group["deviceId"]]][0].append(group_line(group))
+    for rule in rules:
+        tables[names[rule["deviceId"]]][1].append(flow_line(rule))
+    return tables
+
+# Same rule set configure-onos-router.py pushes, plus the ARP responders
+def compile_fabric(fabric, failover=False, ecmp=False):
+    rules = compile_rules(fabric, arp_proxy=True)
+    groups = []
+    if ecmp:
+        groups, rules = compile_ecmp(fabric, rules, failover=failover)
+    elif failover:
+        groups, rules = compile_failover(fabric, rules)
+    rules, _ = unique_rules(rules)
+    return rules, groups
+
+# Write the fabric's rules into the switches of a started Mininet network, groups
+# first (flows pointing at a missing group are refused). Returns (groups, flows).
+def install(net, fabric, failover=False, ecmp=False):
+    rules, groups = compile_fabric(fabric, failover, ecmp)
+    for name, (group_lines, flow_lines) in translate(fabric, rules, groups).items():
+        switch = net.get(name)
+        for command, lines in (('add-groups', group_lines), ('add-flows', flow_lines)):
+            if not lines:
+                continue
+            with tempfile.NamedTemporaryFile('w', suffix='.ofctl', delete=False) as f:
+                f.write('\n'.join(lines) + '\n')
+            try:
+                output = switch.cmd(f'{OFCTL} {command} {name} {f.name}')
+            finally:
+                os.unlink(f.name)
+            if output.strip():
+                raise RuntimeError(f"{command} on {name} failed: {output.strip()}")
+    return len(groups), len(rules)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the fabric's rules as ovs-ofctl add-groups/add-flows lines")
+    parser.add_argument("--fabric", default=FABRIC_FILE, help="fabric description (JSON or YAML)")
+    parser.add_argument("--failover", action="store_true", help="compile with fast-failover groups on every spine link")
+    parser.add_argument("--ecmp", action="store_true", help="compile with SELECT groups hashing flows over every spine")
+    parser.add_argument("--switch", help="only this switch")
+    args = parser.parse_args()
+
+    fabric = load_fabric(args.fabric)
+    rules, groups = compile_fabric(fabric, args.failover, args.ecmp)
+    for name, (group_lines, flow_lines) in translate(fabric, rules, groups).items():
+        if args.switch and name != args.switch:
+            continue
+        print(f"# {name}: {len(group_lines)} groups, {len(flow_lines)} flows")
+        for line in group_lines + flow_lines:
+            print(line)
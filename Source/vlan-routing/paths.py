@@ -0,0 +1,275 @@
+import argparse
+import heapq
+import time
+from collections import deque
+
+from fabric import (
+    FABRIC_FILE,
+    RULE_BUILDERS,
+    compile_pair,
+    gateway_responder,
+    generate_ring,
+    generate_three_tier,
+    load_fabric,
+    save_fabric,
+)
+from flow_rules import unique_rules
+
+# Path engine for fabrics of any shape (leaf-spine, three-tier, rings, ...).
+# compile_rules() assumes every inter-leaf path is leaf-spine-leaf; here the
+# switch graph is searched instead. The rules forward on the destination MAC,
+# so a switch has one next hop per destination leaf: the engine keeps, per leaf
+# that can have hosts, a BFS shortest-path tree pointing every switch at that
+# leaf. All trees together are the all-pairs shortest paths, O(L * (S + E)).
+# Ties go to the neighbour listed first in the fabric file, so on a leaf-spine
+# fabric every path crosses the first spine, like compile_rules().
+#
+# When a link goes down only the trees that used it are rebuilt; when one comes
+# (back) up only the trees where it joins switches at different distances, the
+# only ones it can change. The result is always what a full rebuild would give.
+# k_shortest() lists loop-free alternatives for one pair (Yen), e.g. to see
+# what a failure would fall back to.
+
+class PathEngine:
+    def __init__(self, fabric, down_links=()):
+        self.fabric = fabric
+        self.order = {name: i for i, name in enumerate(fabric.switches)}
+        self.down = {frozenset(link) for link in down_links}
+        # switch -> [neighbour], in fabric order, without the links that are down
+        self.adjacency = {name: [] for name in fabric.switches}
+        for node, neighbour in sorted(fabric.ports, key=lambda key: (self.order[key[0]], self.order[key[1]])):
+            if frozenset((node, neighbour)) not in self.down:
+                self.adjacency[node].append(neighbour)
+        self.trees = {}      # destination leaf -> {switch: next hop}
+        self.distances = {}  # destination leaf -> {switch: hops}
+        for leaf in fabric.leaves():
+            self.build(leaf.name)
+
+    # BFS from the destination over the links that are up
+    def build(self, destination):
+        tree, distance = {}, {destination: 0}
+        queue = deque([destination])
+        while queue:
+            node = queue.popleft()
+            for neighbour in self.adjacency[node]:
+                if neighbour not in distance:
+                    distance[neighbour] = distance[node] + 1
+                    tree[neighbour] = node
+                    queue.append(neighbour)
+        self.trees[destination], self.distances[destination] = tree, distance
+
+    # Switches from src to the destination leaf, both included; None if unreachable
+    def path(self, src, destination):
+        tree = self.trees[destination]
+        if src != destination and src not in tree:
+            return None
+        hops = [src]
+        while hops[-1] != destination:
+            hops.append(tree[hops[-1]])
+        return hops
+
+    # Every switch the traffic of the `sources` leaves to `destination` crosses, with its next hop
+    def transit(self, destination, sources):
+        tree = self.trees[destination]
+        crossed = {}
+        for leaf in sources:
+            node = tree.get(leaf)
+            while node is not None and node != destination and node not in crossed:
+                crossed[node] = tree[node]
+                node = tree[node]
+        return crossed
+
+    # --- LINK CHANGES ---
+    # Take a link down or bring it back. Returns {destination leaf: [switches whose
+    # next hop changed]}, only for the trees that changed.
+    def set_link(self, node1, node2, up):
+        if (node1, node2) not in self.fabric.ports:
+            raise ValueError(f"no link between {node1} and {node2}")
+        link = frozenset((node1, node2))
+        if (link not in self.down) == up:
+            return {}
+        if up:
+            self.down.discard(link)
+            for node, neighbour in ((node1, node2), (node2, node1)):
+                self.adjacency[node].append(neighbour)
+                self.adjacency[node].sort(key=self.order.get)
+            # Equal distances: the link joins two switches of the same BFS layer and is in no tree
+            affected = [destination for destination, distance in self.distances.items()
+                        if distance.get(node1) != distance.get(node2)]
+        else:
+            self.down.add(link)
+            self.adjacency[node1].remove(node2)
+            self.adjacency[node2].remove(node1)
+            affected = [destination for destination, tree in self.trees.items()
+                        if tree.get(node1) == node2 or tree.get(node2) == node1]
+        changed = {}
+        for destination in affected:
+            before = self.trees[destination]
+            self.build(destination)
+            after = self.trees[destination]
+            moved = [node for node in self.fabric.switches if before.get(node) != after.get(node)]
+            if moved:
+                changed[destination] = moved
+        return changed
+
+    # --- K SHORTEST PATHS ---
+    # Shortest path from src to dst avoiding some switches and (directed) links
+    def shortest_path(self, src, dst, avoid_nodes=(), avoid_links=()):
+        parent = {src: None}
+        queue = deque([src])
+        while queue:
+            node = queue.popleft()
+            if node == dst:
+                hops = [dst]
+                while parent[hops[-1]] is not None:
+                    hops.append(parent[hops[-1]])
+                return hops[::-1]
+            for neighbour in self.adjacency[node]:
+                if neighbour not in parent and neighbour not in avoid_nodes and (node, neighbour) not in avoid_links:
+                    parent[neighbour] = node
+                    queue.append(neighbour)
+        return None
+
+    # Up to k loop-free paths from src to dst, shortest first (Yen's algorithm)
+    def k_shortest(self, src, dst, k):
+        first = self.shortest_path(src, dst)
+        if first is None:
+            return []
+        paths, candidates, seen = [first], [], {tuple(first)}
+        while len(paths) < k:
+            last = paths[-1]
+            for i in range(len(last) - 1):
+                root = last[:i + 1]
+                avoid_links = {(p[i], p[i + 1]) for p in paths if p[:i + 1] == root}
+                spur = self.shortest_path(last[i], dst, set(root[:-1]), avoid_links)
+                if spur and tuple(root[:-1] + spur) not in seen:
+                    seen.add(tuple(root[:-1] + spur))
+                    heapq.heappush(candidates, (len(root) + len(spur), root[:-1] + spur))
+            if not candidates:
+                break
+            paths.append(heapq.heappop(candidates)[1])
+        return paths
+
+
+# --- MULTI-HOP RULES ---
+# (leaf, VLAN) -> hosts, the source groups of compile_rules()
+def source_groups(fabric):
+    groups = {}
+    for host in fabric.hosts.values():
+        groups.setdefault((host.switch, host.vlan), []).append(host)
+    return groups
+
+# Every rule that carries traffic to the hosts of one leaf:
+#   source leaves: L2 or L3 uplink to the next hop of the path (plus the ARP
+#                  answer for same-VLAN hosts with arp_proxy); same-leaf pairs
+#                  as in compile_pair()
+#   transit:       ETH_DST -> port towards the next hop, on every switch a path crosses
+#                  (also matching the VLAN on switches with hosts, see build_leaf_transit)
+#   the leaf:      VLAN pop and delivery to the host port
+# Sources that can't reach the leaf get no uplink (the engine has no path).
+def destination_rules(fabric, engine, destination, groups=None, builders=RULE_BUILDERS, arp_proxy=False):
+    groups = groups if groups is not None else source_groups(fabric)
+    tree = engine.trees[destination]
+    targets = [h for h in fabric.hosts.values() if h.switch == destination]
+    rules = []
+    for (leaf, vlan), group in groups.items():
+        src = group[0]
+        leaf_id = fabric.switches[leaf].device_id
+        for dst in targets:
+            if dst is src and len(group) == 1:
+                continue
+            if leaf == destination:
+                rules += compile_pair(fabric, src, dst, None, builders, arp_proxy)
+                continue
+            if leaf not in tree:
+                continue
+            uplink = fabric.port(leaf, tree[leaf])
+            if src.vlan == dst.vlan:
+                if arp_proxy:
+                    rules.append(builders["arp_responder"](leaf_id, dst.vlan, dst.ip, dst.mac))
+                rules.append(builders["l2_uplink"](leaf_id, dst.mac, dst.vlan, uplink))
+            else:
+                rules.append(builders["l3_uplink"](leaf_id, src.vlan, dst.vlan, f'{dst.ip}/32', dst.mac, uplink))
+    sources = {leaf for leaf, _ in groups}
+    crossed = engine.transit(destination, sources)
+    reached = any(leaf != destination and leaf in tree for leaf in sources)
+    with_hosts = {host.switch for host in fabric.hosts.values()}
+    for dst in targets:
+        for node, next_hop in crossed.items():
+            device_id, port = fabric.switches[node].device_id, fabric.port(node, next_hop)
+            if node in with_hosts:
+                rules.append(builders["leaf_transit"](device_id, dst.mac, dst.vlan, port))
+            else:
+                rules.append(builders["transit"](device_id, dst.mac, port))
+        if reached:
+            rules.append(builders["leaf_delivery"](fabric.switches[destination].device_id, dst.mac, dst.vlan, dst.port))
+    return rules
+
+# compile_rules() over the engine's shortest paths instead of one spine hop.
+# Unlike compile_rules(), no rule is emitted twice.
+def compile_paths(fabric, engine=None, builders=RULE_BUILDERS, arp_proxy=False):
+    engine = engine or PathEngine(fabric)
+    rules = [builders["arp_punt"](s.device_id) for s in fabric.switches.values()]
+    groups = source_groups(fabric)
+    for host in fabric.hosts.values():
+        rules.append(builders["ingress"](fabric.switches[host.switch].device_id, host.port, host.vlan))
+    if arp_proxy:
+        rules += [gateway_responder(fabric, leaf, vlan, builders) for leaf, vlan in groups]
+    for leaf in sorted({host.switch for host in fabric.hosts.values()}, key=engine.order.get):
+        rules += destination_rules(fabric, engine, leaf, groups, builders, arp_proxy)
+    return rules
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute shortest paths and multi-hop rules for any fabric shape")
+    parser.add_argument("--fabric", default=FABRIC_FILE, help="fabric description (JSON or YAML)")
+    parser.add_argument("--three-tier", nargs=5, type=int, metavar=("CORES", "PODS", "AGGS", "LEAVES", "HOSTS"),
+                        help="use a generated three-tier fabric instead of --fabric (AGGS, LEAVES per pod, HOSTS per leaf)")
+    parser.add_argument("--ring", nargs=2, type=int, metavar=("LEAVES", "HOSTS"),
+                        help="use a generated ring of leaves instead of --fabric")
+    parser.add_argument("--vlans", type=int, default=2, help="VLANs of a generated fabric")
+    parser.add_argument("--save-fabric", help="write the (generated) fabric to this file, e.g. for flowsim.py --fabric")
+    parser.add_argument("--path", nargs=2, metavar=("SRC", "DST"), help="print the paths between two switches")
+    parser.add_argument("-k", type=int, default=1, help="with --path, list up to k shortest paths")
+    parser.add_argument("--link-down", nargs=2, action="append", default=[], metavar=("NODE1", "NODE2"),
+                        help="take this link down after the first computation and recompute incrementally (repeatable)")
+    parser.add_argument("--arp-proxy", action="store_true", help="compile with the in-switch ARP responders")
+    args = parser.parse_args()
+
+    if args.three_tier:
+        fabric = generate_three_tier(*args.three_tier, vlans=args.vlans)
+    elif args.ring:
+        fabric = generate_ring(*args.ring, vlans=args.vlans)
+    else:
+        fabric = load_fabric(args.fabric)
+    if args.save_fabric:
+        save_fabric(fabric, args.save_fabric)
+        print(f"Fabric saved to {args.save_fabric}")
+
+    start = time.perf_counter()
+    engine = PathEngine(fabric)
+    elapsed = time.perf_counter() - start
+    unreachable = sum(1 for d in engine.trees for l in engine.trees if l != d and l not in engine.trees[d])
+    diameter = max((max(distance.values()) for distance in engine.distances.values()), default=0)
+    print(f"{len(fabric.switches)} switches, {len(fabric.links)} links, {len(engine.trees)} leaves: "
+          f"shortest paths in {elapsed * 1000:.1f} ms, longest {diameter} hops, {unreachable} leaf pairs unreachable")
+
+    if args.path:
+        src, dst = args.path
+        for hops in engine.k_shortest(src, dst, args.k) or [None]:
+            print(" -> ".join(hops) if hops else f" [FAIL] no path from {src} to {dst}")
+
+    start = time.perf_counter()
+    rules, duplicates = unique_rules(compile_paths(fabric, engine, arp_proxy=args.arp_proxy))
+    print(f"Compiled {len(rules)} rules ({duplicates} duplicates) in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    for node1, node2 in args.link_down:
+        start = time.perf_counter()
+        changed = engine.set_link(node1, node2, up=False)
+        elapsed = time.perf_counter() - start
+        moved = sum(len(nodes) for nodes in changed.values())
+        print(f"Link {node1}-{node2} down: {len(changed)}/{len(engine.trees)} destination trees rebuilt, "
+              f"{moved} next hops moved in {elapsed * 1000:.2f} ms")
+        for destination in changed:
+            if any(l != destination and l not in engine.trees[destination] for l in engine.trees):
+                print(f" [NOTE] some leaves can no longer reach {destination}")
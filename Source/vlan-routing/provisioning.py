@@ -0,0 +1,161 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from flow_rules import describe_group, describe_rule
+from metrics import METRICS
+from rule_templates import render_body, spec_device
+
+# Bulk push paths shared by configure-onos-router.py and the benchmarks.
+# Results are always {device_id: ([(rule, flowId)], [(rule, error)])}.
+
+BATCH_SIZE = 50 # Rules per bulk POST /onos/v1/flows call
+WORKERS = 4 # Devices pushed concurrently in --parallel mode
+
+# Pair a bulk POST answer with the rules of its batch. A body that isn't JSON fails
+# the whole batch; rules past the end of a short "flows" list are failed too, as
+# there is no flowId to tell whether they were installed.
+def batch_results(batch, response):
+    if response.status_code not in [200, 201]:
+        return [], [(rule, response.text) for rule in batch]
+    try:
+        flow_ids = [flow["flowId"] for flow in response.json().get("flows", [])]
+    except (ValueError, AttributeError, KeyError, TypeError):
+        return [], [(rule, f"unexpected answer: {response.text}") for rule in batch]
+    missing = [(rule, f"no flowId in the answer ({len(flow_ids)} for {len(batch)} rules)")
+               for rule in batch[len(flow_ids):]]
+    return list(zip(batch, flow_ids)), missing
+
+# One bulk POST /onos/v1/flows call. ONOS answers with
+# {"flows": [{"deviceId": ..., "flowId": ...}]} in the same order as the request body.
+# Returns ([(rule, flowId)], [(rule, error)])
+def push_batch(client, batch):
+    try:
+        response = client.post_flows(batch)
+    except requests.RequestException as e:
+        return [], [(rule, str(e)) for rule in batch]
+    with METRICS.timed('response'):
+        return batch_results(batch, response)
+
+# One bulk DELETE /onos/v1/flows call, flows being [{"deviceId": ..., "flowId": ...}].
+# A refused or failed call is logged and counted per device rather than raised,
+# so the caller can keep the flows and retry. Returns True when ONOS took them.
+def delete_batch(client, flows):
+    try:
+        response = client.delete_flows(flows)
+        if response.status_code in [200, 204]:
+            return True
+        error = response.text
+    except requests.RequestException as e:
+        error = str(e)
+    by_device = {}
+    for flow in flows:
+        by_device[flow["deviceId"]] = by_device.get(flow["deviceId"], 0) + 1
+    for device_id, count in by_device.items():
+        METRICS.fail(device_id, "delete", count)
+    METRICS.event("delete_failed", f" [FAIL] Deleting {len(flows)} stale flows Error: {error}",
+                  flows=len(flows), devices=sorted(by_device), error=error)
+    return False
+
+# Same for rule_templates specs: the batch is rendered straight into the body text.
+# Returns ([(spec, flowId)], [(spec, error)])
+def push_spec_batch(client, batch):
+    with METRICS.timed('serialise'):
+        body = render_body(batch)
+    devices = {spec[1] for spec in batch}
+    try:
+        response = client.post_flows_body(body, spec_device(batch[0]) if len(devices) == 1 else 'mixed')
+    except requests.RequestException as e:
+        return [], [(spec, str(e)) for spec in batch]
+    with METRICS.timed('response'):
+        return batch_results(batch, response)
+
+# Push specs in order, like push_serial(). Results are keyed by device as usual,
+# with specs in place of rules (rule_templates.spec_rule() turns one back into a dict).
+def push_specs(client, specs, batch_size=BATCH_SIZE):
+    results = {}
+    for i in range(0, len(specs), batch_size):
+        installed, failed = push_spec_batch(client, specs[i:i + batch_size])
+        for spec, flow_id in installed:
+            results.setdefault(spec_device(spec), ([], []))[0].append((spec, flow_id))
+        for spec, error in failed:
+            results.setdefault(spec_device(spec), ([], []))[1].append((spec, error))
+    return results
+
+# Push one device's rules, batch_size rules per call
+def push_device(client, rules, batch_size=BATCH_SIZE):
+    installed, failed = [], []
+    for i in range(0, len(rules), batch_size):
+        ok, bad = push_batch(client, rules[i:i + batch_size])
+        installed += ok
+        failed += bad
+    return installed, failed
+
+def group_by_device(rules):
+    by_device = {}
+    for rule in rules:
+        by_device.setdefault(rule["deviceId"], []).append(rule)
+    return by_device
+
+# Push all rules in order, batch_size rules per bulk call
+def push_serial(client, rules, batch_size=BATCH_SIZE):
+    installed, failed = push_device(client, rules, batch_size)
+    results = {}
+    for rule, flow_id in installed:
+        results.setdefault(rule["deviceId"], ([], []))[0].append((rule, flow_id))
+    for rule, error in failed:
+        results.setdefault(rule["deviceId"], ([], []))[1].append((rule, error))
+    return results
+
+# Rules for different devices don't depend on each other, so each device's
+# rules are pushed by its own worker. At most `workers` devices are in flight
+# at once to avoid overwhelming ONOS.
+def push_parallel(client, rules, batch_size=BATCH_SIZE, workers=WORKERS):
+    by_device = group_by_device(rules)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {device_id: pool.submit(push_device, client, device_rules, batch_size)
+                   for device_id, device_rules in by_device.items()}
+    return {device_id: future.result() for device_id, future in futures.items()}
+
+# Groups have no bulk endpoint: one POST /onos/v1/groups/<device> each.
+# They have to be in place before any flow pointing at them is pushed.
+# Returns ([group], [(group, error)])
+def push_groups(client, groups):
+    installed, failed = [], []
+    for group in groups:
+        try:
+            response = client.post_group(group["deviceId"], group)
+        except requests.RequestException as e:
+            failed.append((group, str(e)))
+            continue
+        if response.status_code in [200, 201]:
+            installed.append(group)
+        else:
+            failed.append((group, response.text))
+    return installed, failed
+
+def report_groups(installed, failed):
+    for group in installed:
+        METRICS.event("group_installed", f" [OK] {describe_group(group)}",
+                      detail=True, device=group["deviceId"], group_id=group["groupId"], type=group["type"])
+    for group, error in failed:
+        METRICS.fail(group["deviceId"], "group")
+        METRICS.event("group_failed", f" [FAIL] {describe_group(group)} Error: {error}",
+                      device=group["deviceId"], group_id=group["groupId"], error=error)
+    METRICS.event("groups_done", f"Installed {len(installed)} groups, {len(failed)} failed",
+                  installed=len(installed), failed=len(failed))
+
+# Log the outcome of every rule, then one summary line per device
+def report_results(results):
+    for device_id, (installed, failed) in results.items():
+        for rule, flow_id in installed:
+            METRICS.event("flow_installed", f" [OK] {describe_rule(rule)} -> flowId {flow_id}",
+                          detail=True, device=device_id, flow_id=flow_id, rule=describe_rule(rule))
+        for rule, error in failed:
+            METRICS.event("flow_failed", f" [FAIL] {describe_rule(rule)} Error: {error}",
+                          device=device_id, rule=describe_rule(rule), error=error)
+        if failed:
+            METRICS.fail(device_id, "rule", len(failed))
+    for device_id, (installed, failed) in results.items():
+        METRICS.event("device_done", f"{device_id}: {len(installed)} installed, {len(failed)} failed",
+                      device=device_id, installed=len(installed), failed=len(failed))
@@ -0,0 +1,230 @@
+import requests
+
+from fabric import ECMP_GROUP_BASE, FAILOVER_GROUP_BASE
+from flow_rules import describe_group, describe_rule, rule_key, treatment_key
+from metrics import METRICS
+from onos_client import APP_ID
+from provisioning import delete_batch
+
+# Diff-based reconciliation: instead of re-posting every rule, read what each
+# device already has and only add / delete the difference.
+
+# Only flows OnosClient posted under APP_ID are ours. Everything else on the device
+# (LLDP/ARP punts from the core, acl.py's ACL flows, other apps) is left alone.
+
+# Flows already on their way out don't count as installed
+GONE_STATES = ('PENDING_REMOVE', 'REMOVED')
+
+# One GET /onos/v1/flows/<device> per device, keeping only our app's live flows.
+# Returns ({device_id: [flow]}, {device_id: error}) so an unreadable device is
+# skipped rather than having all of its flows treated as missing.
+def fetch_live_flows(client, device_ids, app_id=APP_ID):
+    live, errors = {}, {}
+    for device_id in device_ids:
+        try:
+            response = client.get_flows(device_id)
+        except requests.RequestException as e:
+            errors[device_id] = str(e)
+            continue
+        if response.status_code != 200:
+            errors[device_id] = response.text
+            continue
+        live[device_id] = [
+            flow for flow in response.json().get("flows", [])
+            if flow.get("appId") == app_id and flow.get("state") not in GONE_STATES
+        ]
+    return live, errors
+
+# Desired rules vs live flows of one device.
+# Returns (adds, changes, deletes): rules to post, rules whose treatment differs
+# from the live flow (re-posting the same key makes ONOS modify it in place),
+# and live flows to delete.
+def diff_flows(desired, live):
+    live_by_key = {}
+    deletes = []
+    for flow in live:
+        key = rule_key(flow)
+        if key in live_by_key:
+            deletes.append(flow)
+        else:
+            live_by_key[key] = flow
+    adds, changes = [], []
+    desired_keys = set()
+    for rule in desired:
+        key = rule_key(rule)
+        desired_keys.add(key)
+        flow = live_by_key.get(key)
+        if flow is None:
+            adds.append(rule)
+        elif treatment_key(flow) != treatment_key(rule):
+            changes.append(rule)
+    deletes += [flow for key, flow in live_by_key.items() if key not in desired_keys]
+    return adds, changes, deletes
+
+# Full plan for a desired rule set: {device_id: (adds, changes, deletes)}, plus fetch errors.
+# Every device in device_ids is read, so a switch that no longer gets any rule
+# still has its stale flows deleted.
+def plan_reconcile(client, desired, device_ids):
+    by_device = {device_id: [] for device_id in device_ids}
+    for rule in desired:
+        by_device.setdefault(rule["deviceId"], []).append(rule)
+    live, errors = fetch_live_flows(client, by_device)
+    plan = {device_id: diff_flows(by_device[device_id], flows) for device_id, flows in live.items()}
+    return plan, errors
+
+# --- GROUPS ---
+# Groups carry no appId, so ours are told apart by appCookie: fabric.py derives it
+# from a group ID in the failover (0x100 + port) or ECMP (0x200 + port) range.
+OWN_GROUP_IDS = range(FAILOVER_GROUP_BASE, ECMP_GROUP_BASE + 0x100)
+
+def own_group(group):
+    try:
+        return int(str(group.get("appCookie")), 16) in OWN_GROUP_IDS
+    except ValueError:
+        return False
+
+# Type plus buckets in order (failover buckets are tried first to last)
+def group_key(group):
+    return (group["type"], tuple(
+        (str(bucket.get("watchPort", "")), treatment_key(bucket)) for bucket in group.get("buckets", [])
+    ))
+
+# One GET /onos/v1/groups/<device> per device, keeping only our live groups.
+# Returns ({device_id: [group]}, {device_id: error}) like fetch_live_flows.
+def fetch_live_groups(client, device_ids):
+    live, errors = {}, {}
+    for device_id in device_ids:
+        try:
+            response = client.get_groups(device_id)
+        except requests.RequestException as e:
+            errors[device_id] = str(e)
+            continue
+        if response.status_code != 200:
+            errors[device_id] = response.text
+            continue
+        live[device_id] = [
+            group for group in response.json().get("groups", [])
+            if own_group(group) and group.get("state") not in GONE_STATES
+        ]
+    return live, errors
+
+# Desired groups vs live groups of one device, matched by appCookie.
+# Returns (adds, changes, deletes). ONOS keeps the existing group when the same
+# appCookie is posted again, so a changed group has to be deleted and re-added.
+def diff_groups(desired, live):
+    live_by_cookie = {group["appCookie"]: group for group in live}
+    adds, changes = [], []
+    for group in desired:
+        current = live_by_cookie.pop(group["appCookie"], None)
+        if current is None:
+            adds.append(group)
+        elif group_key(current) != group_key(group):
+            changes.append(group)
+    return adds, changes, list(live_by_cookie.values())
+
+# Group plan for the same devices: {device_id: (adds, changes, deletes)}, plus fetch errors
+def plan_groups(client, groups, device_ids):
+    by_device = {device_id: [] for device_id in device_ids}
+    for group in groups:
+        by_device.setdefault(group["deviceId"], []).append(group)
+    live, errors = fetch_live_groups(client, by_device)
+    plan = {device_id: diff_groups(by_device[device_id], device_groups) for device_id, device_groups in live.items()}
+    return plan, errors
+
+def print_group_plan(plan, errors):
+    for device_id, (adds, changes, deletes) in plan.items():
+        for group in adds:
+            print(f" + {describe_group(group)}")
+        for group in changes:
+            print(f" ~ {describe_group(group)}")
+        for group in deletes:
+            print(f" - {device_id} group {group['appCookie']} {group['type']}")
+    for device_id, (adds, changes, deletes) in plan.items():
+        if adds or changes or deletes:
+            print(f"{device_id}: {len(adds)} groups to add, {len(changes)} to update, {len(deletes)} to delete")
+    for device_id, error in errors.items():
+        METRICS.fail(device_id, "read")
+        METRICS.event("groups_unreadable", f" [FAIL] {device_id}: could not read live groups, skipped. Error: {error}",
+                      device=device_id, error=error)
+
+# DELETE /onos/v1/groups/<device>/<appCookie> for each group, counting the failures
+# per device. Returns how many ONOS removed.
+def delete_groups(client, groups):
+    deleted = 0
+    for group in groups:
+        try:
+            response = client.delete_group(group["deviceId"], group["appCookie"])
+            if response.status_code in [200, 204]:
+                deleted += 1
+                continue
+            error = response.text
+        except requests.RequestException as e:
+            error = str(e)
+        METRICS.fail(group["deviceId"], "group_delete")
+        METRICS.event("group_delete_failed", f" [FAIL] {group['deviceId']} group {group['appCookie']} Error: {error}",
+                      device=group["deviceId"], app_cookie=group["appCookie"], error=error)
+    return deleted
+
+def print_plan(plan, errors):
+    for device_id, (adds, changes, deletes) in plan.items():
+        for rule in adds:
+            print(f" + {describe_rule(rule)}")
+        for rule in changes:
+            print(f" ~ {describe_rule(rule)}")
+        for flow in deletes:
+            print(f" - {describe_rule(flow)} (flowId {flow['id']})")
+    for device_id, (adds, changes, deletes) in plan.items():
+        print(f"{device_id}: {len(adds)} to add, {len(changes)} to update, {len(deletes)} to delete")
+    for device_id, error in errors.items():
+        METRICS.fail(device_id, "read")
+        METRICS.event("flows_unreadable", f" [FAIL] {device_id}: could not read live flows, skipped. Error: {error}",
+                      device=device_id, error=error)
+
+# Apply the deletes of a plan with one bulk DELETE /onos/v1/flows call.
+# Adds and changes are left to the caller's normal bulk push path.
+# Returns how many flows were deleted, 0 if ONOS refused or could not be reached.
+def apply_deletes(client, plan):
+    deletes = [flow for _, _, device_deletes in plan.values() for flow in device_deletes]
+    if deletes and not delete_batch(client, [{"deviceId": f["deviceId"], "flowId": f["id"]} for f in deletes]):
+        return 0
+    return len(deletes)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from acl import ACL_APP_ID, ACL_FABRIC_FILE, POLICY_FILE, compile_acl, load_policy
+    from fabric import compile_rules, load_fabric
+    from mock_onos import MockOnos
+    from onos_client import AUTH, OnosClient
+    from provisioning import push_serial
+
+    # Self-check against a local mock ONOS: install the routing rules and acl.py's
+    # flows, remove a host, reconcile, and make sure only routing flows went away
+    parser = argparse.ArgumentParser(description="Check that a reconcile deletes stale routing flows and keeps the ACL flows")
+    parser.add_argument("--fabric", default=ACL_FABRIC_FILE, help="fabric description (JSON or YAML)")
+    parser.add_argument("--policy", default=POLICY_FILE, help="ACL policy installed next to the routing rules")
+    parser.add_argument("--remove-host", help="host whose routing rules become stale (default: the last one)")
+    args = parser.parse_args()
+
+    fabric = load_fabric(args.fabric)
+    acl_flows = compile_acl(fabric, load_policy(args.policy))
+    mock = MockOnos(fabric=fabric).start()
+    ip, port = mock.address[0], str(mock.address[1])
+    with OnosClient(ip, port, AUTH) as client, \
+            OnosClient(ip, port, AUTH, app_id=ACL_APP_ID) as acl_client:
+        push_serial(client, compile_rules(fabric))
+        push_serial(acl_client, acl_flows)
+        fabric.remove_host(args.remove_host or list(fabric.hosts)[-1])
+        plan, errors = plan_reconcile(client, compile_rules(fabric), [s.device_id for s in fabric.switches.values()])
+        print_plan(plan, errors)
+        deleted = apply_deletes(client, plan)
+        live = {rule_key(flow) for flow in mock.store.list(None)}
+    mock.stop()
+
+    missing = [flow for flow in acl_flows if rule_key(flow) not in live]
+    for flow in missing:
+        print(f" [FAIL] ACL flow deleted by the reconcile: {describe_rule(flow)}")
+    if errors or not deleted or missing:
+        raise SystemExit(f" [FAIL] {deleted} stale routing flows deleted, {len(missing)} of {len(acl_flows)} ACL flows lost")
+    print(f" [NOTE] {deleted} stale routing flows deleted, all {len(acl_flows)} ACL flows kept")
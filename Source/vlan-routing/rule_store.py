@@ -0,0 +1,227 @@
+import argparse
+import ipaddress
+import sys
+import time
+from dataclasses import dataclass
+
+from fabric import FABRIC_FILE, compile_rules, load_fabric
+from flow_rules import CANONICAL_FIELDS, canonical_entry, describe_rule, load_rules, treatment_key, unique_rules
+
+# In-memory store of the rules about to be pushed, indexed per device and table,
+# that reports rules which can never match (shadowed), add nothing (redundant)
+# or make the switch pick arbitrarily between two actions (conflict).
+#
+# Only containment is checked: a rule is shadowed when one higher-priority rule
+# matches everything it matches. Partial overlaps at the same priority are normal
+# in the pipeline (e.g. IN_PORT ingress vs ETH_DST delivery in table 0) and are
+# not reported, and neither is a rule covered only by the union of several rules.
+# flowsim.py reports the ones real host traffic actually hits (configure-onos-router.py
+# --multi-hop runs it before pushing).
+
+# Match fields compared as prefixes, everything else is an exact match
+PREFIX_FIELDS = {"IPV4_SRC", "IPV4_DST", "IPV6_SRC", "IPV6_DST"}
+# Findings that stop a push in configure-onos-router.py
+ERROR_KINDS = ("shadowed", "conflict")
+
+@dataclass
+class Finding:
+    kind: str      # 'shadowed', 'redundant' or 'conflict'
+    rule: dict     # the rule that never matches / is redundant / conflicts
+    other: dict    # the rule responsible
+
+    @property
+    def is_error(self):
+        return self.kind in ERROR_KINDS
+
+# A rule's match as {criterion type: (value, prefix length or None)}.
+# Prefix values are the network address as an int, so they can be masked to any shorter length.
+def parse_match(rule):
+    match = {}
+    for criterion in rule["selector"]["criteria"]:
+        kind = criterion["type"]
+        if kind in PREFIX_FIELDS:
+            network = ipaddress.ip_network(criterion["ip"], strict=False)
+            match[kind] = (int(network.network_address), network.prefixlen, network.max_prefixlen)
+        else:
+            fields = [name for name in CANONICAL_FIELDS if name in criterion]
+            value = CANONICAL_FIELDS[fields[0]](criterion[fields[0]]) if len(fields) == 1 else canonical_entry(criterion)
+            match[kind] = (value, None, None)
+    return match
+
+def mask(value, prefix_len, max_len):
+    return value & ~((1 << (max_len - prefix_len)) - 1)
+
+# Shape = which fields a match uses and at which prefix lengths
+def match_shape(match):
+    return tuple(sorted((kind, prefix_len) for kind, (_, prefix_len, _) in match.items()))
+
+# Values of `match` for the fields of `shape`, prefixes cut down to the shape's lengths.
+# None when the match lacks one of the fields or has a shorter prefix than the shape.
+def project(match, shape):
+    values = []
+    for kind, prefix_len in shape:
+        if kind not in match:
+            return None
+        value, own_len, max_len = match[kind]
+        if prefix_len is not None:
+            if own_len < prefix_len:
+                return None
+            value = mask(value, prefix_len, max_len)
+        values.append(value)
+    return tuple(values)
+
+
+# --- ONE (DEVICE, TABLE) ---
+# Tuple-space index: rules grouped by match shape, each group a dict keyed by the
+# matched values. Finding the rules that contain a new rule costs one hash probe
+# per shape; finding the rules it contains uses a per-(shape, query shape)
+# projection of the group, built on first use and kept up to date afterwards.
+# Cost per insert grows with the number of shapes and hits, not with the rule count.
+class TableStore:
+    def __init__(self):
+        self.shapes = {}        # shape -> {values: [entry]}
+        self.projections = {}   # (stored shape, query shape) -> {values: [entry]}
+        self.nesting = {}       # (inner shape, outer shape) -> bool
+        self.count = 0
+
+    # Whether every match of shape `inner` lies inside some match of shape `outer`:
+    # outer uses a subset of inner's fields, with prefixes no longer than inner's
+    def nests(self, inner, outer):
+        key = (inner, outer)
+        if key not in self.nesting:
+            fields = dict(inner)
+            self.nesting[key] = all(kind in fields and (length is None or fields[kind] >= length)
+                                    for kind, length in outer)
+        return self.nesting[key]
+
+    # Rules whose match contains `match` (including an identical match)
+    def covering(self, match, shape):
+        for stored, groups in self.shapes.items():
+            if self.nests(shape, stored):
+                yield from groups.get(project(match, stored), ())
+
+    # Rules whose match is strictly inside `match`
+    def covered(self, match, shape):
+        for stored in self.shapes:
+            if stored != shape and self.nests(stored, shape):
+                yield from self.projection(stored, shape).get(project(match, shape), ())
+
+    def projection(self, stored, query):
+        key = (stored, query)
+        if key not in self.projections:
+            index = {}
+            for entries in self.shapes[stored].values():
+                for entry in entries:
+                    index.setdefault(project(entry[2], query), []).append(entry)
+            self.projections[key] = index
+        return self.projections[key]
+
+    def add(self, entry):
+        shape = match_shape(entry[2])
+        self.shapes.setdefault(shape, {}).setdefault(project(entry[2], shape), []).append(entry)
+        for (stored, query), index in self.projections.items():
+            if stored == shape:
+                index.setdefault(project(entry[2], query), []).append(entry)
+        self.count += 1
+
+    def remove(self, entry):
+        shape = match_shape(entry[2])
+        self.shapes[shape][project(entry[2], shape)].remove(entry)
+        for (stored, query), index in self.projections.items():
+            if stored == shape:
+                index[project(entry[2], query)].remove(entry)
+        self.count -= 1
+
+
+# --- ALL DEVICES ---
+# Entries are (priority, treatment key, match, rule)
+class RuleStore:
+    def __init__(self):
+        self.tables = {}  # (device id, table id) -> TableStore
+
+    def __len__(self):
+        return sum(table.count for table in self.tables.values())
+
+    @staticmethod
+    def entry(rule):
+        return (int(rule["priority"]), treatment_key(rule), parse_match(rule), rule)
+
+    def table(self, rule):
+        return self.tables.setdefault((rule["deviceId"], int(rule.get("tableId", 0))), TableStore())
+
+    # Findings between `rule` and the rules already stored, without storing it
+    def check(self, rule):
+        table = self.table(rule)
+        priority, treatment, match, _ = new = self.entry(rule)
+        shape = match_shape(match)
+        findings = []
+        for other in table.covering(match, shape):
+            if other[0] > priority:
+                findings.append(Finding("redundant" if other[1] == treatment else "shadowed", rule, other[3]))
+            elif other[0] == priority:
+                findings.append(Finding("redundant" if other[1] == treatment else "conflict", rule, other[3]))
+        for other in table.covered(match, shape):
+            if priority > other[0]:
+                findings.append(Finding("redundant" if other[1] == treatment else "shadowed", other[3], rule))
+            elif priority == other[0]:
+                findings.append(Finding("redundant" if other[1] == treatment else "conflict", other[3], rule))
+        return new, findings
+
+    # Store `rule`, returning what it shadows, duplicates or conflicts with
+    def add(self, rule):
+        entry, findings = self.check(rule)
+        self.table(rule).add(entry)
+        return findings
+
+    def remove(self, rule):
+        table = self.table(rule)
+        priority, match = int(rule["priority"]), parse_match(rule)
+        shape = match_shape(match)
+        for entry in table.shapes.get(shape, {}).get(project(match, shape), []):
+            if entry[0] == priority:
+                table.remove(entry)
+                return entry[3]
+        return None
+
+# Build a store from `rules`, returning (store, findings)
+def check_rules(rules):
+    store = RuleStore()
+    findings = []
+    for rule in rules:
+        findings += store.add(rule)
+    return store, findings
+
+def print_findings(findings, limit=20):
+    counts = {}
+    for finding in findings:
+        counts[finding.kind] = counts.get(finding.kind, 0) + 1
+        if counts[finding.kind] <= limit:
+            label = "ERROR" if finding.is_error else "WARN"
+            print(f" [{label}] {finding.kind}: {describe_rule(finding.rule)}\n"
+                  f"          by {describe_rule(finding.other)}")
+    for kind, count in counts.items():
+        if count > limit:
+            print(f" ... {count - limit} more {kind}")
+    errors = sum(1 for finding in findings if finding.is_error)
+    print(f"Rule check: {errors} errors, {len(findings) - errors} warnings")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check rules for shadowing, redundancy and conflicts")
+    parser.add_argument("rules", nargs="*", help="extra rule JSON files (e.g. ACLs) checked on top of the fabric's rules")
+    parser.add_argument("--fabric", default=FABRIC_FILE, help="fabric description (JSON or YAML)")
+    parser.add_argument("--aggregate", action="store_true", help="compile with per-subnet L3 prefix routes")
+    parser.add_argument("--no-fabric", action="store_true", help="only check the given rule files")
+    parser.add_argument("--limit", type=int, default=20, help="findings printed per kind")
+    args = parser.parse_args()
+
+    rules = [] if args.no_fabric else compile_rules(load_fabric(args.fabric), aggregate=args.aggregate)
+    for path in args.rules:
+        rules += load_rules(path)
+    rules, _ = unique_rules(rules)
+    start = time.perf_counter()
+    store, findings = check_rules(rules)
+    elapsed = time.perf_counter() - start
+    print_findings(findings, args.limit)
+    print(f"Checked {len(store)} rules on {len(store.tables)} tables in {elapsed * 1000:.1f} ms")
+    sys.exit(1 if any(finding.is_error for finding in findings) else 0)
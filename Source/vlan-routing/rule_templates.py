@@ -0,0 +1,148 @@
+import json
+import re
+from functools import lru_cache
+
+from flow_rules import (
+    build_arp_punt,
+    build_arp_responder,
+    build_ingress_rule,
+    build_intra_switch_route,
+    build_l2_local_forwarding,
+    build_l2_uplink,
+    build_l3_uplink,
+    build_leaf_delivery,
+    build_leaf_transit,
+    build_spine_forwarding,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Precompiled rule templates for large pushes. The flow_rules.py builders make a
+# fresh nested dict per rule and json.dumps serialises it again; at a million
+# rules that is most of the CPU time and a couple of GB of dicts. Here every rule
+# kind is serialised once, with placeholders where its arguments go, and a rule
+# is a "spec": a flat tuple (template, encoded argument, ...). Specs share their
+# argument strings, hash cheaply (so duplicates drop with a dict) and render
+# straight into the text of a bulk POST /onos/v1/flows body.
+#
+# The templates are made by calling the real builders with marker arguments, so
+# they can't drift from flow_rules.py: a rendered spec is the builder's rule,
+# byte for byte as dumps() would write it.
+
+# JSON text of `obj`, compact. orjson when installed (several times faster), json otherwise.
+if orjson:
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+else:
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+MARKER = re.compile(r'"@@(\w+)@@"')
+
+class RuleTemplate:
+    def __init__(self, name, build, params):
+        self.name = name
+        self.params = params
+        text = json.dumps(build(*(f'@@{param}@@' for param in params)), separators=(',', ':'))
+        # Literal JSON between the markers, braces escaped for str.format; argument i
+        # of the builder is field {i + 1}, since field 0 is the template itself
+        pieces = MARKER.split(text)
+        self.text = ''.join(
+            piece.replace('{', '{{').replace('}', '}}') if i % 2 == 0 else f'{{{params.index(piece) + 1}}}'
+            for i, piece in enumerate(pieces)
+        )
+
+    def __repr__(self):
+        return f'RuleTemplate({self.name})'
+
+    def spec(self, *args):
+        return (self, *map(encode, args))
+
+# JSON text of one argument value. Arguments repeat a lot (device IDs, MACs, ports),
+# so recent values are encoded once; bounded, as a long-running process compiles
+# many fabrics. typed, so 1, 1.0 and True keep their own JSON.
+ENCODE_CACHE = 1 << 16
+
+@lru_cache(maxsize=ENCODE_CACHE, typed=True)
+def encode(value):
+    return dumps(value)
+
+TEMPLATES = {template.name: template for template in (
+    RuleTemplate("arp_punt", build_arp_punt, ("device_id",)),
+    RuleTemplate("arp_responder", build_arp_responder, ("device_id", "vlan_id", "ip", "mac")),
+    RuleTemplate("ingress", build_ingress_rule, ("device_id", "host_port", "vlan_id")),
+    RuleTemplate("l2_local", build_l2_local_forwarding, ("device_id", "dst_mac", "vlan_id", "out_port")),
+    RuleTemplate("intra_switch", build_intra_switch_route,
+                 ("device_id", "src_vlan", "dst_ip", "dst_mac", "dst_vlan", "out_port")),
+    RuleTemplate("l2_uplink", build_l2_uplink, ("src_leaf_id", "dst_mac", "vlan_id", "src_uplink")),
+    RuleTemplate("l3_uplink", build_l3_uplink,
+                 ("src_leaf_id", "src_vlan", "dst_vlan", "dst_ip", "dst_mac", "src_uplink")),
+    RuleTemplate("spine", build_spine_forwarding, ("spine_id", "dst_mac", "spine_downlink")),
+    RuleTemplate("leaf_delivery", build_leaf_delivery, ("dst_leaf_id", "dst_mac", "vlan_id", "dst_host_port")),
+    RuleTemplate("leaf_transit", build_leaf_transit, ("device_id", "dst_mac", "vlan_id", "out_port")),
+)}
+(ARP_PUNT, ARP_RESPONDER, INGRESS, L2_LOCAL, INTRA_SWITCH, L2_UPLINK, L3_UPLINK, SPINE, LEAF_DELIVERY,
+ LEAF_TRANSIT) = TEMPLATES.values()
+
+
+# --- SPEC BUILDERS ---
+# Same signatures as fabric.RULE_BUILDERS, returning specs instead of dicts:
+#   compile_rules(fabric, builders=SPEC_BUILDERS)
+
+def l2_remote_specs(src_leaf_id, dst_leaf_id, spine_id, dst_mac, vlan_id, src_uplink, spine_downlink, dst_host_port):
+    return [
+        L2_UPLINK.spec(src_leaf_id, dst_mac, vlan_id, src_uplink),
+        SPINE.spec(spine_id, dst_mac, spine_downlink),
+        LEAF_DELIVERY.spec(dst_leaf_id, dst_mac, vlan_id, dst_host_port),
+    ]
+
+def l3_remote_specs(src_leaf_id, dst_leaf_id, spine_id, src_vlan, dst_vlan, dst_ip, dst_mac,
+                    src_uplink, spine_downlink, dst_host_port):
+    return [
+        L3_UPLINK.spec(src_leaf_id, src_vlan, dst_vlan, dst_ip, dst_mac, src_uplink),
+        SPINE.spec(spine_id, dst_mac, spine_downlink),
+        LEAF_DELIVERY.spec(dst_leaf_id, dst_mac, dst_vlan, dst_host_port),
+    ]
+
+def intra_switch_spec(device_id, src_vlan, dst_ip, dst_mac, dst_vlan, out_port):
+    return INTRA_SWITCH.spec(device_id, src_vlan, dst_ip, dst_mac, dst_vlan, out_port)
+
+SPEC_BUILDERS = {
+    "arp_punt": ARP_PUNT.spec,
+    "arp_responder": ARP_RESPONDER.spec,
+    "ingress": INGRESS.spec,
+    "l2_local": L2_LOCAL.spec,
+    "intra_switch": intra_switch_spec,
+    "l2_remote": l2_remote_specs,
+    "l3_remote": l3_remote_specs,
+    "l2_uplink": L2_UPLINK.spec,
+    "l3_uplink": L3_UPLINK.spec,
+    "transit": SPINE.spec,
+    "leaf_transit": LEAF_TRANSIT.spec,
+    "leaf_delivery": LEAF_DELIVERY.spec,
+}
+
+# Drop repeated specs, keeping the first (unique_rules() for specs)
+def unique_specs(specs):
+    unique = list(dict.fromkeys(specs))
+    return unique, len(specs) - len(unique)
+
+
+# --- RENDERING ---
+def render(spec):
+    return spec[0].text.format(*spec)
+
+# The rule as a dict, e.g. for describe_rule() or the rule checks
+def spec_rule(spec):
+    return json.loads(render(spec))
+
+# Every template's first argument is the device ID, a plain string JSON only quotes
+def spec_device(spec):
+    return spec[1][1:-1]
+
+# Bulk POST /onos/v1/flows body for a batch of specs, as one string
+def render_body(specs):
+    return '{"flows":[' + ','.join([spec[0].text.format(*spec) for spec in specs]) + ']}'
@@ -0,0 +1,223 @@
+import argparse
+import gzip
+import hashlib
+import json
+import sys
+import time
+
+from flow_rules import describe_group, describe_rule, rule_key, treatment_key
+from metrics import METRICS
+from onos_client import AUTH, OnosClient, add_onos_argument
+from provisioning import (
+    BATCH_SIZE, WORKERS, push_groups, push_parallel, push_serial, report_groups, report_results
+)
+
+# Snapshots of the compiled rule set, for restoring ONOS after a restart without
+# recompiling and for seeing what changed between two pushes
+# (configure-onos-router.py --snapshot FILE writes one per push).
+#
+# A snapshot has one section per device with its flows and groups, each sorted
+# by what identifies it (rule_key() / group ID) and without the repeated
+# deviceId. Every section carries the SHA-256 of its canonical JSON, and the
+# snapshot the hash of all sections, so identical rule sets have identical
+# hashes however they were compiled, a diff skips unchanged devices, and a
+# damaged file is refused. The file is gzip'd JSON (written with a zero mtime,
+# so the same snapshot gives the same bytes), or MessagePack when the name ends
+# in .msgpack (needs msgpack).
+
+FORMAT = 'vlan-routing-snapshot'
+VERSION = 1
+
+def canonical(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+def digest(obj):
+    return hashlib.sha256(canonical(obj).encode()).hexdigest()
+
+# --- BUILDING ---
+# source: what the rules were compiled from (fabric file, options), kept for reference only
+def build_snapshot(rules, groups=(), source=None):
+    devices = {}
+    for rule in rules:
+        devices.setdefault(rule["deviceId"], {"flows": [], "groups": []})["flows"].append(
+            {k: v for k, v in rule.items() if k != "deviceId"})
+    for group in groups:
+        devices.setdefault(group["deviceId"], {"flows": [], "groups": []})["groups"].append(
+            {k: v for k, v in group.items() if k != "deviceId"})
+    for device_id, section in devices.items():
+        section["flows"].sort(key=lambda flow: canonical(rule_key(dict(flow, deviceId=device_id))))
+        section["groups"].sort(key=lambda group: group["groupId"])
+        section["hash"] = digest({"flows": section["flows"], "groups": section["groups"]})
+    devices = dict(sorted(devices.items()))
+    return {
+        "format": FORMAT,
+        "version": VERSION,
+        "created": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "source": source or {},
+        "hash": digest({device_id: section["hash"] for device_id, section in devices.items()}),
+        "devices": devices,
+    }
+
+def flows_of(snapshot):
+    return [dict(flow, deviceId=device_id) for device_id, section in snapshot["devices"].items()
+            for flow in section["flows"]]
+
+def groups_of(snapshot):
+    return [dict(group, deviceId=device_id) for device_id, section in snapshot["devices"].items()
+            for group in section["groups"]]
+
+# Recomputes every hash; raises ValueError on the first mismatch
+def verify(snapshot):
+    if snapshot.get("format") != FORMAT or snapshot.get("version") != VERSION:
+        raise ValueError(f"not a version {VERSION} {FORMAT} file")
+    for device_id, section in snapshot["devices"].items():
+        if digest({"flows": section["flows"], "groups": section["groups"]}) != section["hash"]:
+            raise ValueError(f"section {device_id} does not match its hash")
+    if digest({device_id: section["hash"] for device_id, section in snapshot["devices"].items()}) != snapshot["hash"]:
+        raise ValueError("device sections do not match the snapshot hash")
+
+
+# --- FILES ---
+def msgpack_module():
+    try:
+        import msgpack
+    except ImportError:
+        raise RuntimeError("msgpack is required for .msgpack snapshots: pip install msgpack")
+    return msgpack
+
+def save_snapshot(snapshot, path):
+    if path.endswith('.msgpack'):
+        data = msgpack_module().packb(snapshot, use_bin_type=True)
+    else:
+        data = gzip.compress(canonical(snapshot).encode(), mtime=0)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+def load_snapshot(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith('.msgpack'):
+        snapshot = msgpack_module().unpackb(data, raw=False)
+    else:
+        snapshot = json.loads(gzip.decompress(data))
+    verify(snapshot)
+    return snapshot
+
+
+# --- DIFF ---
+# {device_id: (added, removed, changed)}, changed being (old, new) pairs; flows and
+# groups mixed, unchanged devices left out
+def diff_snapshots(old, new):
+    changes = {}
+    for device_id in sorted(set(old["devices"]) | set(new["devices"])):
+        before = old["devices"].get(device_id, {"flows": [], "groups": [], "hash": None})
+        after = new["devices"].get(device_id, {"flows": [], "groups": [], "hash": None})
+        if before["hash"] == after["hash"]:
+            continue
+        added, removed, changed = [], [], []
+        for kind, key, same in (("flows", lambda e: rule_key(dict(e, deviceId=device_id)),
+                                 lambda a, b: treatment_key(a) == treatment_key(b)),
+                                ("groups", lambda e: e["groupId"], lambda a, b: a == b)):
+            old_entries = {key(e): dict(e, deviceId=device_id) for e in before[kind]}
+            new_entries = {key(e): dict(e, deviceId=device_id) for e in after[kind]}
+            added += [e for k, e in new_entries.items() if k not in old_entries]
+            removed += [e for k, e in old_entries.items() if k not in new_entries]
+            changed += [(old_entries[k], e) for k, e in new_entries.items()
+                        if k in old_entries and not same(old_entries[k], e)]
+        changes[device_id] = (added, removed, changed)
+    return changes
+
+def describe_entry(entry):
+    return describe_group(entry) if "buckets" in entry else describe_rule(entry)
+
+def describe_treatment(rule):
+    return ", ".join(
+        f"{i.get('subtype', i['type'])}={next((v for k, v in i.items() if k not in ('type', 'subtype')), '')}"
+        for i in rule["treatment"]["instructions"]
+    )
+
+def print_diff(changes):
+    for device_id, (added, removed, changed) in changes.items():
+        for entry in added:
+            print(f" + {describe_entry(entry)}")
+        for entry in removed:
+            print(f" - {describe_entry(entry)}")
+        for before, after in changed:
+            if "buckets" in after:
+                print(f" ~ {describe_group(after)}")
+            else:
+                print(f" ~ {describe_rule(after)}: {describe_treatment(before)} -> {describe_treatment(after)}")
+    for device_id, (added, removed, changed) in changes.items():
+        print(f"{device_id}: {len(added)} added, {len(removed)} removed, {len(changed)} changed")
+
+
+# --- RESTORE ---
+# Groups first (flows pointing at a missing group stay pending), then every flow in bulk.
+# Returns the flow push results, {device_id: ([(rule, flowId)], [(rule, error)])}.
+def restore_snapshot(client, snapshot, batch_size=BATCH_SIZE, parallel=False, workers=WORKERS):
+    groups = groups_of(snapshot)
+    if groups:
+        installed, failed = push_groups(client, groups)
+        report_groups(installed, failed)
+        if failed:
+            raise RuntimeError(f"{len(failed)} groups could not be installed, not pushing the flows that use them")
+    rules = flows_of(snapshot)
+    if parallel:
+        results = push_parallel(client, rules, batch_size, workers)
+    else:
+        results = push_serial(client, rules, batch_size)
+    report_results(results)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect, compare and restore rule set snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="check a snapshot's hashes and summarise it")
+    show.add_argument("file")
+    diff = commands.add_parser("diff", help="what changed between two snapshots (exit code 1 if anything)")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    restore = commands.add_parser("restore", help="push a snapshot into ONOS as it is, without recompiling")
+    restore.add_argument("file")
+    restore.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rules per bulk POST /onos/v1/flows call")
+    restore.add_argument("--parallel", action="store_true", help="push each device's rules concurrently")
+    restore.add_argument("--workers", type=int, default=WORKERS, help="max devices pushed at once in --parallel mode")
+    add_onos_argument(restore)
+    args = parser.parse_args()
+
+    try:
+        if args.command == "diff":
+            old, new = load_snapshot(args.old), load_snapshot(args.new)
+        else:
+            snapshot = load_snapshot(args.file)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f" [FAIL] {e}")
+
+    if args.command == "show":
+        flows, groups = len(flows_of(snapshot)), len(groups_of(snapshot))
+        print(f"{args.file}: {flows} flows, {groups} groups on {len(snapshot['devices'])} devices, "
+              f"created {snapshot['created']}, hash {snapshot['hash'][:16]}")
+        for key, value in snapshot["source"].items():
+            print(f"  {key}: {value}")
+        for device_id, section in snapshot["devices"].items():
+            print(f"  {device_id}: {len(section['flows'])} flows, {len(section['groups'])} groups, "
+                  f"hash {section['hash'][:16]}")
+    elif args.command == "diff":
+        if old["hash"] == new["hash"]:
+            print(f"Identical rule sets (hash {new['hash'][:16]})")
+            sys.exit(0)
+        changes = diff_snapshots(old, new)
+        print_diff(changes)
+        sys.exit(1)
+    else:
+        METRICS.verbose = False
+        start = time.perf_counter()
+        with OnosClient(*args.onos, AUTH) as client:
+            results = restore_snapshot(client, snapshot, args.batch_size, args.parallel, args.workers)
+        installed = sum(len(ok) for ok, _ in results.values())
+        failed = sum(len(bad) for _, bad in results.values())
+        print(f"Restored {installed} flow rules ({failed} failed) from snapshot {snapshot['hash'][:16]} "
+              f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+        sys.exit(1 if failed else 0)
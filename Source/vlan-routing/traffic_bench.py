@@ -0,0 +1,182 @@
+import json
+import math
+import platform
+import random
+import re
+import time
+
+from mininet.log import info
+
+# Non-interactive data-plane benchmark for a started Mininet fabric
+# (vlan-routing.py --bench, TopoWithRedundancy.py --bench). Host pairs are
+# grouped by the path their packets take through the compiled rules:
+#   l2_local   same leaf, same VLAN    (bridged on the leaf)
+#   l3_local   same leaf, other VLAN   (intra-switch route: MAC + VLAN rewrite)
+#   l2_remote  other leaf, same VLAN   (bridged over a spine)
+#   l3_remote  other leaf, other VLAN  (routed on the source leaf, then over a spine)
+# Every selected pair pings at the same time, then each class runs TCP and UDP
+# iperf over its pairs (the pairs of one class in parallel, classes one after
+# the other so they don't share the links). Latency, loss and throughput
+# percentiles per class go to a JSON report.
+
+PAIR_CLASSES = ("l2_local", "l3_local", "l2_remote", "l3_remote")
+PING_RTT = re.compile(r'time=([\d.]+) ms')
+PING_SUMMARY = re.compile(r'(\d+) packets transmitted, (\d+) received')
+
+def pair_class(src, dst):
+    return ('l2' if src.vlan == dst.vlan else 'l3') + ('_local' if src.switch == dst.switch else '_remote')
+
+# class -> [(src, dst)], at most `per_class` pairs per class (0: all), sampled with `seed`
+def host_pairs(fabric, per_class=0, seed=0):
+    pairs = {name: [] for name in PAIR_CLASSES}
+    hosts = list(fabric.hosts.values())
+    for src in hosts:
+        for dst in hosts:
+            if src is not dst:
+                pairs[pair_class(src, dst)].append((src, dst))
+    rng = random.Random(seed)
+    return {name: (rng.sample(found, per_class) if 0 < per_class < len(found) else found)
+            for name, found in pairs.items() if found}
+
+# Nearest-rank percentiles plus min/mean/max, rounded for the report
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    summary = {f"p{p}": round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)], 3) for p in points}
+    summary.update(min=round(ordered[0], 3), mean=round(sum(ordered) / len(ordered), 3), max=round(ordered[-1], 3))
+    return summary
+
+
+# --- PING ---
+# Every pair of every class pings at once. Returns class -> sent/received/loss and RTT percentiles.
+def ping_all(net, pairs, count, interval):
+    running = []
+    for name, class_pairs in pairs.items():
+        for src, dst in class_pairs:
+            command = ['ping', '-n', '-c', str(count), '-i', str(interval), '-W', '1', dst.ip]
+            running.append((name, net.get(src.name).popen(command)))
+    results = {name: {"pairs": len(class_pairs), "sent": 0, "received": 0, "rtts": []}
+               for name, class_pairs in pairs.items()}
+    for name, ping in running:
+        output = ping.communicate()[0].decode()
+        summary = PING_SUMMARY.search(output)
+        result = results[name]
+        result["sent"] += int(summary.group(1)) if summary else count
+        result["received"] += int(summary.group(2)) if summary else 0
+        result["rtts"] += [float(rtt) for rtt in PING_RTT.findall(output)]
+    for result in results.values():
+        rtts = result.pop("rtts")
+        result["loss_pct"] = round(100.0 * (result["sent"] - result["received"]) / max(1, result["sent"]), 2)
+        result["rtt_ms"] = percentiles(rtts)
+    return results
+
+
+# --- IPERF ---
+# iperf 2 with -y C prints CSV: field 8 is bits/s; a UDP client also prints the
+# server's report, which adds jitter (ms), lost and total datagrams.
+def parse_iperf(output, udp):
+    lines = [line.split(',') for line in output.splitlines() if line.count(',') >= 8]
+    if udp:
+        reports = [fields for fields in lines if len(fields) >= 12]
+        if not reports:
+            return None
+        fields = reports[-1]
+        lost, total = int(fields[10]), int(fields[11])
+        return {"mbps": float(fields[8]) / 1e6, "jitter_ms": float(fields[9]),
+                "loss_pct": 100.0 * lost / total if total else 100.0}
+    return {"mbps": float(lines[-1][8]) / 1e6} if lines else None
+
+# The pairs of one class at the same time. Returns per-pair results (None when iperf got no answer).
+def iperf_class(net, class_pairs, seconds, udp, udp_rate):
+    running = []
+    for src, dst in class_pairs:
+        command = ['iperf', '-c', dst.ip, '-t', str(seconds), '-y', 'C']
+        if udp:
+            command += ['-u', '-b', udp_rate]
+        running.append(net.get(src.name).popen(command))
+    return [parse_iperf(client.communicate()[0].decode(), udp) for client in running]
+
+def iperf_all(net, pairs, seconds, udp_rate):
+    servers = []
+    for name in sorted({dst.name for class_pairs in pairs.values() for _, dst in class_pairs}):
+        servers.append(net.get(name).popen(['iperf', '-s']))
+        servers.append(net.get(name).popen(['iperf', '-s', '-u']))
+    time.sleep(1)
+    results = {}
+    try:
+        for name, class_pairs in pairs.items():
+            results[name] = {}
+            for protocol in ("tcp", "udp"):
+                info(f'*** iperf {protocol} {name}: {len(class_pairs)} pairs for {seconds}s\n')
+                measured = iperf_class(net, class_pairs, seconds, protocol == "udp", udp_rate)
+                answered = [m for m in measured if m]
+                summary = {"pairs": len(class_pairs), "failed": len(measured) - len(answered),
+                           "mbps": dict(percentiles([m["mbps"] for m in answered]),
+                                        sum=round(sum(m["mbps"] for m in answered), 3))}
+                if protocol == "udp":
+                    summary["jitter_ms"] = percentiles([m["jitter_ms"] for m in answered])
+                    summary["loss_pct"] = percentiles([m["loss_pct"] for m in answered])
+                results[name][protocol] = summary
+    finally:
+        for server in servers:
+            server.terminate()
+    return results
+
+
+# --- HARNESS ---
+# Shared options of vlan-routing.py and TopoWithRedundancy.py
+def add_arguments(parser):
+    group = parser.add_argument_group("benchmark (--bench)")
+    group.add_argument("--bench", metavar="FILE",
+                       help="run the ping/iperf benchmark instead of the CLI and write the results to FILE")
+    group.add_argument("--standin", action="store_true",
+                       help="no ONOS: write the compiled rules (with ARP responders) straight into the switches "
+                            "(also without --bench)")
+    group.add_argument("--ping-count", type=int, default=20, help="pings per pair")
+    group.add_argument("--ping-interval", type=float, default=0.2, help="seconds between pings")
+    group.add_argument("--ping-pairs", type=int, default=50, help="pairs pinged per class (0: all)")
+    group.add_argument("--iperf-seconds", type=int, default=5, help="length of each iperf run")
+    group.add_argument("--iperf-pairs", type=int, default=2, help="pairs measured with iperf per class (0: all)")
+    group.add_argument("--no-iperf", action="store_true", help="ping only")
+    group.add_argument("--udp-rate", default="50M", help="UDP iperf send rate per pair")
+    group.add_argument("--seed", type=int, default=0, help="seed for picking the pairs")
+
+# Warm up (ARP, first packets), run ping and iperf, write the report. Returns it.
+def run_benchmark(net, fabric, args, topology):
+    ping_pairs = host_pairs(fabric, args.ping_pairs, args.seed)
+    iperf_pairs = host_pairs(fabric, args.iperf_pairs, args.seed)
+    info('*** Warming up: one ping per pair\n')
+    ping_all(net, ping_pairs, 1, args.ping_interval)
+
+    start = time.perf_counter()
+    info(f'*** Pinging {sum(len(p) for p in ping_pairs.values())} pairs, {args.ping_count} pings each\n')
+    ping = ping_all(net, ping_pairs, args.ping_count, args.ping_interval)
+    iperf = {} if args.no_iperf else iperf_all(net, iperf_pairs, args.iperf_seconds, args.udp_rate)
+    report = {
+        "topology": topology,
+        "python": platform.python_version(),
+        "hosts": len(fabric.hosts),
+        "switches": len(fabric.switches),
+        "standin_controller": args.standin,
+        "settings": {name: getattr(args, name) for name in (
+            "ping_count", "ping_interval", "ping_pairs", "iperf_seconds", "iperf_pairs", "udp_rate", "seed")},
+        "seconds": round(time.perf_counter() - start, 1),
+        "classes": {name: dict(ping=ping[name], **iperf.get(name, {})) for name in ping},
+    }
+    print_report(report)
+    with open(args.bench, 'w') as f:
+        json.dump(report, f, indent=2)
+    info(f'*** Benchmark results written to {args.bench}\n')
+    return report
+
+def print_report(report):
+    print(f"{'class':<10} {'pairs':>5} {'loss %':>7} {'rtt p50':>8} {'rtt p99':>8} "
+          f"{'tcp p50':>8} {'udp p50':>8} {'udp loss':>8}")
+    for name, result in report["classes"].items():
+        ping = result["ping"]
+        tcp = result.get("tcp", {}).get("mbps", {})
+        udp = result.get("udp", {})
+        print(f"{name:<10} {ping['pairs']:>5} {ping['loss_pct']:>7} {ping['rtt_ms'].get('p50', '-'):>8} "
+              f"{ping['rtt_ms'].get('p99', '-'):>8} {tcp.get('p50', '-'):>8} "
+              f"{udp.get('mbps', {}).get('p50', '-'):>8} {udp.get('loss_pct', {}).get('p50', '-'):>8}")
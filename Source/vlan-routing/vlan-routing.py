@@ -1,12 +1,29 @@
 #Importing necessary libraries
+import argparse
+import inspect
+import os
+import sys
+import time
+from functools import partial
 from mininet.net import Mininet # For mininet topo
-from mininet.node import RemoteController # For connecting to ONOS
+from mininet.node import RemoteController, OVSSwitch # For connecting to ONOS
 from mininet.topo import Topo
 from mininet.link import TCLink #Traffic-Control Link, can be used for bandwidth control and many more
 from mininet.cli import CLI
 from mininet.log import setLogLevel, info
 
-# Our topology will look like this
+# fabric.py and the other vlan-routing modules sit next to this file. mn --custom
+# execs it without __file__ and without its directory on sys.path, but the code
+# object still carries the file name.
+HERE = os.path.dirname(os.path.abspath(inspect.currentframe().f_code.co_filename))
+if HERE not in sys.path:
+    sys.path.insert(0, HERE)
+
+import ovs_rules
+import traffic_bench
+from fabric import FABRIC_FILE, generate_fabric, load_fabric, save_fabric
+
+# Our topology (as described in fabric.json) will look like this
 """
         s0a
       /  |   \
@@ -21,81 +38,133 @@ ha1 ha2 hb1 hb2 hc1 hc2
 # ha1, hb1, hc1 will be from 10.0.10.0/24
 # ha2, hb2, hc2 will be from 10.0.20.0/24
 
+# Same host as onos_client.ONOS_IP; mn --custom loads this file on its own, so it isn't imported from there
 ONOS_IP='172.17.0.5'
 ONOS_OF_PORT=6653
 
 class VlanRoutingTopo(Topo):
-    def __init__(self, **opts):
+    # batch_setup: leave host addressing to setup_hosts() (one shell call per host)
+    # instead of Mininet's per-parameter ifconfig/route calls
+    def __init__(self, fabric=None, batch_setup=False, **opts):
         super( VlanRoutingTopo, self ).__init__(**opts)
-	
-        # To ensure all five switches show up in ONOS GUI, assign a unique ID when adding switches
-        # Central switches (s0a, s0b)
-        s0a = self.addSwitch('s0a', dpid='0000000000000001')
-        #s0b = self.addSwitch('s0b', dpid='0000000000000002')
-
-        #Leaf switches (sa1, sb1, sc1)
-        sa1 = self.addSwitch('sa1', dpid='0000000000000003')
-        sb1 = self.addSwitch('sb1', dpid='0000000000000004')
-        sc1 = self.addSwitch('sc1', dpid='0000000000000005')
-
-        #Hosts (ha1, ha2, hb1, hb2, hc1, hc2)
-        ha1 = self.addHost('ha1', ip = '10.0.10.11/24', mac='00:00:00:00:01:01', defaultRoute='via 10.0.10.1')
-        ha2 = self.addHost('ha2', ip = '10.0.20.11/24', mac='00:00:00:00:02:01', defaultRoute='via 10.0.20.1')
-        hb1 = self.addHost('hb1', ip = '10.0.10.12/24', mac='00:00:00:00:01:02', defaultRoute='via 10.0.10.1')	
-        hb2 = self.addHost('hb2', ip = '10.0.20.12/24', mac='00:00:00:00:02:02', defaultRoute='via 10.0.20.1')
-        hc1 = self.addHost('hc1', ip = '10.0.10.13/24', mac='00:00:00:00:01:03', defaultRoute='via 10.0.10.1')
-        hc2 = self.addHost('hc2', ip = '10.0.20.13/24', mac='00:00:00:00:02:03', defaultRoute='via 10.0.20.1')
-
-        #Main links
-        # Central switches links
-        #self.addLink(s0a, s0b, port1=1, port2=1)#, cls = TCLink, bw = 100)
-        # Central switch to branch switches
-        self.addLink(s0a, sa1, port1=2, port2=1)#, cls = TCLink, bw = 100)
-        self.addLink(s0a, sb1, port1=3, port2=1)#, cls = TCLink, bw = 100)
-        self.addLink(s0a, sc1, port1=4, port2=1)#, cls = TCLink, bw = 100)
-        #sa1 to hosts
-        self.addLink(sa1, ha1, port1=2, port2=1)#, cls = TCLink, bw = 100)	
-        self.addLink(sa1, ha2, port1=3, port2=1)#, cls = TCLink, bw = 100)
-        #sb1 to hosts
-        self.addLink(sb1, hb1, port1=2, port2=1)#, cls = TCLink, bw = 100)	
-        self.addLink(sb1, hb2, port1=3, port2=1)#, cls = TCLink, bw = 100)	
-        #sc1 to hosts
-        self.addLink(sc1, hc1, port1=2, port2=1)#, cls = TCLink, bw = 100)
-        self.addLink(sc1, hc2, port1=3, port2=1)#, cls = TCLink, bw = 100)
-        #Backup links
-        #self.addLink(s0b, sa1, port1=2, port2=4)#, cls = TCLink, bw = 50)
-        #self.addLink(s0b, sb1, port1=3, port2=4)#, cls = TCLink, bw = 50)
-        #self.addLink(s0b, sc1, port1=4, port2=4)#, cls = TCLink, bw = 50)
+        # Switches, hosts and ports all come from the fabric description (fabric.json),
+        # the same one configure-onos-router.py compiles the flow rules from
+        self.fabric = fabric or load_fabric()
 
-# This function will be used to run our defined topo
-def run():
-    setLogLevel('info')
-    topo = VlanRoutingTopo()
-    onos_ctrl = RemoteController('c0', ip=ONOS_IP, port=ONOS_OF_PORT)
-    net = Mininet(topo=topo, controller=onos_ctrl, link=TCLink, autoSetMacs=False)
-    
+        # To ensure all switches show up in ONOS GUI, assign a unique ID when adding switches
+        for switch in self.fabric.switches.values():
+            self.addSwitch(switch.name, dpid=switch.dpid)
+
+        for host in self.fabric.hosts.values():
+            if batch_setup:
+                self.addHost(host.name, ip=None, mac=None)
+            else:
+                gateway = self.fabric.vlans[host.vlan].gateway
+                self.addHost(host.name, ip=self.fabric.host_cidr(host), mac=host.mac, defaultRoute=f'via {gateway}')
+
+        # Spine <-> leaf links
+        for link in self.fabric.links:
+            self.addLink(link.node1, link.node2, port1=link.port1, port2=link.port2)#, cls = TCLink, bw = 100)
+        # Leaf <-> host links, in batch mode the host MAC is set when the veth pair is created
+        for host in self.fabric.hosts.values():
+            mac_opts = {'addr2': host.mac} if batch_setup else {}
+            self.addLink(host.switch, host.name, port1=host.port, port2=1, **mac_opts)#, cls = TCLink, bw = 100)
+
+# Address, default route and static gateway ARP for every host, as one chained
+# command per host. All commands are sent before any answer is read, so the
+# per-host shell round trips overlap instead of adding up.
+# static_arp=False leaves ARP to the leaves (configure-onos-router.py --arp-proxy).
+def setup_hosts(net, fabric, static_arp=True):
+    pending = []
+    for host in fabric.hosts.values():
+        node = net.get(host.name)
+        intf = node.defaultIntf()
+        gateway = fabric.vlans[host.vlan].gateway
+        commands = [
+            f'ip addr add {fabric.host_cidr(host)} dev {intf}',
+            f'ip route add default via {gateway}'
+        ]
+        if static_arp:
+            # STATIC ARP SO THAT PACKETS CAN GO TO THE LEAF SWITCHES FIRST, USING A DUMMY MAC 00:00:00:00:00:99
+            commands.append(f'arp -s {gateway} {fabric.router_mac}')
+        node.sendCmd(' && '.join(commands))
+        pending.append((node, intf, host))
+    for node, intf, host in pending:
+        output = node.waitOutput()
+        if output.strip():
+            info(f'*** {host.name}: {output}')
+        # Keep Mininet's own view (used by ping/iperf helpers) in sync, no shell call needed
+        intf.ip, intf.prefixLen = host.ip, int(fabric.host_cidr(host).split('/')[1])
+
+# Build, start and address the network, timing each phase. Returns the started net.
+# standin=True: no ONOS, the compiled rules are written into the switches directly (ovs_rules.py).
+def start_network(fabric, static_arp=True, standin=False):
+    phases = {}
+    start = time.perf_counter()
+    topo = VlanRoutingTopo(fabric, batch_setup=True)
+    if standin:
+        switch = partial(OVSSwitch, protocols='OpenFlow13', failMode='secure')
+        net = Mininet(topo=topo, controller=None, switch=switch, link=TCLink, autoSetMacs=False, build=False)
+    else:
+        onos_ctrl = RemoteController('c0', ip=ONOS_IP, port=ONOS_OF_PORT)
+        net = Mininet(topo=topo, controller=onos_ctrl, link=TCLink, autoSetMacs=False, build=False)
+    phases['topology'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    net.build()
+    phases['build'] = time.perf_counter() - start
+
+    start = time.perf_counter()
     net.start()
+    phases['start'] = time.perf_counter() - start
+
+    info('*** Setting up host addresses, routes%s\n' % (' and static ARP for gateways' if static_arp else ''))
+    start = time.perf_counter()
+    setup_hosts(net, fabric, static_arp)
+    phases['host setup'] = time.perf_counter() - start
+
+    if standin:
+        start = time.perf_counter()
+        groups, flows = ovs_rules.install(net, fabric)
+        info(f'*** Stand-in controller installed {groups} groups and {flows} flows\n')
+        phases['rules'] = time.perf_counter() - start
 
-    info('*** Setting up Static ARP for Gateways\n')
-    ha1 = net.get('ha1')
-    ha2 = net.get('ha2')
-    hb1 = net.get('hb1')
-    hb2 = net.get('hb2')
-    hc1 = net.get('hc1')
-    hc2 = net.get('hc2')
-
-    # STATIC ARP SO THAT PACKETS CAN GO TO THE LEAF SWITCHES FIRST, USING A DUMMY MAC 00:00:00:00:00:99
-    ha1.cmd('arp -s 10.0.10.1 00:00:00:00:00:99')
-    ha2.cmd('arp -s 10.0.20.1 00:00:00:00:00:99')
-    hb1.cmd('arp -s 10.0.10.1 00:00:00:00:00:99')
-    hb2.cmd('arp -s 10.0.20.1 00:00:00:00:00:99')
-    hc1.cmd('arp -s 10.0.10.1 00:00:00:00:00:99')
-    hc2.cmd('arp -s 10.0.20.1 00:00:00:00:00:99')
-
-    info('*** Network is up\n')
-    CLI(net)
-    net.stop()
+    info('*** Bring-up of %d switches, %d hosts: %s (total %.2fs)\n' % (
+        len(fabric.switches), len(fabric.hosts),
+        ', '.join(f'{name} {seconds:.2f}s' for name, seconds in phases.items()),
+        sum(phases.values())))
+    return net
+
+# This function will be used to run our defined topo
+# With bench (the parsed --bench options) it runs traffic_bench instead of the CLI.
+def run(fabric, static_arp=True, standin=False, bench=None):
+    setLogLevel('info')
+    net = start_network(fabric, static_arp, standin)
+    try:
+        info('*** Network is up\n')
+        if bench:
+            traffic_bench.run_benchmark(net, fabric, bench, topology='vlan-routing')
+        else:
+            CLI(net)
+    finally:
+        net.stop()
 
 if __name__ == '__main__':
-    run()
+    parser = argparse.ArgumentParser(description="Start the vlan-routing Mininet topology")
+    parser.add_argument("--fabric", default=FABRIC_FILE, help="fabric description (JSON or YAML)")
+    parser.add_argument("--leaves", type=int, help="generate a leaf-spine fabric with this many leaves instead")
+    parser.add_argument("--spines", type=int, default=1, help="spines of the generated fabric")
+    parser.add_argument("--hosts-per-leaf", type=int, default=2, help="hosts per leaf of the generated fabric")
+    parser.add_argument("--arp-proxy", action="store_true",
+                        help="no static gateway ARP on the hosts, the leaves answer ARP (configure-onos-router.py --arp-proxy)")
+    parser.add_argument("--save-fabric", help="write the fabric in use to this JSON file (for configure-onos-router.py --fabric)")
+    traffic_bench.add_arguments(parser)
+    args = parser.parse_args()
+    if args.leaves:
+        fabric = generate_fabric(spines=args.spines, leaves=args.leaves, hosts_per_leaf=args.hosts_per_leaf)
+    else:
+        fabric = load_fabric(args.fabric)
+    if args.save_fabric:
+        save_fabric(fabric, args.save_fabric)
+    run(fabric, static_arp=not args.arp_proxy, standin=args.standin, bench=args if args.bench else None)
 topos = { 'VlanRouting': ( lambda: VlanRoutingTopo() ) }